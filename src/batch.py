@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+from dotenv import load_dotenv
+
+from llms import QueryGenerator, ComplexQueryGenerator, TableToNaturalGenerator
+from interfaces import QueryTemplate, ComplexQueryTemplate, TableToNaturalTemplate
+from query_guard import QueryRejected
+from schema_cache import SchemaCache
+from schema_index import SchemaIndex
+from summarization import summarize_records
+from columnar import ColumnarResult
+from skeleton_cache import bind_arguments
+from config import (
+    ANALYSIS_TOKEN_BUDGET,
+    MAX_RESULT_ROWS,
+    SCHEMA_TOP_K,
+    make_engine,
+    make_rate_limiter,
+    make_response_cache,
+    save_workload_log,
+)
+from prompts import QUERY_SYSTEM_MESSAGE, ANALYSIS_SYSTEM_MESSAGE
+
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+CURRENT_DIR = os.path.dirname(__file__)
+dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+load_dotenv(dotenv_path)
+
+ANALYSIS_PROMPT = "Explain the data in the following data, considering the original question provided."
+PARAMETERS = {
+    "temperature": 0.0,
+    "top_p": 0.95,
+    "max_tokens": 2000,
+}
+
+
+def read_completed(output_path):
+    """
+    Ids already answered successfully in a previous run, so a restarted batch resumes where it
+    stopped. Failed questions are attempted again.
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if not result.get("error"):
+                completed.add(str(result["id"]))
+    return completed
+
+
+def read_questions(input_path, completed):
+    """
+    Questions of the input file not answered yet. Questions without an `id` get `line:<n>`, the
+    1-based line number, which cannot collide with the ids of the input. A line that is not a
+    JSON object is yielded as `{"id": "line:<n>", "error": ...}`, so it is reported in the output
+    instead of aborting the batch.
+    """
+    with open(input_path, "r", encoding="utf-8") as input_file:
+        for number, line in enumerate(input_file):
+            if not line.strip():
+                continue
+            try:
+                question = json.loads(line)
+                if not isinstance(question, dict):
+                    raise ValueError(f"Expected a JSON object, found {type(question).__name__}")
+            except ValueError as exc:
+                logger.error("Malformed input line %s: %s", number + 1, str(exc))
+                question = {"error": f"Malformed input line: {exc}"}
+            question.setdefault("id", f"line:{number + 1}")
+            if str(question["id"]) not in completed:
+                yield question
+
+
+class BatchRunner:
+    """
+    Runs JSONL questions through generate, execute and analyse with bounded concurrency.
+
+    Every worker shares the same generator clients and database pool. Results are appended to the
+    output file as soon as each question finishes, so a crashed run can be resumed with the same
+    arguments.
+
+    Input lines look like `{"id": 1, "question": "...", "complex": true, "db_params": {...}}`.
+    `db_params` defaults to the connected database and `complex` to false.
+
+    With `parameterized`, questions that only differ in their literals reuse one cached
+    parameterized query, and the literals are bound as query arguments.
+    """
+
+    def __init__(
+        self,
+        database_engine,
+        generators,
+        db_mapping,
+        concurrency=8,
+        max_rows=1000,
+        token_budget=3000,
+        parameterized=False,
+    ):
+        self.database_engine = database_engine
+        self.query_generator, self.complex_query_generator, self.analysis_generator = generators
+        self.db_mapping = db_mapping
+        self.concurrency = concurrency
+        self.max_rows = max_rows
+        self.token_budget = token_budget
+        self.parameterized = parameterized
+        self.latencies = []
+        self.errors = 0
+
+    def build_template(self, question):
+        db_params = question.get("db_params") or {
+            "database_name": self.database_engine.database,
+            "table_name": question.get("table_name", ""),
+        }
+        if question.get("complex"):
+            return self.complex_query_generator, ComplexQueryTemplate(
+                prompt=question["question"],
+                query_type="Postgres",
+                programming_language="SQL",
+                db_params=db_params,
+                db_mapping=self.db_mapping,
+            )
+        return self.query_generator, QueryTemplate(
+            prompt=question["question"],
+            query_type="Postgres",
+            programming_language="SQL",
+            db_params=db_params,
+        )
+
+    async def answer(self, question):
+        generator, template = self.build_template(question)
+        arguments = []
+        if self.parameterized:
+            sql, values = await generator.send_parameterized_request(template, PARAMETERS)
+            arguments = await bind_arguments(self.database_engine, sql, values)
+        else:
+            sql = await generator.send_request(template, PARAMETERS)  # type: ignore
+
+        async with self.database_engine.stream(
+            sql, *arguments, max_rows=self.max_rows, guarded=True, cached=True
+        ) as records:
+            rows = await ColumnarResult.from_stream(records)
+
+        analysis = await self.analysis_generator.send_request(
+            TableToNaturalTemplate(
+                prompt=question.get("analysis_prompt", ANALYSIS_PROMPT),
+                data=summarize_records(rows, token_budget=self.token_budget, truncated=rows.truncated),
+                original_prompt=template.prompt,
+            ),
+            PARAMETERS,
+        )
+        return {
+            "sql": sql,
+            "arguments": arguments,
+            "rows": len(rows),
+            "truncated": rows.truncated,
+            "analysis": analysis,
+        }
+
+    async def attempt(self, question):
+        if "error" in question:
+            self.errors += 1
+            return {"error": question["error"]}
+        try:
+            return await self.answer(question)
+        except QueryRejected as exc:
+            logger.error("Question %s rejected: %s", question["id"], str(exc))
+            self.errors += 1
+            return {"error": f"{type(exc).__name__}: {exc}", "rejection": exc.rejection.model_dump()}
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error("Question %s failed: %s", question["id"], str(exc))
+            self.errors += 1
+            return {"error": f"{type(exc).__name__}: {exc}"}
+
+    async def worker(self, queue, output_file):
+        while True:
+            question = await queue.get()
+            if question is None:
+                queue.task_done()
+                return
+
+            start = time.perf_counter()
+            result = await self.attempt(question)
+            latency = time.perf_counter() - start
+            self.latencies.append(latency)
+
+            output_file.write(
+                json.dumps({"id": question["id"], "latency": latency, **result}, default=str) + "\n"
+            )
+            output_file.flush()
+            queue.task_done()
+
+    async def run(self, input_path, output_path):
+        completed = read_completed(output_path)
+        logger.info("Skipping %s questions answered in a previous run", len(completed))
+
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        start = time.perf_counter()
+        with open(output_path, "a", encoding="utf-8") as output_file:
+            workers = [
+                asyncio.create_task(self.worker(queue, output_file)) for _ in range(self.concurrency)
+            ]
+            for question in read_questions(input_path, completed):
+                await queue.put(question)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed):
+        total = len(self.latencies)
+        latencies = sorted(self.latencies)
+        return {
+            "questions": total,
+            "errors": self.errors,
+            "error_rate": self.errors / total if total else 0.0,
+            "elapsed": elapsed,
+            "throughput": total / elapsed if elapsed else 0.0,
+            "latency_p50": statistics.median(latencies) if latencies else None,
+            "latency_p95": latencies[int(0.95 * (total - 1))] if latencies else None,
+        }
+
+
+async def run_batch(input_path, output_path, concurrency, pool_size, parameterized=False):
+    url: str = os.environ.get("GPT4V_URL", "")
+    key: str = os.environ.get("GPT4V_KEY", "")
+
+    database_engine = make_engine("postgres", pool_size=pool_size)
+    async with database_engine:
+        schema_cache = SchemaCache()
+        db_mapping = await schema_cache.get_tables(database_engine)
+        response_cache = make_response_cache()
+        rate_limiter = make_rate_limiter()
+
+        query_generator = QueryGenerator(
+            aistudio_url=url,
+            aistudio_key=key,
+            response_cache=response_cache,
+            schema_fingerprint=schema_cache.fingerprint,
+            rate_limiter=rate_limiter,
+        )
+        complex_query_generator = ComplexQueryGenerator(
+            aistudio_url=url,
+            aistudio_key=key,
+            schema_index=SchemaIndex(schema_cache.tables, top_k=SCHEMA_TOP_K),
+            response_cache=response_cache,
+            schema_fingerprint=schema_cache.fingerprint,
+            rate_limiter=rate_limiter,
+        )
+        analysis_generator = TableToNaturalGenerator(
+            aistudio_url=url, aistudio_key=key, rate_limiter=rate_limiter
+        )
+        query_generator.system_message = QUERY_SYSTEM_MESSAGE
+        complex_query_generator.system_message = QUERY_SYSTEM_MESSAGE
+        analysis_generator.system_message = ANALYSIS_SYSTEM_MESSAGE
+        generators = (query_generator, complex_query_generator, analysis_generator)
+
+        runner = BatchRunner(
+            database_engine,
+            generators,
+            db_mapping,
+            concurrency=concurrency,
+            max_rows=MAX_RESULT_ROWS,
+            token_budget=ANALYSIS_TOKEN_BUDGET,
+            parameterized=parameterized,
+        )
+        try:
+            return await runner.run(input_path, output_path)
+        finally:
+            for generator in generators:
+                await generator.close()
+            response_cache.close()
+            save_workload_log()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions.")
+    parser.add_argument("input", help="JSONL file with one question per line.")
+    parser.add_argument("output", help="JSONL file results are appended to.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument(
+        "--parameterized",
+        action="store_true",
+        help="Reuse parameterized queries for questions that only differ in their literals.",
+    )
+    arguments = parser.parse_args()
+    report = asyncio.run(
+        run_batch(
+            arguments.input,
+            arguments.output,
+            arguments.concurrency,
+            arguments.pool_size,
+            arguments.parameterized,
+        )
+    )
+    print(json.dumps(report, indent=2))
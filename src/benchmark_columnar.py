@@ -0,0 +1,156 @@
+import gc
+import json
+import time
+import random
+import asyncio
+import datetime
+import logging
+import argparse
+import tracemalloc
+
+from columnar import ColumnarResult
+from database import PostgresDatabase
+from result_cache import CachedRecord
+from summarization import summarize_records
+
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+BENCHMARK_QUERY = """
+SELECT
+    g AS purchase_id,
+    g % 5000 AS student_id,
+    'category_' || (g % 40) AS category_name,
+    round(random()::numeric * 100, 2)::float8 AS price,
+    DATE '2024-01-01' + (g % 365) AS purchase_date
+FROM generate_series(1, $1) AS g
+"""
+BATCH_SIZE = 500
+
+
+def synthetic_records(rows, seed=0):
+    """
+    Records shaped like the `BENCHMARK_QUERY` result, built as `CachedRecord`s, which are read
+    the same way as asyncpg records, so the benchmark runs without a database.
+    """
+    generator = random.Random(seed)
+    index = {
+        name: position
+        for position, name in enumerate(
+            ("purchase_id", "student_id", "category_name", "price", "purchase_date")
+        )
+    }
+    start = datetime.date(2024, 1, 1)
+    return [
+        CachedRecord(
+            index,
+            (
+                number,
+                number % 5000,
+                f"category_{number % 40}",
+                round(generator.random() * 100, 2),
+                start + datetime.timedelta(days=number % 365),
+            ),
+        )
+        for number in range(1, rows + 1)
+    ]
+
+
+async def fetch_records(rows):
+    db = PostgresDatabase(
+        host="localhost",
+        port=5432,
+        database="postgres",
+        user="admin",
+        password="admin",
+    )
+    async with db:
+        return list(await db.fetch(BENCHMARK_QUERY, rows))
+
+
+def dict_rows(records):
+    rows = []
+    for start in range(0, len(records), BATCH_SIZE):
+        rows.extend(dict(record) for record in records[start : start + BATCH_SIZE])
+    return rows
+
+
+def columnar_rows(records):
+    result = ColumnarResult()
+    for start in range(0, len(records), BATCH_SIZE):
+        result.extend(records[start : start + BATCH_SIZE])
+    return result
+
+
+def measure(records, materialise, encode_json):
+    """
+    Seconds to materialise the records in batches as the result streams do, summarise them as
+    statistics and as full CSV, and encode them as JSON. The memory held by the materialised
+    rows and the peak memory of all steps are traced in a second run, since tracing slows every
+    allocation down.
+    """
+
+    def stages():
+        rows = materialise(records)
+        yield "materialise"
+        summarize_records(rows, mode="stats")
+        yield "stats"
+        summarize_records(rows, mode="csv")
+        yield "csv"
+        encode_json(rows)
+        yield "json"
+
+    gc.collect()
+    timings = {}
+    start = time.perf_counter()
+    for stage in stages():
+        timings[stage] = time.perf_counter() - start
+        start = time.perf_counter()
+    timings["total"] = sum(timings.values())
+
+    gc.collect()
+    tracemalloc.start()
+    memory = {}
+    for stage in stages():
+        if stage == "materialise":
+            memory["rows"] = tracemalloc.get_traced_memory()[0]
+    memory["peak"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return timings, memory
+
+
+async def benchmark(rows, use_database):
+    records = await fetch_records(rows) if use_database else synthetic_records(rows)
+    logger.info("Materialising %s records", len(records))
+
+    baseline, baseline_memory = measure(
+        records, dict_rows, lambda rows: json.dumps(rows, default=str)
+    )
+    columnar, columnar_memory = measure(records, columnar_rows, lambda rows: rows.to_json())
+
+    print(f"rows: {len(records)}")
+    print(f"{'stage':<12} {'dict per row':>14} {'columnar':>10} {'speedup':>9}")
+    for stage in baseline:
+        print(
+            f"{stage:<12} {baseline[stage]:>13.3f}s {columnar[stage]:>9.3f}s "
+            f"{baseline[stage] / max(columnar[stage], 1e-9):>8.1f}x"
+        )
+    for name in baseline_memory:
+        print(
+            f"{name + ' memory':<12} {baseline_memory[name] / 2**20:>12.1f}MB "
+            f"{columnar_memory[name] / 2**20:>8.1f}MB "
+            f"{baseline_memory[name] / max(columnar_memory[name], 1):>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare dict-per-row and columnar results.")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument(
+        "--database",
+        action="store_true",
+        help="Fetch real asyncpg records from the local Postgres instead of synthetic ones.",
+    )
+    arguments = parser.parse_args()
+    asyncio.run(benchmark(arguments.rows, arguments.database))
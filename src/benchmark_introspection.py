@@ -0,0 +1,119 @@
+import time
+import asyncio
+import logging
+import argparse
+
+from database import PostgresDatabase, get_schema
+
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+BENCHMARK_SCHEMA = "bench_introspection"
+
+
+async def legacy_get_schema(db, schema="public"):
+    """
+    The per-table introspection loop `get_schema` used before the bulk `pg_catalog` queries:
+    one query to list tables plus a columns and a foreign-key query for every table.
+    """
+    schema_dict = {}
+
+    tables = await db.fetch('''
+    SELECT table_name
+    FROM information_schema.tables
+    WHERE table_schema = $1
+    ''', schema)
+
+    for table in tables:
+        table_name = table['table_name']
+        columns = await db.fetch('''
+        SELECT column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = $1 AND table_name = $2
+        ''', schema, table_name)
+
+        foreign_keys = await db.fetch('''
+        SELECT
+            kcu.column_name,
+            ccu.table_name AS foreign_table_name,
+            ccu.column_name AS foreign_column_name
+        FROM
+            information_schema.table_constraints AS tc
+            JOIN information_schema.key_column_usage AS kcu
+              ON tc.constraint_name = kcu.constraint_name
+              AND tc.table_schema = kcu.table_schema
+            JOIN information_schema.constraint_column_usage AS ccu
+              ON ccu.constraint_name = tc.constraint_name
+              AND ccu.table_schema = tc.table_schema
+        WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_schema = $1 AND tc.table_name = $2
+        ''', schema, table_name)
+
+        for col in columns:
+            column_name = f"Column name: {col['column_name']}"
+            data_type = f"Data Type: {col['data_type']}"
+            fk_info = next((fk for fk in foreign_keys if fk['column_name'] == col['column_name']), None)
+            foreign_key_to = f"foreign key to {fk_info['foreign_table_name']} through {fk_info['foreign_column_name']}" if fk_info else None
+            schema_dict[column_name] = str([f"Table Name: {table_name}", data_type, foreign_key_to])
+
+    return schema_dict
+
+
+async def create_benchmark_schema(db, tables):
+    await db.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+    await db.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA}")
+
+    for i in range(tables):
+        parent = f", parent_id INT REFERENCES {BENCHMARK_SCHEMA}.table_{i - 1}(id)" if i else ""
+        await db.execute(f"""
+        CREATE TABLE {BENCHMARK_SCHEMA}.table_{i} (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(100),
+            description TEXT,
+            amount NUMERIC(12, 2),
+            created_at TIMESTAMP{parent}
+        )
+        """)
+
+
+async def timed(function, db, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await function(db, BENCHMARK_SCHEMA)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+async def benchmark(tables, repeat):
+    db = PostgresDatabase(
+        host="localhost",
+        port=5432,
+        database="postgres",
+        user="admin",
+        password="admin",
+    )
+    await db.connect()
+
+    try:
+        logger.info("Creating %s tables in schema %s", tables, BENCHMARK_SCHEMA)
+        await create_benchmark_schema(db, tables)
+
+        legacy_time, _ = await timed(legacy_get_schema, db, repeat)
+        bulk_time, _ = await timed(get_schema, db, repeat)
+
+        print(f"tables: {tables}")
+        print(f"legacy per-table loop: {legacy_time:.3f}s")
+        print(f"bulk pg_catalog:       {bulk_time:.3f}s")
+        print(f"speedup:               {legacy_time / bulk_time:.1f}x")
+    finally:
+        await db.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+        await db.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare schema introspection strategies.")
+    parser.add_argument("--tables", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    arguments = parser.parse_args()
+    asyncio.run(benchmark(arguments.tables, arguments.repeat))
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+from llms import QueryGenerator, ComplexQueryGenerator, TableToNaturalGenerator
+from interfaces import QueryTemplate, ComplexQueryTemplate, TableToNaturalTemplate
+from database import PostgresDatabase, get_schema
+from summarization import summarize_records
+from mock_aistudio import MockAIStudio
+from dispatch import HedgedDispatcher
+from prompts import QUERY_SYSTEM_MESSAGE, ANALYSIS_SYSTEM_MESSAGE
+from telemetry import InMemoryTelemetry, set_telemetry
+import db_config
+
+
+logger = logging.getLogger()
+for logger_name in ("", "llms", "httpx"):
+    logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+CURRENT_DIR = os.path.dirname(__file__)
+
+PARAMETERS = {
+    "temperature": 0.0,
+    "top_p": 0.95,
+    "max_tokens": 2000,
+}
+
+QUERY_TEMPLATE = QueryTemplate(
+    prompt="Retrieve the information from all products that contains the name 'student' but are not 'student loans'.",
+    query_type="Postgres",
+    programming_language="SQL",
+    db_params={
+        "database_name": "postgres",
+        "table_name": "products",
+        "fields": ["product_name", "product_description"],
+    },
+)
+
+# Requests replayed one at a time with tracemalloc to attribute peak memory to each stage.
+MEMORY_SAMPLES = 20
+
+COMPLEX_PROMPT = "Retrieve the name from all categories which had products where sold for students on classroom 2."
+
+CANNED_ROWS = [
+    {"product_id": index, "product_name": f"product {index}", "category_id": index % 7}
+    for index in range(200)
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def describe(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+    }
+
+
+async def seed_dataset(size=None):
+    """
+    Recreate the sample tables of `db_config` with their seed rows, or with a synthetic dataset
+    of `size` purchases.
+    """
+    if size:
+        await db_config.generate(size)
+        return
+    db = PostgresDatabase(host="localhost", port=5432, database="postgres", user="admin", password="admin")
+    async with db:
+        await db.execute("DROP TABLE IF EXISTS purchases, student, classroom, products, categories CASCADE")
+    await db_config.create()
+    await db_config.insert()
+
+
+class PipelineBenchmark:
+    """
+    Runs the generators against a `MockAIStudio` and, unless `database` is None, the seeded
+    Postgres dataset, recording the latency of every stage of every request.
+
+    Concurrent requests interleave their allocations, so the peak memory of every stage is
+    traced in a separate pass that replays a few requests one at a time. A stage peak is the
+    most memory allocated above what was already in use when the stage started.
+    """
+
+    def __init__(self, mock, database=None, db_mapping=None, hedge_percentile=None):
+        self.mock = mock
+        self.database = database
+        self.db_mapping = db_mapping or {"Column name: category_name": "['Table Name: categories']"}
+
+        self.query_generator = QueryGenerator(aistudio_url="http://mock/query", aistudio_key="mock")
+        self.complex_query_generator = ComplexQueryGenerator(aistudio_url="http://mock/query", aistudio_key="mock")
+        self.analysis_generator = TableToNaturalGenerator(aistudio_url="http://mock/analysis", aistudio_key="mock")
+        self.query_generator.system_message = QUERY_SYSTEM_MESSAGE
+        self.complex_query_generator.system_message = QUERY_SYSTEM_MESSAGE
+        self.analysis_generator.system_message = ANALYSIS_SYSTEM_MESSAGE
+        if hedge_percentile:
+            for generator in (self.query_generator, self.complex_query_generator, self.analysis_generator):
+                generator.dispatcher = HedgedDispatcher(hedge_percentile=hedge_percentile)
+        mock.attach(self.query_generator, self.complex_query_generator, self.analysis_generator)
+        self.stage_memory = None
+        self.open_stages = []
+
+    async def close(self):
+        for generator in (self.query_generator, self.complex_query_generator, self.analysis_generator):
+            await generator.close()
+
+    def fold_peak(self):
+        # Stages nest, so the peak since the last reset counts towards every open stage.
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self.open_stages:
+            frame[1] = max(frame[1], peak)
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, timings, stage):
+        tracing = self.stage_memory is not None
+        if tracing:
+            self.fold_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            frame = [baseline, baseline]
+            self.open_stages.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[stage].append(time.perf_counter() - start)
+            if tracing:
+                self.fold_peak()
+                self.open_stages.remove(frame)
+                self.stage_memory[stage] = max(self.stage_memory[stage], frame[1] - frame[0])
+
+    async def timed(self, timings, stage, awaitable):
+        with self.stage(timings, stage):
+            return await awaitable
+
+    async def generate(self, generator, template, timings):
+        prompt = await self.timed(timings, "prompt", generator.prepare_request(template))
+        response = await self.timed(timings, "llm", generator.request_completion(prompt, PARAMETERS))
+        return response["choices"][0]["message"]["content"]
+
+    async def execute(self, sql, timings):
+        if self.database is None:
+            return CANNED_ROWS
+        records = await self.timed(timings, "sql", self.database.fetch(sql))
+        return records
+
+    async def analyse(self, rows, original_prompt, timings):
+        with self.stage(timings, "serialisation"):
+            data = summarize_records(rows, token_budget=None, mode="csv")
+        template = TableToNaturalTemplate(prompt="Explain the data.", data=data, original_prompt=original_prompt)
+        return await self.generate(self.analysis_generator, template, timings)
+
+    async def analysis_stream_request(self, timings):
+        data = summarize_records(CANNED_ROWS, token_budget=None, mode="csv")
+        template = TableToNaturalTemplate(prompt="Explain the data.", data=data, original_prompt=QUERY_TEMPLATE.prompt)
+        start = time.perf_counter()
+        deltas = []
+        with self.stage(timings, "llm"):
+            async for delta in self.analysis_generator.stream_request(template, PARAMETERS):
+                if not deltas:
+                    timings["first_token"].append(time.perf_counter() - start)
+                deltas.append(delta)
+        return "".join(deltas)
+
+    async def query_request(self, timings):
+        sql = await self.generate(self.query_generator, QUERY_TEMPLATE, timings)
+        return await self.execute(sql, timings)
+
+    async def complex_request(self, timings):
+        template = ComplexQueryTemplate(
+            prompt=COMPLEX_PROMPT,
+            query_type="Postgres",
+            programming_language="SQL",
+            db_params={"database_name": "postgres", "table_name": "categories", "fields": ["category_name"]},
+            db_mapping=self.db_mapping,
+        )
+        sql = await self.generate(self.complex_query_generator, template, timings)
+        return await self.execute(sql, timings)
+
+    async def analysis_request(self, timings):
+        return await self.analyse(CANNED_ROWS, QUERY_TEMPLATE.prompt, timings)
+
+    async def scenario(self, name, requests, concurrency):
+        request = {
+            "query": self.query_request,
+            "complex_query": self.complex_request,
+            "analysis": self.analysis_request,
+            "analysis_stream": self.analysis_stream_request,
+        }[name]
+        timings = defaultdict(list)
+        semaphore = asyncio.Semaphore(concurrency)
+        telemetry = set_telemetry(InMemoryTelemetry())
+
+        async def run_one():
+            async with semaphore:
+                with self.stage(timings, "total"):
+                    await request(timings)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(run_one() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+
+        self.stage_memory = defaultdict(int)
+        try:
+            for _ in range(min(requests, MEMORY_SAMPLES)):
+                with self.stage(defaultdict(list), "total"):
+                    await request(defaultdict(list))
+            stage_memory = dict(self.stage_memory)
+        finally:
+            self.stage_memory = None
+            tracemalloc.stop()
+
+        return {
+            "scenario": name,
+            "concurrency": concurrency,
+            "requests": requests,
+            "elapsed": elapsed,
+            "throughput": requests / elapsed,
+            "peak_memory_bytes": peak_memory,
+            "stage_peak_memory_bytes": stage_memory,
+            "stages": {stage: describe(values) for stage, values in timings.items()},
+            "counters": dict(telemetry.counters),
+        }
+
+
+async def benchmark(arguments):
+    mock = MockAIStudio(
+        latency=arguments.latency,
+        jitter=arguments.jitter,
+        seed=arguments.seed,
+        token_latency=arguments.token_latency,
+    )
+    database = None
+    db_mapping = None
+    if not arguments.no_database:
+        if arguments.seed_database:
+            await seed_dataset(arguments.dataset_size)
+        database = PostgresDatabase(
+            host="localhost",
+            port=5432,
+            database="postgres",
+            user="admin",
+            password="admin",
+            pool_size=max(arguments.concurrency),
+        )
+        await database.connect()
+        db_mapping = await get_schema(database)
+
+    runner = PipelineBenchmark(mock, database, db_mapping, arguments.hedge_percentile)
+    results = []
+    try:
+        for name in arguments.scenarios:
+            for concurrency in arguments.concurrency:
+                result = await runner.scenario(name, arguments.requests, concurrency)
+                results.append(result)
+                print(
+                    f"{name:>14} c={concurrency:<3} {result['throughput']:8.1f} req/s "
+                    f"p50={result['stages']['total']['p50'] * 1000:7.1f}ms "
+                    f"p99={result['stages']['total']['p99'] * 1000:7.1f}ms "
+                    f"peak={result['peak_memory_bytes'] / 1024:8.0f}KiB"
+                )
+    finally:
+        await runner.close()
+        if database is not None:
+            await database.disconnect()
+
+    report = {
+        "config": {
+            "latency": arguments.latency,
+            "jitter": arguments.jitter,
+            "token_latency": arguments.token_latency,
+            "seed": arguments.seed,
+            "requests": arguments.requests,
+            "database": not arguments.no_database,
+            "hedge_percentile": arguments.hedge_percentile,
+        },
+        "results": results,
+    }
+    with open(arguments.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Saved report to {arguments.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the NL to SQL pipeline.")
+    parser.add_argument("--scenarios", nargs="+", default=["query", "complex_query", "analysis"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock completion latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Mean exponential jitter in seconds.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Mock seconds per generated word.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-database", action="store_true", help="Skip Postgres and use canned rows.")
+    parser.add_argument("--seed-database", action="store_true", help="Recreate the db_config sample dataset.")
+    parser.add_argument(
+        "--dataset-size", type=int, default=None, help="Seed a synthetic dataset with this many purchases."
+    )
+    parser.add_argument(
+        "--hedge-percentile", type=float, default=None, help="Hedge completions after this latency percentile."
+    )
+    parser.add_argument("--output", default=os.path.join(CURRENT_DIR, "benchmark_results.json"))
+    asyncio.run(benchmark(parser.parse_args()))
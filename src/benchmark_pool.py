@@ -0,0 +1,57 @@
+import time
+import asyncio
+import logging
+import argparse
+
+from database import PostgresDatabase
+
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+LOAD_QUERY = "SELECT pg_sleep($1), count(*) FROM pg_catalog.pg_class"
+
+
+async def run_load(pool_size, requests, concurrency, query_seconds):
+    database = PostgresDatabase(
+        host="localhost",
+        port=5432,
+        database="postgres",
+        user="admin",
+        password="admin",
+        pool_size=pool_size,
+        min_pool_size=pool_size,
+        acquire_timeout=60,
+        statement_timeout=30000,
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker():
+        async with semaphore:
+            await database.fetch(LOAD_QUERY, query_seconds)
+
+    async with database:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return requests / elapsed
+
+
+async def benchmark(pool_sizes, requests, concurrency, query_seconds):
+    print(f"{'pool size':>10} {'queries/s':>12}")
+    for pool_size in pool_sizes:
+        throughput = await run_load(pool_size, requests, concurrency, query_seconds)
+        print(f"{pool_size:>10} {throughput:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure fetch throughput as the pool grows.")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--query-seconds", type=float, default=0.01)
+    arguments = parser.parse_args()
+    asyncio.run(
+        benchmark(arguments.pool_sizes, arguments.requests, arguments.concurrency, arguments.query_seconds)
+    )
@@ -0,0 +1,242 @@
+import io
+import csv
+import json
+
+import numpy as np
+
+
+def compact(values):
+    """
+    Store a column compactly: null-free integer and float columns become NumPy arrays, and
+    repeated strings share one object through a per-column intern table. Other columns,
+    including numeric ones with nulls and `Decimal`s, stay lists.
+    """
+    types = set(map(type, values))
+    if types == {int}:
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            return values
+    if types == {float}:
+        return np.array(values, dtype=np.float64)
+    if types <= {str, type(None)}:
+        interned = {}
+        return list(map(interned.setdefault, values, values))
+    return values
+
+
+JSON_TYPES = {str, int, float, bool, type(None)}
+
+
+def is_typed(column):
+    return isinstance(column, np.ndarray)
+
+
+def to_list(column):
+    return column.tolist() if is_typed(column) else column
+
+
+def jsonable(column):
+    """
+    Column values JSON can encode, with dates, `Decimal`s and other values turned into strings in
+    one pass rather than through a `default` callback per value.
+    """
+    column = to_list(column)
+    types = set(map(type, column))
+    if types <= JSON_TYPES:
+        return column
+    if type(None) not in types:
+        return list(map(str, column))
+    return [value if type(value) in JSON_TYPES else str(value) for value in column]
+
+
+def scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def take(column, indexes):
+    """
+    Values of `column` at `indexes` as Python objects. A range covering the whole column is not
+    copied for list columns.
+    """
+    if isinstance(indexes, range) and indexes == range(len(column)):
+        return to_list(column)
+    if isinstance(column, np.ndarray):
+        return column[np.fromiter(indexes, dtype=np.intp)].tolist()
+    return [column[index] for index in indexes]
+
+
+class RowView:
+    """
+    One row of a `ColumnarResult`, read from the columns on access without copying them. Supports
+    the same access as `asyncpg.Record`: by position or column name, `keys()`, `values()`,
+    `items()`, `get()` and `dict(row)`.
+    """
+
+    __slots__ = ("_result", "_row")
+
+    def __init__(self, result, row):
+        self._result = result
+        self._row = row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._result.index[key]
+        return scalar(self._result.columns[key][self._row])
+
+    def __iter__(self):
+        return self.values()
+
+    def __len__(self):
+        return len(self._result.names)
+
+    def __repr__(self):
+        return "<RowView " + " ".join(f"{key}={value!r}" for key, value in self.items()) + ">"
+
+    def get(self, key, default=None):
+        return self[key] if key in self._result.index else default
+
+    def keys(self):
+        return iter(self._result.names)
+
+    def values(self):
+        return (scalar(column[self._row]) for column in self._result.columns)
+
+    def items(self):
+        return zip(self._result.names, self.values())
+
+
+class ColumnarResult:
+    """
+    Query result stored as one column per field, built once from asyncpg records.
+
+    Records are transposed batch by batch while they are fetched, so no per-row dict is ever
+    created and the records can be released as soon as their batch is read. On first access the
+    columns are compacted (see `compact`), after which `extend` is no longer allowed.
+
+    `column(name)` returns the stored column itself and `row(i)` a `RowView` over the columns,
+    neither copies any value. Iterating yields `RowView`s, so code written for a list of records
+    keeps working. `to_csv` and `to_json` encode straight from the columns.
+
+    Args:
+        names (Sequence[str]): Column names, taken from the first record when empty.
+        truncated (bool): Whether the result was capped when it was fetched.
+    """
+
+    __slots__ = ("names", "index", "pending", "_columns", "truncated")
+
+    def __init__(self, names=(), truncated=False):
+        self.names = list(names)
+        self.index = {name: position for position, name in enumerate(self.names)}
+        self.pending = [[] for _ in self.names]
+        self._columns = None
+        self.truncated = truncated
+
+    @classmethod
+    def from_records(cls, records, truncated=False):
+        result = cls(truncated=truncated)
+        result.extend(records)
+        return result
+
+    @classmethod
+    async def from_stream(cls, stream):
+        """
+        Consume a `ResultStream` batch by batch, keeping its `truncated` flag.
+        """
+        result = cls()
+        async for batch in stream.batches():
+            result.extend(batch)
+        result.truncated = stream.truncated
+        return result
+
+    def extend(self, records):
+        """
+        Append asyncpg records, `CachedRecord`s or dicts with the columns of this result.
+        """
+        if self._columns is not None:
+            raise ValueError("Rows cannot be added once the columns were read.")
+        records = list(records)
+        if not records:
+            return
+        if not self.names:
+            self.names = list(records[0].keys())
+            self.index = {name: position for position, name in enumerate(self.names)}
+            self.pending = [[] for _ in self.names]
+        # Records iterate over their values, dicts over their keys.
+        if isinstance(records[0], dict):
+            records = [tuple(record.values()) for record in records]
+        for column, values in zip(self.pending, zip(*records)):
+            column.extend(values)
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = [compact(column) for column in self.pending]
+            self.pending = None
+        return self._columns
+
+    def __len__(self):
+        if self._columns is None:
+            return len(self.pending[0]) if self.pending else 0
+        return len(self._columns[0]) if self._columns else 0
+
+    def __iter__(self):
+        return self.rows()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.column(key)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("Row index out of range.")
+        return RowView(self, key)
+
+    def __repr__(self):
+        return f"ColumnarResult({len(self)} rows, columns={self.names})"
+
+    def column(self, name):
+        return self.columns[self.index[name]]
+
+    def row(self, row):
+        return self[row]
+
+    def rows(self):
+        return (RowView(self, row) for row in range(len(self)))
+
+    def tuples(self, indexes=None):
+        """
+        Rows as tuples of Python values, for encoders that need plain objects.
+        """
+        indexes = range(len(self)) if indexes is None else indexes
+        return zip(*(take(column, indexes) for column in self.columns))
+
+    def to_records(self):
+        return [dict(zip(self.names, row)) for row in self.tuples()]
+
+    def to_csv(self, indexes=None, header=True):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if header:
+            writer.writerow(self.names)
+        # csv writes None as an empty field.
+        writer.writerows(self.tuples(indexes))
+        return buffer.getvalue()
+
+    def to_json(self, orient="split"):
+        """
+        Encode the result as JSON. `split` gives `{"columns": [...], "data": [[...], ...]}`,
+        `columns` gives `{name: [values]}` and `records` a list of objects, the most verbose.
+        Values JSON does not know, such as dates and `Decimal`s, are encoded as strings.
+        """
+        columns = [jsonable(column) for column in self.columns]
+        match orient:
+            case "split":
+                content = {"columns": self.names, "data": list(zip(*columns))}
+            case "columns":
+                content = dict(zip(self.names, columns))
+            case "records":
+                content = [dict(zip(self.names, row)) for row in zip(*columns)]
+            case _:
+                raise ValueError(f"Unknown orient {orient}. Expected split, columns or records.")
+        return json.dumps(content)
@@ -0,0 +1,91 @@
+import os
+from functools import lru_cache
+from dotenv import load_dotenv
+
+from database import PostgresDatabase
+from dispatch import HedgedDispatcher
+from index_advisor import WorkloadLog
+from query_guard import QueryGuard
+from result_cache import ResultCache
+from response_cache import ResponseCache
+from throttling import RateLimiter
+
+
+# Settings and factories shared by `main`, `service` and `batch`. Importing this module only
+# reads `.env`: logging, telemetry and the workload log are set up by the callers.
+
+dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+load_dotenv(dotenv_path)
+
+MAX_RESULT_ROWS = int(os.environ.get("MAX_RESULT_ROWS", 1000))
+MAX_RESULT_BYTES = int(os.environ.get("MAX_RESULT_BYTES", 1_000_000))
+ANALYSIS_TOKEN_BUDGET = int(os.environ.get("ANALYSIS_TOKEN_BUDGET", 3000))
+QUERY_MAX_COST = float(os.environ.get("QUERY_MAX_COST", 1e6))
+SCHEMA_TOP_K = int(os.environ.get("SCHEMA_TOP_K", 5)) or None
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE") or 0)
+AISTUDIO_RPM = float(os.environ.get("AISTUDIO_RPM") or 0) or None
+AISTUDIO_TPM = float(os.environ.get("AISTUDIO_TPM") or 0) or None
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH") or None
+RESULT_CACHE_CHANNEL = os.environ.get("RESULT_CACHE_CHANNEL", "table_changed") or None
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 100))
+DB_IDLE_TIMEOUT = float(os.environ.get("DB_IDLE_TIMEOUT", 300))
+WORKLOAD_LOG_PATH = os.environ.get("WORKLOAD_LOG_PATH", "")
+WORKLOAD_LOG_SIZE = int(os.environ.get("WORKLOAD_LOG_SIZE", 500))
+
+
+@lru_cache(maxsize=None)
+def workload_log():
+    """
+    Workload log shared by every engine, continuing the one saved at `WORKLOAD_LOG_PATH`, or None
+    when the path is unset. It is loaded on the first call.
+    """
+    if not WORKLOAD_LOG_PATH:
+        return None
+    if os.path.exists(WORKLOAD_LOG_PATH):
+        return WorkloadLog.load(WORKLOAD_LOG_PATH, WORKLOAD_LOG_SIZE)
+    return WorkloadLog(WORKLOAD_LOG_SIZE)
+
+
+def save_workload_log():
+    log = workload_log()
+    if log is not None:
+        log.save(WORKLOAD_LOG_PATH)
+
+
+def make_dispatcher(url, key):
+    """
+    Hedged dispatcher over the main deployment and the comma separated `HEDGE_URLS` and
+    `HEDGE_KEYS`, or None when `HEDGE_PERCENTILE` is unset.
+
+    Raises:
+        ValueError: When `HEDGE_URLS` and `HEDGE_KEYS` have different lengths.
+    """
+    if not HEDGE_PERCENTILE:
+        return None
+    urls = [value.strip() for value in os.environ.get("HEDGE_URLS", "").split(",") if value.strip()]
+    keys = [value.strip() for value in os.environ.get("HEDGE_KEYS", "").split(",") if value.strip()]
+    if len(urls) != len(keys):
+        raise ValueError("HEDGE_URLS and HEDGE_KEYS must list the same number of deployments.")
+    return HedgedDispatcher([(url, key), *zip(urls, keys)], hedge_percentile=HEDGE_PERCENTILE)
+
+
+def make_rate_limiter():
+    return RateLimiter(requests_per_minute=AISTUDIO_RPM, tokens_per_minute=AISTUDIO_TPM)
+
+
+def make_response_cache():
+    return ResponseCache(path=RESPONSE_CACHE_PATH)
+
+
+def make_engine(database_name, pool_size=4):
+    return PostgresDatabase(
+        host="localhost",
+        port=5432,
+        database=database_name,
+        user="admin",
+        password="admin",
+        pool_size=pool_size,
+        query_guard=QueryGuard(max_cost=QUERY_MAX_COST, default_limit=MAX_RESULT_ROWS),
+        result_cache=ResultCache(channel=RESULT_CACHE_CHANNEL),
+        workload_log=workload_log(),
+    )
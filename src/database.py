@@ -1,78 +1,525 @@
+import time
+import asyncio
+from contextlib import aclosing, asynccontextmanager
+
 import asyncpg
 
+from telemetry import get_telemetry
+from schema_model import Column, Schema, Table
+
 
 class PostgresDatabase:
-    def __init__(self, host, port, database, user, password):
+    """
+    Thin asyncpg wrapper used by the hook and the tools around it.
+
+    By default a single connection is opened and concurrent calls are serialised on it. Setting
+    `pool_size` switches to a pooled mode backed by `asyncpg.create_pool`, where every call acquires
+    its own connection so coroutines can run queries in parallel.
+
+    Args:
+        pool_size (Optional[int]): Maximum number of pooled connections. `None` keeps the single
+            connection mode.
+        min_pool_size (int): Connections opened eagerly by the pool.
+        acquire_timeout (Optional[float]): Seconds to wait for a free pooled connection.
+        statement_timeout (Optional[int]): Default server-side `statement_timeout` in milliseconds.
+        statement_cache_size (int): Size of the per-connection prepared statement cache.
+        query_guard (Optional[QueryGuard]): Pre-flight check applied to calls made with
+            `guarded=True`, meant for generated SQL.
+        result_cache (Optional[ResultCache]): Cache of results consulted by calls made with
+            `cached=True`. A cache with a `channel` listens for change notifications once
+            connected, which in pooled mode takes one more connection.
+        workload_log (Optional[WorkloadLog]): Log the guarded queries are recorded in with their
+            execution time, for the `IndexAdvisor`. Results served from the cache are not logged.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        database,
+        user,
+        password,
+        pool_size=None,
+        min_pool_size=1,
+        acquire_timeout=None,
+        statement_timeout=None,
+        statement_cache_size=100,
+        query_guard=None,
+        result_cache=None,
+        workload_log=None,
+    ):
         self.host = host
         self.port = port
         self.database = database
         self.user = user
         self.password = password
+        self.pool_size = pool_size
+        self.min_pool_size = min_pool_size
+        self.acquire_timeout = acquire_timeout
+        self.statement_timeout = statement_timeout
+        self.statement_cache_size = statement_cache_size
+        self.query_guard = query_guard
+        self.result_cache = result_cache
+        self.workload_log = workload_log
         self.connection = None
+        self.pool = None
+        self.listener_connection = None
+        self.lock = asyncio.Lock()
+        self.parameter_types_cache = {}
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.disconnect()
+
+    @property
+    def connect_params(self):
+        params = {
+            "host": self.host,
+            "port": self.port,
+            "database": self.database,
+            "user": self.user,
+            "password": self.password,
+            "statement_cache_size": self.statement_cache_size,
+        }
+        if self.statement_timeout:
+            params["server_settings"] = {"statement_timeout": str(self.statement_timeout)}
+        return params
 
     async def connect(self):
-        self.connection = await asyncpg.connect(
-            host=self.host,
-            port=self.port,
-            database=self.database,
-            user=self.user,
-            password=self.password
-        )
+        if self.pool_size:
+            self.pool = await asyncpg.create_pool(
+                min_size=min(self.min_pool_size, self.pool_size),
+                max_size=self.pool_size,
+                **self.connect_params,
+            )
+        else:
+            self.connection = await asyncpg.connect(**self.connect_params)
+        if self.result_cache is not None and self.result_cache.channel is not None:
+            await self.result_cache.listen(self)
+
+    @property
+    def max_connections(self):
+        if not self.pool_size:
+            return 1
+        listening = self.result_cache is not None and self.result_cache.channel is not None
+        return self.pool_size + listening
 
     async def disconnect(self):
-        if self.connection is None:
+        if self.connection is None and self.pool is None:
             raise ValueError("Database connection is closed")
-        await self.connection.close()
+        if self.listener_connection is not None:
+            await self.listener_connection.close()
+            self.listener_connection = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        else:
+            await self.connection.close()
+            self.connection = None
 
-    async def execute(self, query, *args):
-        if self.connection is None:
+    @asynccontextmanager
+    async def checkout(self):
+        if self.pool is not None:
+            async with self.pool.acquire(timeout=self.acquire_timeout) as connection:
+                yield connection
+        elif self.connection is not None:
+            async with self.lock:
+                yield self.connection
+        else:
             raise ValueError("Database connection is closed")
-        return await self.connection.execute(query, *args)
 
-    async def fetch(self, query, *args):
-        if self.connection is None:
+    @asynccontextmanager
+    async def acquire(self, statement_timeout=None, readonly=False):
+        """
+        Yield a connection for one operation: a pooled connection in pooled mode, or the shared
+        connection under a lock otherwise. A `statement_timeout` (milliseconds) or `readonly`
+        opens a transaction so they only apply to statements issued inside the block.
+        """
+        async with self.checkout() as connection:
+            if statement_timeout is None and not readonly:
+                yield connection
+            else:
+                async with connection.transaction(readonly=readonly):
+                    if statement_timeout is not None:
+                        await connection.execute(f"SET LOCAL statement_timeout = {int(statement_timeout)}")
+                    yield connection
+
+    @asynccontextmanager
+    async def acquire_guarded(self, query, *args):
+        """
+        Yield a read-only connection together with the statement the `query_guard` accepted in
+        place of `query`.
+        """
+        if self.query_guard is None:
+            raise ValueError("A query guard is required to run guarded queries")
+        async with self.acquire(self.query_guard.statement_timeout, readonly=True) as connection:
+            with get_telemetry().span("sql_preflight", database=self.database):
+                guarded_query = await self.query_guard.check(connection, query, *args)
+            yield connection, guarded_query
+
+    async def execute(self, query, *args, statement_timeout=None):
+        with get_telemetry().span("sql_execution", database=self.database):
+            async with self.acquire(statement_timeout) as connection:
+                return await connection.execute(query, *args)
+
+    async def fetch(self, query, *args, statement_timeout=None, guarded=False, cached=False):
+        telemetry = get_telemetry()
+        cache_key = None
+        if cached and self.result_cache is not None:
+            cache_key = self.result_cache.make_key(query, (args, guarded))
+            records = await self.result_cache.get(self, cache_key)
+            telemetry.counter("result_cache_hits" if records is not None else "result_cache_misses")
+            if records is not None:
+                return records
+            table_versions = await self.result_cache.table_versions(self, query)
+
+        if guarded:
+            async with self.acquire_guarded(query, *args) as (connection, guarded_query):
+                with telemetry.span("sql_execution", database=self.database):
+                    start = time.perf_counter()
+                    records = await connection.fetch(guarded_query, *args)
+                self.record_workload(guarded_query, args, time.perf_counter() - start, len(records))
+        else:
+            with telemetry.span("sql_execution", database=self.database):
+                async with self.acquire(statement_timeout) as connection:
+                    records = await connection.fetch(query, *args)
+        telemetry.counter("rows_fetched", len(records))
+        if cache_key is not None:
+            self.result_cache.set(cache_key, records, table_versions)
+        return records
+
+    def record_workload(self, query, args, duration, rows):
+        if self.workload_log is not None:
+            self.workload_log.record(self.database, query, args, duration * 1000, rows)
+
+    async def parameter_types(self, query):
+        """
+        Type names of the `$n` parameters Postgres infers for `query`, prepared once per query.
+        """
+        if query not in self.parameter_types_cache:
+            async with self.checkout() as connection:
+                statement = await connection.prepare(query)
+            if len(self.parameter_types_cache) >= self.statement_cache_size:
+                self.parameter_types_cache.pop(next(iter(self.parameter_types_cache)))
+            self.parameter_types_cache[query] = [
+                parameter.name for parameter in statement.get_parameters()
+            ]
+        return self.parameter_types_cache[query]
+
+    async def copy_records_to_table(self, table, *, records, columns=None, schema_name=None):
+        async with self.acquire() as connection:
+            return await connection.copy_records_to_table(
+                table, records=records, columns=columns, schema_name=schema_name
+            )
+
+    def stream(
+        self,
+        query,
+        *args,
+        batch_size=500,
+        max_rows=None,
+        max_bytes=None,
+        statement_timeout=None,
+        guarded=False,
+        cached=False,
+    ):
+        """
+        Run `query` through a server-side cursor and return a `ResultStream` that yields rows or
+        row batches without loading the whole result. The stream stops once `max_rows` rows or
+        roughly `max_bytes` bytes of values have been produced. With `guarded`, the query goes
+        through the `query_guard` pre-flight check first. With `cached`, complete results are
+        stored in and served from the `result_cache`.
+        """
+        return ResultStream(
+            self, query, args, batch_size, max_rows, max_bytes, statement_timeout, guarded, cached
+        )
+
+    async def add_listener(self, channel, callback):
+        """
+        Subscribe `callback` to a LISTEN channel. Pooled connections are recycled, so in pooled
+        mode a dedicated connection is kept open for notifications.
+        """
+        if self.pool is not None:
+            if self.listener_connection is None:
+                self.listener_connection = await asyncpg.connect(**self.connect_params)
+            await self.listener_connection.add_listener(channel, callback)
+        elif self.connection is not None:
+            await self.connection.add_listener(channel, callback)
+        else:
             raise ValueError("Database connection is closed")
-        return await self.connection.fetch(query, *args)
 
 
-async def get_schema(db):
+def record_size(record):
+    return sum(len(str(value)) for value in record.values() if value is not None)
+
+
+class ResultStream:
+    """
+    Async iterator over the result of a query read through an asyncpg cursor in batches of
+    `batch_size` rows. Iterating the stream yields records, `batches()` yields lists of records.
+
+    The cursor lives inside a transaction on a connection held only while the stream is being
+    consumed. Use the stream as an async context manager (`async with database.stream(...) as
+    rows`) to close the cursor and release the connection as soon as the consumer stops early.
+    After the stream ends, `rows_fetched`, `bytes_fetched` and `truncated` describe what was
+    produced.
+    """
+
+    def __init__(
+        self,
+        database,
+        query,
+        args,
+        batch_size,
+        max_rows,
+        max_bytes,
+        statement_timeout,
+        guarded=False,
+        cached=False,
+    ):
+        self.database = database
+        self.query = query
+        self.args = args
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.statement_timeout = statement_timeout
+        self.guarded = guarded
+        self.cached = cached and database.result_cache is not None
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.truncated = False
+        self.iterators = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.aclose()
+
+    def __aiter__(self):
+        return self.rows()
+
+    async def aclose(self):
+        while self.iterators:
+            await self.iterators.pop().aclose()
+
+    def rows(self):
+        iterator = self._rows()
+        self.iterators.append(iterator)
+        return iterator
+
+    def batches(self):
+        iterator = self._batches()
+        self.iterators.append(iterator)
+        return iterator
+
+    async def _rows(self):
+        async with aclosing(self._batches()) as batches:
+            async for batch in batches:
+                for record in batch:
+                    yield record
+
+    async def _batches(self):
+        telemetry = get_telemetry()
+        try:
+            if self.cached:
+                cache = self.database.result_cache
+                cache_key = cache.make_key(self.query, (self.args, self.guarded))
+                records = await cache.get(self.database, cache_key)
+                telemetry.counter("result_cache_hits" if records is not None else "result_cache_misses")
+                if records is not None:
+                    for start in range(0, len(records), self.batch_size):
+                        batch = self._apply_limits(records[start : start + self.batch_size])
+                        if batch:
+                            yield batch
+                        if self.truncated:
+                            return
+                    return
+                table_versions = await cache.table_versions(self.database, self.query)
+
+            collected = [] if self.cached else None
+            # Only time spent in the database counts, not the consumer's work between batches.
+            duration = 0.0
+            async with self._acquire() as (connection, query):
+                async with connection.transaction():
+                    with telemetry.span("sql_execution", database=self.database.database):
+                        start = time.perf_counter()
+                        cursor = await connection.cursor(query, *self.args)
+                        duration += time.perf_counter() - start
+                    while not self.truncated:
+                        size = self.batch_size
+                        if self.max_rows is not None:
+                            size = min(size, self.max_rows - self.rows_fetched + 1)
+                        with telemetry.span("sql_fetch_batch"):
+                            start = time.perf_counter()
+                            batch = await cursor.fetch(size)
+                            duration += time.perf_counter() - start
+                        if not batch:
+                            break
+                        batch = self._apply_limits(batch)
+                        if collected is not None:
+                            collected.extend(batch)
+                        if batch:
+                            yield batch
+
+            if self.guarded:
+                self.database.record_workload(query, self.args, duration, self.rows_fetched)
+            if collected is not None and not self.truncated:
+                self.database.result_cache.set(cache_key, collected, table_versions)
+        finally:
+            telemetry.counter("rows_fetched", self.rows_fetched)
+            telemetry.counter("bytes_fetched", self.bytes_fetched)
+
+    @asynccontextmanager
+    async def _acquire(self):
+        if self.guarded:
+            async with self.database.acquire_guarded(self.query, *self.args) as acquired:
+                yield acquired
+        else:
+            async with self.database.acquire(self.statement_timeout) as connection:
+                yield connection, self.query
+
+    def _apply_limits(self, batch):
+        if self.max_rows is not None and self.rows_fetched + len(batch) > self.max_rows:
+            batch = batch[: self.max_rows - self.rows_fetched]
+            self.truncated = True
+
+        for index, record in enumerate(batch):
+            size = record_size(record)
+            if self.max_bytes is not None and self.bytes_fetched + size > self.max_bytes:
+                batch = batch[:index]
+                self.truncated = True
+                break
+            self.bytes_fetched += size
+
+        self.rows_fetched += len(batch)
+        return batch
+
+
+SCHEMA_COLUMNS_QUERY = """
+SELECT
+    c.relname AS table_name,
+    obj_description(c.oid, 'pg_class') AS table_comment,
+    a.attname AS column_name,
+    format_type(a.atttypid, a.atttypmod) AS data_type,
+    col_description(c.oid, a.attnum) AS column_comment
+FROM pg_catalog.pg_class AS c
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_attribute AS a ON a.attrelid = c.oid
+WHERE n.nspname = $1
+    AND ($2::text[] IS NULL OR c.relname = ANY($2::text[]))
+    AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+    AND a.attnum > 0
+    AND NOT a.attisdropped
+ORDER BY c.relname, a.attnum
+"""
+
+SCHEMA_CONSTRAINTS_QUERY = """
+SELECT
+    c.relname AS table_name,
+    con.contype AS constraint_type,
+    a.attname AS column_name,
+    fc.relname AS foreign_table_name,
+    fa.attname AS foreign_column_name
+FROM pg_catalog.pg_constraint AS con
+    JOIN pg_catalog.pg_class AS c ON c.oid = con.conrelid
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, fattnum, ord)
+    JOIN pg_catalog.pg_attribute AS a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+    LEFT JOIN pg_catalog.pg_class AS fc ON fc.oid = con.confrelid
+    LEFT JOIN pg_catalog.pg_attribute AS fa ON fa.attrelid = con.confrelid AND fa.attnum = k.fattnum
+WHERE n.nspname = $1
+    AND ($2::text[] IS NULL OR c.relname = ANY($2::text[]))
+    AND con.contype IN ('p', 'f')
+ORDER BY c.relname, con.conname, k.ord
+"""
+
+
+SCHEMA_STATISTICS_QUERY = """
+SELECT
+    c.relname AS table_name,
+    c.reltuples::bigint AS row_estimate,
+    ARRAY(
+        SELECT a.attname
+        FROM unnest(x.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_catalog.pg_attribute AS a ON a.attrelid = c.oid AND a.attnum = k.attnum
+        ORDER BY k.ord
+    ) AS index_columns
+FROM pg_catalog.pg_class AS c
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    LEFT JOIN pg_catalog.pg_index AS x ON x.indrelid = c.oid
+    LEFT JOIN pg_catalog.pg_class AS i ON i.oid = x.indexrelid
+WHERE n.nspname = $1
+    AND ($2::text[] IS NULL OR c.relname = ANY($2::text[]))
+    AND c.relkind IN ('r', 'p', 'm')
+ORDER BY c.relname, i.relname
+"""
+
+
+async def introspect_schema(db, schema="public", table_names=None, statistics=False):
+    """
+    Read every table, column, data type, primary key and foreign key of a schema with two bulk
+    `pg_catalog` queries and group them per table in memory. When `table_names` is given only
+    those tables are read. With `statistics`, a third query adds the planner row estimate and
+    the indexed columns of every table.
+
+    Returns:
+        Schema: The tables in name order.
+    """
+    tables = {}
+
+    for row in await db.fetch(SCHEMA_COLUMNS_QUERY, schema, table_names):
+        table = tables.get(row["table_name"])
+        if table is None:
+            table = tables[row["table_name"]] = Table(row["table_name"], comment=row["table_comment"])
+        table.columns.append(Column(row["column_name"], row["data_type"], row["column_comment"]))
+
+    for row in await db.fetch(SCHEMA_CONSTRAINTS_QUERY, schema, table_names):
+        table = tables.get(row["table_name"])
+        if table is None:
+            continue
+        if row["constraint_type"] == "p":
+            table.primary_key.append(row["column_name"])
+        else:
+            table.foreign_keys[row["column_name"]] = (
+                row["foreign_table_name"],
+                row["foreign_column_name"],
+            )
+
+    if statistics:
+        for row in await db.fetch(SCHEMA_STATISTICS_QUERY, schema, table_names):
+            table = tables.get(row["table_name"])
+            if table is None:
+                continue
+            # reltuples is -1 (or 0 before PostgreSQL 14) until the table is analyzed
+            table.row_count = row["row_estimate"] if row["row_estimate"] > 0 else None
+            if row["index_columns"]:
+                table.indexes.append(tuple(row["index_columns"]))
+
+    return Schema(tables.values())
+
+
+def build_schema_mapping(tables):
+    """
+    Legacy flat `{"Column name: x": "['Table Name: t', 'Data Type: d', fk]"}` mapping of a
+    `Schema`. Identically named columns of different tables overwrite each other, so prompts
+    should use `str(schema)` instead.
+    """
     schema_dict = {}
 
-    tables = await db.fetch('''
-    SELECT table_name
-    FROM information_schema.tables
-    WHERE table_schema = 'public'
-    ''')
-
-    for table in tables:
-        table_name = table['table_name']
-        columns = await db.fetch('''
-        SELECT column_name, data_type
-        FROM information_schema.columns
-        WHERE table_name = $1
-        ''', table_name)
-        
-        foreign_keys = await db.fetch('''
-        SELECT
-            kcu.column_name,
-            ccu.table_name AS foreign_table_name,
-            ccu.column_name AS foreign_column_name
-        FROM
-            information_schema.table_constraints AS tc
-            JOIN information_schema.key_column_usage AS kcu
-              ON tc.constraint_name = kcu.constraint_name
-              AND tc.table_schema = kcu.table_schema
-            JOIN information_schema.constraint_column_usage AS ccu
-              ON ccu.constraint_name = tc.constraint_name
-              AND ccu.table_schema = tc.table_schema
-        WHERE tc.constraint_type = 'FOREIGN KEY' AND tc.table_name = $1
-        ''', table_name)
-
-        for col in columns:
-            column_name = f"Column name: {col['column_name']}"
-            data_type = f"Data Type: {col['data_type']}"
-            fk_info = next((fk for fk in foreign_keys if fk['column_name'] == column_name), None)
-            foreign_key_to = f"foreign key to {fk_info['foreign_table_name']} through {fk_info['foreign_column_name']}" if fk_info else None
-            schema_dict[column_name] = str([f"Table Name: {table_name}", data_type, foreign_key_to])
+    for table_name, table in tables.items():
+        for name, data_type, _ in table.columns:
+            column_name = f"Column name: {name}"
+            fk_info = table.foreign_keys.get(name)
+            foreign_key_to = f"foreign key to {fk_info[0]} through {fk_info[1]}" if fk_info else None
+            schema_dict[column_name] = str([f"Table Name: {table_name}", f"Data Type: {data_type}", foreign_key_to])
 
     return schema_dict
+
+
+async def get_schema(db, schema="public", statistics=False):
+    return await introspect_schema(db, schema, statistics=statistics)
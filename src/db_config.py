@@ -1,10 +1,14 @@
 
 import os
+import time
+import random
 import asyncio
 import logging
+import argparse
 from dotenv import load_dotenv
 
 from database import PostgresDatabase
+from result_cache import install_change_trigger
 
 
 logger = logging.getLogger()
@@ -14,6 +18,9 @@ CURRENT_DIR = os.path.dirname(__file__)
 dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
 load_dotenv(dotenv_path)
 
+SAMPLE_TABLES = ["categories", "products", "classroom", "student", "purchases"]
+RESULT_CACHE_CHANNEL = os.environ.get("RESULT_CACHE_CHANNEL", "table_changed")
+
 
 async def create():
     db = PostgresDatabase(
@@ -59,7 +66,7 @@ async def create():
     """)
 
     await db.execute("""
-    CREATE TABLE purchases (
+    CREATE TABLE IF NOT EXISTS purchases (
         purchase_id SERIAL PRIMARY KEY,
         student_id INT,
         product_id INT,
@@ -68,9 +75,19 @@ async def create():
     );
     """)
 
+    await install_change_triggers(db)
     await db.disconnect()
 
 
+async def install_change_triggers(db):
+    """
+    Notify the result caches of writes to the sample tables, see `ResultCache.listen`.
+    """
+    if RESULT_CACHE_CHANNEL:
+        for table in SAMPLE_TABLES:
+            await install_change_trigger(db, table, RESULT_CACHE_CHANNEL)
+
+
 async def insert():
     db = PostgresDatabase(
         host="localhost",
@@ -142,7 +159,154 @@ async def insert():
         (5, 6);
     """)
 
+    await db.disconnect()
+
+
+CATEGORY_NAMES = ["Books", "Electronics", "Furniture", "Stationery", "Apparel", "Accessories", "Loans"]
+PRODUCT_NAMES = [
+    "book", "laptop", "tablet", "pen", "desk", "chair", "backpack", "planner", "notebook",
+    "calculator", "uniform", "shoes", "jacket", "hat", "water bottle", "ID holder", "lamp",
+    "art supplies", "lunchbox", "loan",
+]
+FIRST_NAMES = ["John", "Jane", "Alice", "Bob", "Charlie", "Diana", "Eve", "Frank", "Grace", "Heidi"]
+LAST_NAMES = ["Doe", "Smith", "Johnson", "Brown", "Davis", "Miller", "Wilson", "Moore", "Taylor"]
+
+BARE_TABLES = """
+DROP TABLE IF EXISTS purchases, student, classroom, products, categories CASCADE;
+CREATE TABLE categories (category_id SERIAL, category_name VARCHAR(100));
+CREATE TABLE products (
+    product_id SERIAL, product_name VARCHAR(100), product_description TEXT, category_id INT
+);
+CREATE TABLE classroom (classroom_id SERIAL, classroom_name VARCHAR(100) NOT NULL);
+CREATE TABLE student (student_id SERIAL, student_name VARCHAR(100) NOT NULL, classroom_id INT);
+CREATE TABLE purchases (purchase_id SERIAL, student_id INT, product_id INT);
+"""
+
+CONSTRAINTS_AND_INDEXES = [
+    "ALTER TABLE categories ADD PRIMARY KEY (category_id)",
+    "ALTER TABLE products ADD PRIMARY KEY (product_id)",
+    "ALTER TABLE classroom ADD PRIMARY KEY (classroom_id)",
+    "ALTER TABLE student ADD PRIMARY KEY (student_id)",
+    "ALTER TABLE purchases ADD PRIMARY KEY (purchase_id)",
+    "ALTER TABLE products ADD FOREIGN KEY (category_id) REFERENCES categories(category_id)",
+    "ALTER TABLE student ADD FOREIGN KEY (classroom_id) REFERENCES classroom(classroom_id)",
+    "ALTER TABLE purchases ADD FOREIGN KEY (student_id) REFERENCES student(student_id)",
+    "ALTER TABLE purchases ADD FOREIGN KEY (product_id) REFERENCES products(product_id)",
+    "CREATE INDEX ON products (category_id)",
+    "CREATE INDEX ON student (classroom_id)",
+    "CREATE INDEX ON purchases (student_id)",
+    "CREATE INDEX ON purchases (product_id)",
+]
+
+
+def dataset_sizes(size):
+    """
+    Row counts of every table for a dataset with `size` purchases.
+    """
+    students = max(size // 10, 5)
+    return {
+        "categories": len(CATEGORY_NAMES),
+        "products": max(size // 100, 20),
+        "classroom": max(students // 30, 3),
+        "student": students,
+        "purchases": size,
+    }
+
+
+def generate_rows(table, sizes, seed):
+    generator = random.Random(f"{seed}:{table}")
+    for row_id in range(1, sizes[table] + 1):
+        match table:
+            case "categories":
+                yield (row_id, CATEGORY_NAMES[row_id - 1])
+            case "products":
+                name = f"{generator.choice(PRODUCT_NAMES)} {row_id}"
+                category_id = generator.randint(1, sizes["categories"])
+                yield (row_id, name, f"A {name} for students", category_id)
+            case "classroom":
+                yield (row_id, f"Classroom {row_id}")
+            case "student":
+                name = f"{generator.choice(FIRST_NAMES)} {generator.choice(LAST_NAMES)}"
+                yield (row_id, name, generator.randint(1, sizes["classroom"]))
+            case "purchases":
+                yield (
+                    row_id,
+                    generator.randint(1, sizes["student"]),
+                    generator.randint(1, sizes["products"]),
+                )
+
+
+def batched(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def generate(size=1_000_000, batch_size=50_000, seed=0):
+    """
+    Recreate the sample schema with a synthetic dataset of `size` purchases, streamed through
+    `COPY` in batches of `batch_size` rows. Keys and indexes are built after loading and the
+    tables are analyzed at the end, so the planner sees production-like statistics.
+    """
+    db = PostgresDatabase(
+        host="localhost",
+        port=5432,
+        database="postgres",
+        user="admin",
+        password="admin",
+    )
+    sizes = dataset_sizes(size)
+    columns = {
+        "categories": ["category_id", "category_name"],
+        "products": ["product_id", "product_name", "product_description", "category_id"],
+        "classroom": ["classroom_id", "classroom_name"],
+        "student": ["student_id", "student_name", "classroom_id"],
+        "purchases": ["purchase_id", "student_id", "product_id"],
+    }
+
+    async with db:
+        start = time.perf_counter()
+        await db.execute(BARE_TABLES)
+
+        for table, table_columns in columns.items():
+            loaded = 0
+            for batch in batched(generate_rows(table, sizes, seed), batch_size):
+                await db.copy_records_to_table(table, records=batch, columns=table_columns)
+                loaded += len(batch)
+                logger.info("Loaded %s/%s rows into %s", loaded, sizes[table], table)
+            await db.execute(
+                "SELECT setval(pg_get_serial_sequence($1, $2), $3)", table, table_columns[0], max(loaded, 1)
+            )
+
+        logger.info("Loaded %s rows in %.1fs", sum(sizes.values()), time.perf_counter() - start)
+        for statement in CONSTRAINTS_AND_INDEXES:
+            await db.execute(statement)
+        await db.execute(f"ANALYZE {', '.join(SAMPLE_TABLES)}")
+        await install_change_triggers(db)
+        logger.info("Dataset ready in %.1fs", time.perf_counter() - start)
+
 
 if __name__ == "__main__":
-    #asyncio.run(create())
-    asyncio.run(insert())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create and populate the sample database.")
+    parser.add_argument(
+        "command", nargs="?", default="insert", choices=["create", "insert", "generate"]
+    )
+    parser.add_argument(
+        "--size", type=int, default=1_000_000, help="Purchases generated by 'generate'."
+    )
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    match arguments.command:
+        case "create":
+            asyncio.run(create())
+        case "insert":
+            asyncio.run(insert())
+        case "generate":
+            asyncio.run(generate(arguments.size, arguments.batch_size, arguments.seed))
@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+import itertools
+from collections import deque
+
+import httpx
+
+from telemetry import get_telemetry
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+class HedgedDispatcher:
+    """
+    Sends completion requests for a generator across one or more deployments, hedging slow ones.
+
+    Each request goes to the next endpoint in round-robin order. If it has not answered after the
+    `hedge_percentile` of the recent latencies, a duplicate goes to the following endpoint; the
+    first successful response wins and the other attempt is cancelled. A failed attempt fails
+    over to the next endpoint immediately. Until `min_samples` latencies are known the hedge
+    delay is `initial_delay`.
+
+    The generator's `rate_limiter` charges the request once; every hedge and failover reserves
+    `tokens` more and settles them with the usage of its own response. A cancelled attempt keeps
+    its reservation, since the deployment may still process it.
+
+    Args:
+        endpoints (Optional[List[Tuple[str, str]]]): `(url, key)` of every deployment. Defaults to
+            the generator's own `aistudio_url` and `aistudio_key`.
+        hedge_percentile (float): Latency percentile, between 0 and 1, after which to hedge.
+        max_hedges (int): Extra attempts allowed per request, hedges and failovers combined.
+        initial_delay (float): Hedge delay in seconds before enough latencies were observed.
+        min_delay (float): Lower bound of the hedge delay, so a fast window does not double load.
+        window (int): Number of recent latencies the percentile is computed over.
+        min_samples (int): Latencies required before the percentile is used.
+    """
+
+    def __init__(
+        self,
+        endpoints=None,
+        hedge_percentile=0.95,
+        max_hedges=1,
+        initial_delay=2.0,
+        min_delay=0.05,
+        window=200,
+        min_samples=20,
+    ):
+        if not 0 < hedge_percentile <= 1:
+            raise ValueError("hedge_percentile must be in (0, 1].")
+        self.endpoints = list(endpoints or [])
+        self.hedge_percentile = hedge_percentile
+        self.max_hedges = max_hedges
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.rotation = itertools.count()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @property
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "hedge_delay": self.delay(),
+        }
+
+    def delay(self):
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self.latencies)
+        return max(ordered[int(self.hedge_percentile * (len(ordered) - 1))], self.min_delay)
+
+    def next_endpoint(self, generator):
+        """
+        `(url, key)` of the deployment next in the rotation, for streams, which are not hedged.
+        """
+        endpoints = self.endpoints or [(generator.aistudio_url, generator.aistudio_key)]
+        return endpoints[next(self.rotation) % len(endpoints)]
+
+    async def attempt(self, generator, url, key, data, limiter=None, tokens=0):
+        if limiter is not None:
+            await limiter.acquire(tokens)
+        start = time.perf_counter()
+        try:
+            response = await generator.http_client.post(
+                url, json=data, headers={**generator.headers, "api-key": key}
+            )
+            response.raise_for_status()
+        except asyncio.CancelledError:
+            # A cancelled attempt took at least this long, keeping it keeps the tail visible.
+            self.latencies.append(time.perf_counter() - start)
+            raise
+        except httpx.HTTPError:
+            if limiter is not None:
+                limiter.settle(tokens, 0)
+            raise
+        self.latencies.append(time.perf_counter() - start)
+        body = response.json()
+        if limiter is not None:
+            limiter.settle(tokens, body.get("usage", {}).get("total_tokens"))
+        return body
+
+    async def request(self, generator, data, tokens=0):
+        """
+        Send `data` to the endpoints and return the JSON body of the first successful response.
+        `tokens` is the reservation of each extra attempt against the generator's `rate_limiter`.
+
+        Raises:
+            httpx.HTTPError: The error of the last attempt when every attempt failed.
+        """
+        telemetry = get_telemetry()
+        stage = generator.stage_name
+        endpoints = self.endpoints or [(generator.aistudio_url, generator.aistudio_key)]
+        first = next(self.rotation)
+        attempts = {}
+        pending = set()
+        error = None
+
+        def launch(kind):
+            url, key = endpoints[(first + len(attempts)) % len(endpoints)]
+            limiter = generator.rate_limiter if attempts else None
+            task = asyncio.create_task(self.attempt(generator, url, key, data, limiter, tokens))
+            attempts[task] = kind
+            pending.add(task)
+
+        self.requests += 1
+        launch("primary")
+        try:
+            while pending:
+                can_hedge = len(attempts) <= self.max_hedges
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.delay() if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    self.hedges += 1
+                    telemetry.counter(f"{stage}.hedges")
+                    logger.debug("No response after %.3fs, hedging the request.", self.delay())
+                    launch("hedge")
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        if attempts[task] == "hedge":
+                            self.hedge_wins += 1
+                            telemetry.counter(f"{stage}.hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                    logger.warning("Completion attempt failed: %s", str(error))
+
+                if can_hedge:
+                    self.failovers += 1
+                    telemetry.counter(f"{stage}.failovers")
+                    launch("failover")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
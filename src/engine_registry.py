@@ -0,0 +1,241 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from database import PostgresDatabase
+from schema_cache import DEFAULT_CACHE_DIR, SchemaCache
+
+
+logger = logging.getLogger(__name__)
+
+
+class Tenant:
+    """
+    One database of the registry: its engine, its schema snapshot and how many callers are
+    currently using it.
+    """
+
+    __slots__ = ("name", "engine", "schema_cache", "connecting", "leases", "last_used")
+
+    def __init__(self, name, engine, schema_cache):
+        self.name = name
+        self.engine = engine
+        self.schema_cache = schema_cache
+        self.connecting = None
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+    @property
+    def connections(self):
+        return self.engine.max_connections
+
+    async def schema(self):
+        return await self.schema_cache.get_tables(self.engine)
+
+
+class EngineRegistry:
+    """
+    Engines keyed by database name, for serving many tenant databases from one process.
+
+    Engines are created on the first `lease` of a database, together with a schema cache
+    primed from its on-disk snapshot. Every open engine reserves its `max_connections` against
+    the registry's; when a new database does not fit, the least recently used engines nobody is
+    leasing are closed, and if none can be closed the caller waits for a lease to end. Engines idle for `idle_timeout`
+    seconds are closed by `evict_idle`, which `start` runs every `sweep_interval` seconds.
+
+    Args:
+        engine_factory (Optional[Callable[[str], PostgresDatabase]]): Builds the engine of a
+            database name. Defaults to a pooled `PostgresDatabase` with `connection_settings`.
+        max_connections (int): Connections reserved across all open engines.
+        pool_size (int): Pool size of the default engines.
+        idle_timeout (float): Seconds without a lease after which an engine is closed.
+        sweep_interval (float): Seconds between two idle sweeps once started.
+        schema_cache_dir (str): Directory of the per-database schema snapshots.
+        on_close (Optional[Callable[[Tenant], None]]): Called with every tenant whose engine is
+            closed, so state kept per database can be released with it.
+        connection_settings: `host`, `port`, `user`, `password` and other `PostgresDatabase`
+            arguments of the default engines.
+    """
+
+    def __init__(
+        self,
+        engine_factory=None,
+        max_connections=100,
+        pool_size=4,
+        idle_timeout=300.0,
+        sweep_interval=60.0,
+        schema_cache_dir=DEFAULT_CACHE_DIR,
+        on_close=None,
+        **connection_settings,
+    ):
+        if pool_size > max_connections:
+            raise ValueError("pool_size cannot exceed max_connections.")
+        self.engine_factory = engine_factory or self.default_engine
+        self.max_connections = max_connections
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.schema_cache_dir = schema_cache_dir
+        self.on_close = on_close
+        self.connection_settings = connection_settings
+        self.tenants = OrderedDict()
+        self.condition = asyncio.Condition()
+        self.sweeper = None
+        self.evictions = 0
+
+    def default_engine(self, database_name):
+        return PostgresDatabase(
+            database=database_name, pool_size=self.pool_size, **self.connection_settings
+        )
+
+    @property
+    def reserved_connections(self):
+        return sum(tenant.connections for tenant in self.tenants.values())
+
+    @property
+    def stats(self):
+        return {
+            "tenants": len(self.tenants),
+            "leased": sum(1 for tenant in self.tenants.values() if tenant.leases),
+            "reserved_connections": self.reserved_connections,
+            "evictions": self.evictions,
+        }
+
+    @staticmethod
+    def route(prompt_template):
+        """
+        Database name a template is meant for, from `db_params["database_name"]`.
+        """
+        database_name = prompt_template.db_params.get("database_name")
+        if not database_name:
+            raise ValueError("The database name is required to route a query.")
+        return database_name
+
+    async def _close(self, tenant):
+        self.tenants.pop(tenant.name, None)
+        if self.on_close is not None:
+            self.on_close(tenant)
+        try:
+            await tenant.engine.disconnect()
+        except ValueError:
+            pass
+        logger.info("Closed the engine of %s", tenant.name)
+
+    def evictable(self, tenant):
+        return not tenant.leases and tenant.connecting.done()
+
+    async def _make_room(self, connections, database_name):
+        """
+        Close idle engines, or wait, until `connections` more fit. Waiting releases the lock, so
+        another lease may open `database_name` meanwhile; its tenant is returned in that case.
+        """
+        while self.reserved_connections + connections > self.max_connections:
+            if database_name in self.tenants:
+                break
+            idle = next(filter(self.evictable, self.tenants.values()), None)
+            if idle is None:
+                await self.condition.wait()
+            else:
+                self.evictions += 1
+                await self._close(idle)
+        return self.tenants.get(database_name)
+
+    async def _checkout(self, database_name):
+        async with self.condition:
+            tenant = self.tenants.get(database_name)
+            if tenant is None:
+                # Only constructed for its pool size, it connects once room was made.
+                engine = self.engine_factory(database_name)
+                if engine.max_connections > self.max_connections:
+                    raise ValueError(
+                        f"The engine of {database_name} needs {engine.max_connections} "
+                        f"connections, more than max_connections ({self.max_connections})."
+                    )
+                tenant = await self._make_room(engine.max_connections, database_name)
+                if tenant is None:
+                    tenant = Tenant(
+                        database_name, engine, SchemaCache(cache_dir=self.schema_cache_dir)
+                    )
+                    tenant.schema_cache.load(database_name)
+                    tenant.connecting = asyncio.ensure_future(engine.connect())
+                    self.tenants[database_name] = tenant
+                    logger.info("Opening an engine for %s", database_name)
+            self.tenants.move_to_end(database_name)
+            tenant.leases += 1
+
+        try:
+            await asyncio.shield(tenant.connecting)
+        except BaseException:
+            async with self.condition:
+                tenant.leases -= 1
+                failed = tenant.connecting.done() and not tenant.connecting.cancelled()
+                if failed and tenant.connecting.exception() is not None:
+                    if self.tenants.get(database_name) is tenant:
+                        self.tenants.pop(database_name)
+                self.condition.notify_all()
+            raise
+        return tenant
+
+    async def _checkin(self, tenant):
+        async with self.condition:
+            tenant.leases -= 1
+            tenant.last_used = time.monotonic()
+            self.condition.notify_all()
+
+    @asynccontextmanager
+    async def lease(self, database_name):
+        """
+        Yield the connected `Tenant` of `database_name`, opening its engine if needed. The engine
+        is not evicted while the lease is held.
+
+        Raises:
+            ValueError: When the engine needs more connections than `max_connections`.
+        """
+        tenant = await self._checkout(database_name)
+        try:
+            yield tenant
+        finally:
+            await self._checkin(tenant)
+
+    def lease_for(self, prompt_template):
+        return self.lease(self.route(prompt_template))
+
+    async def evict_idle(self):
+        async with self.condition:
+            deadline = time.monotonic() - self.idle_timeout
+            for tenant in list(self.tenants.values()):
+                if self.evictable(tenant) and tenant.last_used < deadline:
+                    self.evictions += 1
+                    await self._close(tenant)
+            self.condition.notify_all()
+
+    async def sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.evict_idle()
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.error("Idle engine sweep failed: %s", str(exc))
+
+    def start(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self.sweep())
+
+    async def close(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            self.sweeper = None
+        async with self.condition:
+            for tenant in list(self.tenants.values()):
+                if tenant.connecting is not None and not tenant.connecting.done():
+                    await asyncio.gather(tenant.connecting, return_exceptions=True)
+                await self._close(tenant)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
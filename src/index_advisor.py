@@ -0,0 +1,442 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict
+
+import asyncpg
+
+from database import PostgresDatabase, introspect_schema
+
+
+logger = logging.getLogger(__name__)
+
+JOIN_CONDITION_KEYS = ("Hash Cond", "Merge Cond", "Join Filter")
+# A column, optionally qualified and cast, compared with an operator a btree index can serve.
+OPERAND = r"\(*(?:\"?(\w+)\"?\.)?\"?([A-Za-z_]\w*)\"?\)*(?:::[\w ]+?(?:\[\])?)?"
+COMPARISON_PATTERN = re.compile(rf"{OPERAND}\s*(=|<=|>=|<|>)\s*(?:ANY\b\s*)?(?:{OPERAND})?")
+
+
+def quote_identifier(name):
+    # Always quoted, since names such as `user` or `order` are valid but reserved.
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", ()):
+        yield from plan_nodes(child)
+
+
+def compared_columns(condition):
+    """
+    `(qualifier, column, operator)` of both sides of every comparison in a plan condition such
+    as `((p.category_id)::integer = c.category_id)`. Literals and casts are not columns and
+    are filtered out later against the schema.
+    """
+    columns = []
+    for match in COMPARISON_PATTERN.finditer(condition or ""):
+        left_qualifier, left, operator, right_qualifier, right = match.groups()
+        columns.append((left_qualifier, left, operator))
+        if right is not None:
+            columns.append((right_qualifier, right, operator))
+    return columns
+
+
+class WorkloadEntry:
+    __slots__ = ("database", "query", "args", "count", "total_ms", "max_ms", "rows", "plan")
+
+    def __init__(
+        self, database, query, args=(), count=0, total_ms=0.0, max_ms=0.0, rows=0, plan=None
+    ):
+        self.database = database
+        self.query = query
+        self.args = list(args)
+        self.count = count
+        self.total_ms = total_ms
+        self.max_ms = max_ms
+        self.rows = rows
+        self.plan = plan
+
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class WorkloadLog:
+    """
+    Bounded in-memory log of the generated queries a process executed, one entry per database and
+    statement with its execution count and timings. Once `max_queries` statements are logged the
+    least recently executed one is dropped. Recording is a dictionary update, so the log can stay
+    enabled in production; plans are only read when an `IndexAdvisor` analyses the log.
+    """
+
+    def __init__(self, max_queries=500):
+        self.max_queries = max_queries
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries.values()))
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.split()).rstrip(";")
+
+    def record(self, database, query, args, duration_ms, rows):
+        key = (database, self.normalize(query))
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = WorkloadEntry(database, key[1], args)
+            if len(self.entries) > self.max_queries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        entry.count += 1
+        entry.total_ms += duration_ms
+        entry.max_ms = max(entry.max_ms, duration_ms)
+        entry.rows = rows
+
+    def add(self, entry):
+        key = (entry.database, entry.query)
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        while len(self.entries) > self.max_queries:
+            self.entries.popitem(last=False)
+
+    def save(self, path):
+        with open(f"{path}.tmp", "w", encoding="utf-8") as workload_file:
+            for entry in self.entries.values():
+                workload_file.write(json.dumps(entry.to_dict(), default=str) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path, max_queries=500):
+        """
+        Read a log written by `save`, or the output of `batch`, whose lines carry the `sql`,
+        `arguments` and `latency` of every answered question. Only the last `max_queries`
+        statements are kept, and unreadable lines are skipped with a warning.
+        """
+        log = cls(max_queries)
+        with open(path, "r", encoding="utf-8") as workload_file:
+            for number, line in enumerate(workload_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    content = json.loads(line)
+                    if "sql" not in content:
+                        log.add(WorkloadEntry(**content))
+                    elif not content.get("error"):
+                        log.record(
+                            content.get("database", "postgres"),
+                            content["sql"],
+                            content.get("arguments", ()),
+                            content.get("latency", 0.0) * 1000,
+                            content.get("rows", 0),
+                        )
+                except (ValueError, TypeError, AttributeError) as exc:
+                    logger.warning("Skipping unreadable line %s of %s: %s", number, path, str(exc))
+        return log
+
+
+class IndexProposal:
+    """
+    One `CREATE INDEX` suggestion. `savings_ms` is the share of the logged execution time spent
+    in the sequential scans the index would replace, which assumes the index scan is free; when
+    validated with hypothetical indexes, it is scaled by the planner cost reduction instead.
+    """
+
+    __slots__ = (
+        "table",
+        "column",
+        "kinds",
+        "queries",
+        "executions",
+        "savings_ms",
+        "cost_before",
+        "cost_after",
+        "validated",
+    )
+
+    def __init__(self, table, column):
+        self.table = table
+        self.column = column
+        self.kinds = set()
+        self.queries = {}
+        self.executions = 0
+        self.savings_ms = 0.0
+        self.cost_before = None
+        self.cost_after = None
+        self.validated = None
+
+    @property
+    def name(self):
+        return f"idx_{self.table}_{self.column}"[:63]
+
+    @property
+    def statement(self):
+        return "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})".format(
+            quote_identifier(self.name), quote_identifier(self.table), quote_identifier(self.column)
+        )
+
+    @property
+    def hypothetical_statement(self):
+        return f"CREATE INDEX ON {quote_identifier(self.table)} ({quote_identifier(self.column)})"
+
+    def to_dict(self):
+        return {
+            "statement": self.statement,
+            "table": self.table,
+            "column": self.column,
+            "kinds": sorted(self.kinds),
+            "queries": len(self.queries),
+            "executions": self.executions,
+            "estimated_savings_ms": self.savings_ms,
+            "cost_before": self.cost_before,
+            "cost_after": self.cost_after,
+            "planner_speedup": (
+                self.cost_before / self.cost_after
+                if self.cost_before is not None and self.cost_after
+                else None
+            ),
+            "validated": self.validated,
+        }
+
+
+class IndexAdvisor:
+    """
+    Proposes single-column btree indexes for the columns a logged workload filters or joins on
+    through sequential scans.
+
+    Every logged statement is planned once with `EXPLAIN (FORMAT JSON)`. A `Seq Scan` whose filter
+    compares a column, or whose table is joined on a column, makes that column a candidate unless
+    an existing index already starts with it, the table is smaller than `min_rows`, or the filter
+    keeps more than `max_selectivity` of the table, where an index would not be used. Candidates
+    are ranked by the logged time spent in those scans, weighted by their share of the plan cost.
+
+    With `validate`, each candidate is created as a hypothetical index with the `hypopg`
+    extension and the affected statements are planned again, so proposals the planner would not
+    use are discarded.
+
+    Args:
+        workload_log (WorkloadLog): The executed statements to analyse.
+        min_rows (int): Tables with fewer estimated rows are never indexed.
+        max_selectivity (float): Highest fraction of a table a filter can keep and still be
+            proposed.
+        max_proposals (int): Number of proposals returned.
+    """
+
+    def __init__(self, workload_log, min_rows=10_000, max_selectivity=0.2, max_proposals=10):
+        self.workload_log = workload_log
+        self.min_rows = min_rows
+        self.max_selectivity = max_selectivity
+        self.max_proposals = max_proposals
+
+    @staticmethod
+    async def explain(connection, entry):
+        plan = await connection.fetchval(f"EXPLAIN (FORMAT JSON) {entry.query}", *entry.args)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    async def capture_plans(self, db, refresh=False):
+        """
+        Plan the logged statements of `db` that have no plan yet. Statements that cannot be
+        planned any more, for example after a schema change, are skipped.
+        """
+        # Plain EXPLAIN runs nothing, and outside a transaction a failed plan does not abort the
+        # following ones.
+        entries = [
+            entry
+            for entry in self.workload_log
+            if entry.database == db.database and (refresh or entry.plan is None)
+        ]
+        async with db.acquire() as connection:
+            for entry in entries:
+                try:
+                    entry.plan = await self.explain(connection, entry)
+                except (asyncpg.PostgresError, ValueError) as exc:
+                    logger.warning("Could not plan a logged query: %s", str(exc))
+
+    def eligible(self, table, column_name):
+        if not any(column.name == column_name for column in table.columns):
+            return False
+        if any(index and index[0] == column_name for index in table.indexes):
+            return False
+        return table.row_count is None or table.row_count >= self.min_rows
+
+    def candidates(self, entry, schema):
+        """
+        `(table, column, kind, cost share)` of every indexable column a plan scans sequentially.
+        """
+        nodes = list(plan_nodes(entry.plan))
+        total_cost = max(entry.plan.get("Total Cost", 0.0), 1e-9)
+        scans = {
+            node.get("Alias", node["Relation Name"]): node
+            for node in nodes
+            if node["Node Type"] == "Seq Scan" and "Relation Name" in node
+        }
+
+        for alias, scan in scans.items():
+            table = schema.get(scan["Relation Name"])
+            if not scan.get("Filter") or table is None:
+                continue
+            selectivity = scan.get("Plan Rows", 0) / table.row_count if table.row_count else 0.0
+            if selectivity > self.max_selectivity:
+                continue
+            for qualifier, column_name, _ in compared_columns(scan["Filter"]):
+                if qualifier in (None, alias) and self.eligible(table, column_name):
+                    yield table.name, column_name, "filter", scan["Total Cost"] / total_cost
+
+        for node in nodes:
+            for key in JOIN_CONDITION_KEYS:
+                for qualifier, column_name, operator in compared_columns(node.get(key)):
+                    scan = scans.get(qualifier)
+                    if operator != "=" or scan is None:
+                        continue
+                    table = schema.get(scan["Relation Name"])
+                    if table is not None and self.eligible(table, column_name):
+                        yield table.name, column_name, "join", scan["Total Cost"] / total_cost
+
+    async def propose(self, db, validate=False):
+        """
+        Ranked index proposals for the logged statements of `db`.
+
+        Returns:
+            List[IndexProposal]: At most `max_proposals` proposals, best first.
+        """
+        await self.capture_plans(db)
+        schema = await introspect_schema(db, statistics=True)
+
+        proposals = {}
+        for entry in self.workload_log:
+            if entry.database != db.database or entry.plan is None:
+                continue
+            shares = {}
+            for table_name, column_name, kind, share in self.candidates(entry, schema):
+                key = (table_name, column_name)
+                if key not in proposals:
+                    proposals[key] = IndexProposal(table_name, column_name)
+                proposals[key].kinds.add(kind)
+                shares[key] = max(shares.get(key, 0.0), share)
+            for key, share in shares.items():
+                proposal = proposals[key]
+                proposal.queries[entry.query] = entry
+                proposal.executions += entry.count
+                proposal.savings_ms += entry.total_ms * min(share, 1.0)
+
+        ranked = sorted(proposals.values(), key=lambda proposal: proposal.savings_ms, reverse=True)
+        if validate:
+            ranked = await self.validate(db, ranked)
+        return ranked[: self.max_proposals]
+
+    async def validate(self, db, proposals):
+        """
+        Re-plan the statements of every proposal with its index created hypothetically and keep
+        the proposals that lower their planner cost, re-ranked by the scaled savings. Proposals
+        are returned unvalidated when `hypopg` is not installed, and dropped when their index or
+        one of their statements fails to plan.
+        """
+        async with db.acquire() as connection:
+            if not await connection.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'"):
+                logger.warning("hypopg is not installed, proposals are not validated.")
+                return proposals
+
+            validated = []
+            try:
+                for proposal in proposals:
+                    await connection.execute("SELECT hypopg_reset()")
+                    try:
+                        await connection.fetchval(
+                            "SELECT indexrelid FROM hypopg_create_index($1)",
+                            proposal.hypothetical_statement,
+                        )
+                        before = after = savings = 0.0
+                        for entry in proposal.queries.values():
+                            cost = (await self.explain(connection, entry))["Total Cost"]
+                            before += entry.plan["Total Cost"] * entry.count
+                            after += cost * entry.count
+                            reduction = 1 - cost / max(entry.plan["Total Cost"], 1e-9)
+                            savings += entry.total_ms * max(reduction, 0.0)
+                    except asyncpg.PostgresError as exc:
+                        logger.warning(
+                            "Skipping %s, it could not be validated: %s",
+                            proposal.statement,
+                            str(exc),
+                        )
+                        continue
+                    proposal.cost_before = before
+                    proposal.cost_after = after
+                    proposal.validated = after < before
+                    proposal.savings_ms = savings
+                    if proposal.validated:
+                        validated.append(proposal)
+            finally:
+                await connection.execute("SELECT hypopg_reset()")
+
+        return sorted(validated, key=lambda proposal: proposal.savings_ms, reverse=True)
+
+    async def report(self, db, validate=False):
+        """
+        Workload totals and the proposals with the speedup of the whole logged workload each one
+        would bring on its own.
+        """
+        proposals = await self.propose(db, validate)
+        entries = [entry for entry in self.workload_log if entry.database == db.database]
+        total_ms = sum(entry.total_ms for entry in entries)
+
+        def workload_speedup(proposal):
+            if not total_ms:
+                return None
+            return total_ms / max(total_ms - proposal.savings_ms, 1e-9)
+
+        return {
+            "database": db.database,
+            "statements": len(entries),
+            "executions": sum(entry.count for entry in entries),
+            "total_ms": total_ms,
+            "proposals": [
+                {**proposal.to_dict(), "workload_speedup": workload_speedup(proposal)}
+                for proposal in proposals
+            ],
+        }
+
+
+async def advise(workload_path, database, validate, max_proposals):
+    workload_log = WorkloadLog.load(workload_path)
+    db = PostgresDatabase(
+        host="localhost",
+        port=5432,
+        database=database,
+        user="admin",
+        password="admin",
+    )
+    async with db:
+        advisor = IndexAdvisor(workload_log, max_proposals=max_proposals)
+        return await advisor.report(db, validate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Propose indexes for a logged query workload.")
+    parser.add_argument(
+        "workload", help="JSONL saved by `WorkloadLog.save`, or the output file of `batch`."
+    )
+    parser.add_argument("--database", default="postgres")
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Check every proposal with a hypothetical index, requires the hypopg extension.",
+    )
+    parser.add_argument("--max-proposals", type=int, default=10)
+    arguments = parser.parse_args()
+    report = asyncio.run(
+        advise(arguments.workload, arguments.database, arguments.validate, arguments.max_proposals)
+    )
+    print(json.dumps(report, indent=2))
@@ -1,5 +1,7 @@
-from typing import Dict, List
+from typing import Dict, List, Literal, Optional
+from pydantic import BaseModel, ConfigDict
 from aistudio_requests.schemas import PromptTemplate
+from schema_model import Schema
 
 
 class QueryTemplate(PromptTemplate):
@@ -9,9 +11,19 @@ class QueryTemplate(PromptTemplate):
 
 
 class ComplexQueryTemplate(QueryTemplate):
-    db_mapping: Dict[str, str]
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    db_mapping: Schema | Dict[str, str]
 
 
 class TableToNaturalTemplate(PromptTemplate):
     data: str
     original_prompt: str
+
+
+class QueryRejection(BaseModel):
+    query: str
+    reason: Literal["invalid", "not_read_only", "cost", "rows"]
+    message: str
+    estimated_cost: Optional[float] = None
+    estimated_rows: Optional[float] = None
@@ -1,15 +1,450 @@
+import json
+import time
+import asyncio
 import logging
+from contextlib import AsyncExitStack
+
+import httpx
 
 from string import Template
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
 from aistudio_requests.generate import PromptGenerator
+from aistudio_requests.schemas import AzureAIMessage, AzureAIRequest, PromptTemplate
 from interfaces import QueryTemplate, ComplexQueryTemplate, TableToNaturalTemplate
+from response_cache import ResponseCache
+from dispatch import DEFAULT_TIMEOUT, HedgedDispatcher
+from throttling import RateLimiter, SingleFlight
+from skeleton_cache import PLACEHOLDER_PATTERN, extract_literals, is_parameterized
+from prompts import PARAMETERIZED_QUERY_INSTRUCTIONS
+from schema_index import SchemaIndex
+from tokenizer import count_tokens
+from telemetry import get_telemetry
 
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+PENDING_CLOSES = set()
+
+
+def close_client(client: httpx.AsyncClient) -> None:
+    """
+    Close a client that is being replaced from synchronous code: on the running loop when there
+    is one, or on a short-lived loop otherwise.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(client.aclose())
+        return
+    task = loop.create_task(client.aclose())
+    PENDING_CLOSES.add(task)
+    task.add_done_callback(PENDING_CLOSES.discard)
+
+
+class NLToSQLGenerator(PromptGenerator):
+    """
+    Common base of the project generators. It splits `send_request` into preparing the prompt,
+    calling the model and extracting the content, so a `ResponseCache` can answer repeated
+    prompts without a model round trip. Completions go through `dispatcher` when one is set,
+    which can spread and hedge them across several deployments.
+
+    Identical prompts in flight at the same time share one completion unless `coalesce` is
+    False. With a `rate_limiter`, requests are paced to the deployment quotas and throttled or
+    failed ones are retried with backoff that honours `Retry-After`, in place of the fixed
+    retries of the base client. Generators of one process can share an `http_client`, and with
+    it the open connections to the deployment.
+
+    Every stage is reported to the configured telemetry under `stage_name`.
+    """
+
+    stage_name: str = "generation"
+
+    def __init__(
+        self,
+        *args,
+        response_cache: Optional[ResponseCache] = None,
+        schema_fingerprint: Optional[str] = None,
+        dispatcher: Optional[HedgedDispatcher] = None,
+        timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+        rate_limiter: Optional[RateLimiter] = None,
+        coalesce: bool = True,
+        http_client: Optional[httpx.AsyncClient] = None,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        # The base client waits for hours, so a stalled deployment would hang the request.
+        self.owns_http_client = True
+        if http_client is not None:
+            self.use_http_client(http_client)
+        else:
+            self.use_http_client(httpx.AsyncClient(timeout=timeout), owned=True)
+        self.response_cache = response_cache
+        self.dispatcher = dispatcher
+        self.rate_limiter = rate_limiter
+        self.inflight = SingleFlight() if coalesce else None
+        self.__schema_fingerprint = schema_fingerprint
+
+    @property
+    def schema_fingerprint(self) -> Optional[str]:
+        """
+        Fingerprint of the schema the prompts are generated against. It is part of the cache key,
+        and replacing it drops the cached responses of the previous schema.
+        """
+        return self.__schema_fingerprint
+
+    @schema_fingerprint.setter
+    def schema_fingerprint(self, fingerprint: Optional[str]) -> None:
+        previous = self.__schema_fingerprint
+        self.__schema_fingerprint = fingerprint
+        if self.response_cache is not None and previous is not None and previous != fingerprint:
+            self.response_cache.invalidate(previous)
+
+    def use_http_client(self, http_client: httpx.AsyncClient, owned: bool = False) -> None:
+        """
+        Send the requests through `http_client`. The previous client is closed when this
+        generator created it, while a shared client is left open for its owner to close.
+        """
+        if self.owns_http_client and self.http_client is not http_client:
+            close_client(self.http_client)
+        self.http_client = http_client
+        self.owns_http_client = owned
+
+    def build_messages(self, prompt_request: str) -> List[AzureAIMessage]:
+        return [
+            AzureAIMessage(
+                role="system",
+                content=[{"type": "text", "text": self.system_message}],
+            ),
+            AzureAIMessage(
+                role="user",
+                content=[{"type": "text", "text": prompt_request}],
+            ),
+        ]
+
+    async def request_completion(
+        self,
+        prompt_request: str,
+        parameters: Dict[str, Union[str, float, int]],
+    ) -> dict:
+        messages = self.build_messages(prompt_request)
+        logger.debug("Sending query to Azure AI Service. Messages: %s \n", messages)
+
+        data = AzureAIRequest(messages=messages, **parameters)  # type: ignore
+        json_data = data.model_dump(exclude_unset=True, exclude_none=True)
+        logger.debug("Sending data to Azure AI Studio. Data: %s \n", json_data)
+
+        reserved = 0
+        if self.rate_limiter is not None:
+            reserved = count_tokens(self.system_message + prompt_request) + data.max_tokens
+
+        def send():
+            if self.dispatcher is not None:
+                return self.dispatcher.request(self, json_data, reserved)
+            if self.rate_limiter is not None:
+                return self._post_completion(json_data)
+            return self._request_url(method="post", url=self.aistudio_url, data=json_data)
+
+        telemetry = get_telemetry()
+        with telemetry.span(f"{self.stage_name}.llm_request", url=self.aistudio_url):
+            if self.rate_limiter is not None:
+                response = await self.rate_limiter.call(send, reserved, self.stage_name)
+            else:
+                response = await send()
+
+        usage = response.get("usage", {})
+        telemetry.counter(f"{self.stage_name}.prompt_tokens", usage.get("prompt_tokens", 0))
+        telemetry.counter(f"{self.stage_name}.completion_tokens", usage.get("completion_tokens", 0))
+        logger.info(
+            "Query successfully generated. Resources used: %s",
+            str({
+                "model": response.get("model", ""),
+                **response.get("usage", {}),
+            }),
+        )
+        return response
+
+    async def _post_completion(self, json_data: dict) -> dict:
+        response = await self.http_client.post(self.aistudio_url, json=json_data, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def _stream_endpoint(self, url: str, key: str, json_data: dict) -> AsyncIterator[str]:
+        headers = {**self.headers, "api-key": key}
+        async with self.http_client.stream("POST", url, json=json_data, headers=headers) as response:
+            if response.is_error:
+                await response.aread()
+            response.raise_for_status()
+            async for chunk in response.aiter_text():
+                yield chunk
+
+    async def _stream_lines(
+        self, json_data: dict, endpoint: Optional[Tuple[str, str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Server-sent event lines of a streamed completion. `_stream_url` yields text chunks that
+        do not respect line boundaries, and its retry path yields the retried generator instead
+        of its chunks, so both are flattened here. An explicit `(url, key)` endpoint is streamed
+        from once, leaving the retries to the caller.
+        """
+        if endpoint is not None:
+            stream = self._stream_endpoint(*endpoint, json_data)
+        else:
+            stream = self._stream_url(method="post", url=self.aistudio_url, data=json_data)
+        pending = [stream]
+        buffer = ""
+        while pending:
+            try:
+                chunk = await pending[-1].__anext__()
+            except StopAsyncIteration:
+                pending.pop()
+                continue
+            if not isinstance(chunk, str):
+                pending.append(chunk)
+                continue
+            buffer += chunk
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                yield line.rstrip("\r")
+        if buffer:
+            yield buffer
+
+    async def stream_completion(
+        self,
+        prompt_request: str,
+        parameters: Dict[str, Union[str, float, int]],
+    ) -> AsyncIterator[str]:
+        """
+        Streamed counterpart of `request_completion`, yielding the content deltas as the model
+        produces them. The time to the first delta is recorded in the
+        `{stage_name}.time_to_first_token` histogram, in milliseconds.
+
+        With a `dispatcher`, the stream goes to the deployment next in its rotation, but is never
+        hedged nor failed over. With a `rate_limiter`, it reserves its tokens like a request and
+        settles them with the usage of the final chunk; a failed stream is not retried.
+        """
+        data = AzureAIRequest(
+            messages=self.build_messages(prompt_request), stream=True, **parameters  # type: ignore
+        )
+        json_data = data.model_dump(exclude_unset=True, exclude_none=True)
+        logger.debug("Streaming data from Azure AI Studio. Data: %s \n", json_data)
+
+        endpoint = None
+        if self.dispatcher is not None:
+            endpoint = self.dispatcher.next_endpoint(self)
+        elif self.rate_limiter is not None:
+            endpoint = (self.aistudio_url, self.aistudio_key)
+
+        async with AsyncExitStack() as stack:
+            usage = {}
+            if self.rate_limiter is not None:
+                json_data["stream_options"] = {"include_usage": True}
+                reserved = count_tokens(self.system_message + prompt_request) + data.max_tokens
+                usage = await stack.enter_async_context(
+                    self.rate_limiter.reserve(reserved, self.stage_name)
+                )
+
+            telemetry = get_telemetry()
+            start = time.perf_counter()
+            first_token = True
+            url = endpoint[0] if endpoint is not None else self.aistudio_url
+            with telemetry.span(f"{self.stage_name}.llm_stream", url=url):
+                async for line in self._stream_lines(json_data, endpoint):
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    usage.update(chunk.get("usage") or {})
+                    choices = chunk.get("choices") or [{}]
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if not delta:
+                        continue
+                    if first_token:
+                        first_token = False
+                        telemetry.histogram(
+                            f"{self.stage_name}.time_to_first_token",
+                            (time.perf_counter() - start) * 1000,
+                        )
+                    yield delta
+
+    async def stream_request(
+        self,
+        prompt_template: PromptTemplate,
+        parameters: Dict[str, Union[str, float, int]],
+    ) -> AsyncIterator[str]:
+        """
+        Asynchronously stream the answer to the prompt as content deltas. A cached answer is
+        yielded as a single delta, and a stream that completes is cached like `send_request`.
+        Identical prompts streamed at the same time are not coalesced, each opens its own stream.
+
+        Args:
+            prompt_template (PromptTemplate): The prompt template to generate the prompt.
+            parameters (Dict[str, Union[str, float, int]]): Additional parameters for the request.
+
+        Yields:
+            str: The successive pieces of the answer.
+        """
+        telemetry = get_telemetry()
+        with telemetry.span(f"{self.stage_name}.prompt_preparation"):
+            prompt_request: str = await self.prepare_request(prompt_template)
+        if not prompt_request:
+            return
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.make_key(
+                prompt_request, self.system_message, parameters, self.schema_fingerprint
+            )
+            content = self.response_cache.get(cache_key)
+            if content is not None:
+                telemetry.counter(f"{self.stage_name}.cache_hits")
+                yield content
+                return
+            telemetry.counter(f"{self.stage_name}.cache_misses")
+
+        deltas = []
+        async for delta in self.stream_completion(prompt_request, parameters):
+            deltas.append(delta)
+            yield delta
+        if cache_key is not None and deltas:
+            self.response_cache.set(cache_key, "".join(deltas), self.schema_fingerprint)
+
+    async def send_request(
+        self,
+        prompt_template: PromptTemplate,
+        parameters: Dict[str, Union[str, float, int]],
+        *,
+        complete_response: bool = False,
+        **kwargs
+    ):
+        """
+        Asynchronously send a request to the Azure AI Studio using the provided parameters,
+        answering from the response cache when an identical prompt was already generated.
+
+        Args:
+            prompt_template (PromptTemplate): The prompt template to generate the prompt.
+            parameters (Dict[str, Union[str, float, int]]): Additional parameters for the request.
+            complete_response (bool, optional): Whether to return the complete response. Complete
+                responses are never cached. Defaults to False.
+
+        Returns:
+            str: The result of the prompt from the Azure AI Studio, or None if the request was unsuccessful.
+        """
+        telemetry = get_telemetry()
+        with telemetry.span(f"{self.stage_name}.prompt_preparation"):
+            prompt_request: str = await self.prepare_request(prompt_template)
+        if not prompt_request:
+            return None
+
+        cache_key = None
+        if self.response_cache is not None and not complete_response:
+            cache_key = self.response_cache.make_key(
+                prompt_request, self.system_message, parameters, self.schema_fingerprint
+            )
+            content = self.response_cache.get(cache_key)
+            if content is not None:
+                telemetry.counter(f"{self.stage_name}.cache_hits")
+                logger.info("Response served from cache. Stats: %s", self.response_cache.stats)
+                return content
+            telemetry.counter(f"{self.stage_name}.cache_misses")
+
+        if self.inflight is not None and not complete_response:
+            flight_key = cache_key or ResponseCache.make_key(
+                prompt_request, self.system_message, parameters, self.schema_fingerprint
+            )
+            if flight_key in self.inflight.calls:
+                telemetry.counter(f"{self.stage_name}.coalesced")
+            response = await self.inflight.run(
+                flight_key, lambda: self.request_completion(prompt_request, parameters)
+            )
+        else:
+            response = await self.request_completion(prompt_request, parameters)
+        if complete_response:
+            return response
+
+        content = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if cache_key is not None and content:
+            self.response_cache.set(cache_key, content, self.schema_fingerprint)
+        return content
+
+    async def send_parameterized_request(
+        self,
+        prompt_template: PromptTemplate,
+        parameters: Dict[str, Union[str, float, int]],
+    ) -> Tuple[str, List[str]]:
+        """
+        Generate a query for questions that only differ in their literals. The quoted strings,
+        dates and numbers of the prompt are replaced with `$1`, `$2`..., and the response cache
+        is looked up for a parameterized query generated for the same question shape. On a miss
+        the model is asked for such a query, which is cached when it uses exactly those
+        placeholders. Bind the returned values with `skeleton_cache.bind_arguments`.
+
+        Without a response cache or literals, this falls back to `send_request` with no values.
+        An answer without any placeholder is valid SQL with the literals inlined, so it is
+        returned as is with no values, but not cached for the question shape; only an answer
+        with mismatched placeholders is generated again with `send_request`. Identical prompts
+        in flight share one completion, as in `send_request`.
+
+        Args:
+            prompt_template (PromptTemplate): The prompt template to generate the prompt.
+            parameters (Dict[str, Union[str, float, int]]): Additional parameters for the request.
+
+        Returns:
+            Tuple[str, List[str]]: The query and the literal values for its `$n` parameters.
+        """
+        shape, values, kinds = extract_literals(prompt_template.prompt)
+        if self.response_cache is None or not values:
+            return await self.send_request(prompt_template, parameters), []
+
+        telemetry = get_telemetry()
+        with telemetry.span(f"{self.stage_name}.prompt_preparation"):
+            prompt_request: str = await self.prepare_request(
+                prompt_template.model_copy(update={"prompt": shape})
+            )
+        cache_key = self.response_cache.make_key(
+            prompt_request, self.system_message, {**parameters, "literals": kinds}, self.schema_fingerprint
+        )
+        query = self.response_cache.get(cache_key)
+        if query is not None:
+            telemetry.counter(f"{self.stage_name}.skeleton_hits")
+            return query, values
+        telemetry.counter(f"{self.stage_name}.skeleton_misses")
+
+        instructions = Template(PARAMETERIZED_QUERY_INSTRUCTIONS).substitute(
+            placeholders=", ".join(f"${number}" for number in range(1, len(values) + 1)),
+            values=", ".join(f"${number} = {value!r}" for number, value in enumerate(values, 1)),
+        )
+        prompt_request += instructions
+        if self.inflight is not None:
+            # The instructions carry the literal values, so only identical questions coalesce.
+            flight_key = ResponseCache.make_key(
+                prompt_request, self.system_message, parameters, self.schema_fingerprint
+            )
+            if flight_key in self.inflight.calls:
+                telemetry.counter(f"{self.stage_name}.coalesced")
+            response = await self.inflight.run(
+                flight_key, lambda: self.request_completion(prompt_request, parameters)
+            )
+        else:
+            response = await self.request_completion(prompt_request, parameters)
+        query = response.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if is_parameterized(query, len(values)):
+            self.response_cache.set(cache_key, query, self.schema_fingerprint)
+            return query, values
+
+        telemetry.counter(f"{self.stage_name}.skeleton_rejected")
+        if not PLACEHOLDER_PATTERN.search(query):
+            logger.warning("The model did not return a parameterized query, using it with the literals.")
+            return query, []
+        logger.warning("The model returned mismatched placeholders, generating the query directly.")
+        return await self.send_request(prompt_template, parameters), []
+
+
+class QueryGenerator(NLToSQLGenerator):
 
-class QueryGenerator(PromptGenerator):
+    stage_name = "query_generation"
 
     async def retrieve_context(self) -> str:
         return ""
@@ -82,10 +517,37 @@ class QueryGenerator(PromptGenerator):
         return query_request
 
 
-class ComplexQueryGenerator(PromptGenerator):
+class ComplexQueryGenerator(NLToSQLGenerator):
 
-    async def retrieve_context(self) -> str:
-        return ""
+    stage_name = "complex_query_generation"
+
+    def __init__(self, *args, schema_index: Optional[SchemaIndex] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.schema_index = schema_index
+        self.last_context_usage: dict = {}
+        self._full_schema_tokens: Optional[Tuple[tuple, int]] = None
+
+    def full_schema_tokens(self, db_mapping) -> int:
+        """
+        Token count of the unpruned schema, which is only logged next to the pruned one. It is
+        counted once per schema index and fingerprint instead of on every request.
+        """
+        key = (self.schema_index, self.schema_fingerprint)
+        if self._full_schema_tokens is None or self._full_schema_tokens[0] != key:
+            self._full_schema_tokens = (key, count_tokens(str(db_mapping)))
+        return self._full_schema_tokens[1]
+
+    async def retrieve_context(self, question: str = "") -> str:
+        """
+        Ranks the schema tables against the question with the `SchemaIndex` built at schema-load
+        time and renders only the relevant tables and their foreign-key neighbours.
+
+        Returns:
+            str: The pruned schema, one line per table, or an empty string when no index is configured.
+        """
+        if self.schema_index is None:
+            return ""
+        return self.schema_index.prune(question).render()
 
     async def retrieve_history(self) -> str:
         return ""
@@ -148,6 +610,20 @@ class ComplexQueryGenerator(PromptGenerator):
 
         query_request += " The database schema is $db_mapping."
 
+        db_mapping = await self.retrieve_context(prompt_template.prompt)
+        if db_mapping:
+            full_tokens = self.full_schema_tokens(prompt_template.db_mapping)
+            pruned_tokens = count_tokens(db_mapping)
+            self.last_context_usage = {"full_tokens": full_tokens, "pruned_tokens": pruned_tokens}
+            logger.info(
+                "Schema context pruned from %s to %s tokens (%.1f%% reduction).",
+                full_tokens,
+                pruned_tokens,
+                100 * (1 - pruned_tokens / max(full_tokens, 1)),
+            )
+        else:
+            db_mapping = prompt_template.db_mapping
+
         if prompt_template.programming_language:
             query_request += " The programming language is $programming_language."
 
@@ -155,13 +631,15 @@ class ComplexQueryGenerator(PromptGenerator):
             prompt=prompt_template.prompt,
             query_type=prompt_template.query_type,
             programming_language=prompt_template.programming_language,
-            db_mapping=prompt_template.db_mapping,
+            db_mapping=db_mapping,
             **prompt_template.db_params,
         )
         return query_request
 
 
-class TableToNaturalGenerator(PromptGenerator):
+class TableToNaturalGenerator(NLToSQLGenerator):
+
+    stage_name = "analysis"
 
     async def retrieve_context(self) -> str:
         return ""
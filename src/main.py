@@ -6,7 +6,26 @@ from dotenv import load_dotenv
 
 from llms import QueryGenerator, ComplexQueryGenerator, TableToNaturalGenerator
 from interfaces import QueryTemplate, ComplexQueryTemplate, TableToNaturalTemplate
-from database import PostgresDatabase, get_schema
+from engine_registry import EngineRegistry
+from config import (
+    ANALYSIS_TOKEN_BUDGET,
+    DB_IDLE_TIMEOUT,
+    DB_MAX_CONNECTIONS,
+    MAX_RESULT_BYTES,
+    MAX_RESULT_ROWS,
+    SCHEMA_TOP_K,
+    make_dispatcher,
+    make_engine,
+    make_rate_limiter,
+    make_response_cache,
+    save_workload_log,
+)
+from schema_cache import SchemaCache
+from schema_index import SchemaIndex
+from summarization import summarize_records
+from columnar import ColumnarResult
+from pipeline import StageGraph
+from telemetry import OpenCensusTelemetry, set_telemetry
 from prompts import QUERY_SYSTEM_MESSAGE, ANALYSIS_SYSTEM_MESSAGE
 
 
@@ -21,23 +40,55 @@ load_dotenv(dotenv_path)
 class ChatWithSQLHook:
 
     @staticmethod
-    async def test_query_generator():
+    async def test_query_generator(on_delta=None):
+        """
+        Runs the sample questions end to end. When `on_delta` is given, the analyses are streamed
+        and every content delta is forwarded as `on_delta(stage_name, delta)` as soon as it arrives.
+        """
         url: str = os.environ.get("GPT4V_URL", "")
         key: str = os.environ.get("GPT4V_KEY", "")
         az_monitor: str = os.environ.get("AZ_CONNECTION_LOG", "")
+        if az_monitor:
+            set_telemetry(OpenCensusTelemetry(az_monitor))
 
-        query_generator = QueryGenerator(aistudio_url=url, aistudio_key=key)
-        complex_query_generator = ComplexQueryGenerator(aistudio_url=url, aistudio_key=key)
-        table_to_natural_generator = TableToNaturalGenerator(aistudio_url=url, aistudio_key=key)
-        database_engine = PostgresDatabase(
-            host="localhost",
-            port=5432,
-            database="postgres",
-            user="admin",
-            password="admin",
+        registry = EngineRegistry(
+            engine_factory=make_engine,
+            max_connections=DB_MAX_CONNECTIONS,
+            idle_timeout=DB_IDLE_TIMEOUT,
+        )
+        registry.start()
+        # The last snapshot keys the cached responses without connecting first, so the simple
+        # branch does not wait for the database. The `schema` stage sets the current fingerprint.
+        snapshot = SchemaCache()
+        snapshot.load("postgres")
+        schema_fingerprint = snapshot.fingerprint if snapshot.tables is not None else None
+
+        response_cache = make_response_cache()
+        # The generators share the deployment, so they share its quotas.
+        rate_limiter = make_rate_limiter()
+
+        query_generator = QueryGenerator(
+            aistudio_url=url,
+            aistudio_key=key,
+            response_cache=response_cache,
+            schema_fingerprint=schema_fingerprint,
+            dispatcher=make_dispatcher(url, key),
+            rate_limiter=rate_limiter,
+        )
+        complex_query_generator = ComplexQueryGenerator(
+            aistudio_url=url,
+            aistudio_key=key,
+            response_cache=response_cache,
+            schema_fingerprint=schema_fingerprint,
+            dispatcher=make_dispatcher(url, key),
+            rate_limiter=rate_limiter,
+        )
+        table_to_natural_generator = TableToNaturalGenerator(
+            aistudio_url=url,
+            aistudio_key=key,
+            dispatcher=make_dispatcher(url, key),
+            rate_limiter=rate_limiter,
         )
-        await database_engine.connect()
-        database_schema = await get_schema(database_engine)
 
         query_generator.system_message = QUERY_SYSTEM_MESSAGE
         complex_query_generator.system_message = QUERY_SYSTEM_MESSAGE
@@ -55,17 +106,7 @@ class ChatWithSQLHook:
             }
         )
 
-        complex_schema = ComplexQueryTemplate(
-            prompt = "Retrieve the name from all categories which had products where sold for students on classroom 2.",
-            query_type = "Postgres",
-            programming_language = "SQL",
-            db_params = {
-                "database_name": "postgres",
-                "table_name": "categories",
-                "fields": ["category_name"],
-            },
-            db_mapping = database_schema,
-        )
+        complex_prompt = "Retrieve the name from all categories which had products where sold for students on classroom 2."
 
         parameters = {
             "temperature": 0.0,
@@ -73,35 +114,102 @@ class ChatWithSQLHook:
             "max_tokens": 2000,
         }
 
-        query_response = await query_generator.send_request(query_schema, parameters)  # type: ignore
-        assert isinstance(query_response, str)
-        print(query_response)
-
-        database_response = await database_engine.fetch(query_response)
-        print([dict(record) for record in database_response])
+        complex_db_params = {
+            "database_name": "postgres",
+            "table_name": "categories",
+            "fields": ["category_name"],
+        }
 
-        simple_table_schema = TableToNaturalTemplate(
-            prompt = "Explain the data in the following data, considering the original question provided.",
-            data = str([dict(record) for record in database_response]),
-            original_prompt=query_schema.prompt,
-        )
-        simple_analysis = await table_to_natural_generator.send_request(simple_table_schema, parameters)
-
-        complex_query_response = await complex_query_generator.send_request(complex_schema, parameters)  # type: ignore
-        assert isinstance(complex_query_response, str)
-        print(complex_query_response)
-    
-        complex_response = await database_engine.fetch(complex_query_response)
-        print([dict(record) for record in complex_response])
-
-        complex_table_schema = TableToNaturalTemplate(
-            prompt = "Evaluate if the dasta provided is sufficient to answer the user original question.",
-            data = str([dict(record) for record in complex_response]),
-            original_prompt=complex_schema.prompt
+        async def fetch_rows(query, database_name):
+            async with registry.lease(database_name) as tenant:
+                async with tenant.engine.stream(
+                    query,
+                    max_rows=MAX_RESULT_ROWS,
+                    max_bytes=MAX_RESULT_BYTES,
+                    guarded=True,
+                    cached=True,
+                ) as records:
+                    rows = await ColumnarResult.from_stream(records)
+            print(rows)
+            return rows, rows.truncated
+
+        async def schema():
+            async with registry.lease(complex_db_params["database_name"]) as tenant:
+                database_schema = await tenant.schema()
+            query_generator.schema_fingerprint = tenant.schema_cache.fingerprint
+            complex_query_generator.schema_fingerprint = tenant.schema_cache.fingerprint
+            complex_query_generator.schema_index = SchemaIndex(database_schema, top_k=SCHEMA_TOP_K)
+            return database_schema
+
+        async def simple_query():
+            query_response = await query_generator.send_request(query_schema, parameters)  # type: ignore
+            assert isinstance(query_response, str)
+            print(query_response)
+            return query_response
+
+        async def simple_rows(simple_query):
+            return await fetch_rows(simple_query, registry.route(query_schema))
+
+        async def analyse(stage, template):
+            if on_delta is None:
+                return await table_to_natural_generator.send_request(template, parameters)
+            deltas = []
+            async for delta in table_to_natural_generator.stream_request(template, parameters):
+                deltas.append(delta)
+                on_delta(stage, delta)
+            return "".join(deltas)
+
+        async def simple_analysis(simple_rows):
+            rows, truncated = simple_rows
+            simple_table_schema = TableToNaturalTemplate(
+                prompt = "Explain the data in the following data, considering the original question provided.",
+                data = summarize_records(rows, token_budget=ANALYSIS_TOKEN_BUDGET, truncated=truncated),
+                original_prompt=query_schema.prompt,
+            )
+            return await analyse("simple_analysis", simple_table_schema)
+
+        async def complex_query(schema):
+            complex_schema = ComplexQueryTemplate(
+                prompt = complex_prompt,
+                query_type = "Postgres",
+                programming_language = "SQL",
+                db_params = complex_db_params,
+                db_mapping = schema,
+            )
+            complex_query_response = await complex_query_generator.send_request(complex_schema, parameters)  # type: ignore
+            assert isinstance(complex_query_response, str)
+            print(complex_query_response)
+            return complex_query_response
+
+        async def complex_rows(complex_query):
+            return await fetch_rows(complex_query, complex_db_params["database_name"])
+
+        async def complex_analysis(complex_rows):
+            rows, truncated = complex_rows
+            complex_table_schema = TableToNaturalTemplate(
+                prompt = "Evaluate if the dasta provided is sufficient to answer the user original question.",
+                data = summarize_records(rows, token_budget=ANALYSIS_TOKEN_BUDGET, truncated=truncated),
+                original_prompt=complex_prompt,
+            )
+            return await analyse("complex_analysis", complex_table_schema)
+
+        graph = (
+            StageGraph()
+            .add("schema", schema)
+            .add("simple_query", simple_query)
+            .add("simple_rows", simple_rows, depends_on=["simple_query"])
+            .add("simple_analysis", simple_analysis, depends_on=["simple_rows"])
+            .add("complex_query", complex_query, depends_on=["schema"])
+            .add("complex_rows", complex_rows, depends_on=["complex_query"])
+            .add("complex_analysis", complex_analysis, depends_on=["complex_rows"])
         )
-        complex_analysis = await table_to_natural_generator.send_request(complex_table_schema, parameters)
-        
-        return f"\n\n**SIMPLE ANALYSIS**:\n{simple_analysis},\n\n**COMPLEX ANALYSIS**:\n{complex_analysis}"
+        try:
+            results = await graph.run()
+        finally:
+            await registry.close()
+            save_workload_log()
+
+        return f"\n\n**SIMPLE ANALYSIS**:\n{results['simple_analysis']},\n\n**COMPLEX ANALYSIS**:\n{results['complex_analysis']}"
 
 
 if __name__ == "__main__":
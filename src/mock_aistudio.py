@@ -0,0 +1,122 @@
+import json
+import random
+import asyncio
+
+import httpx
+
+
+PRODUCTS_SQL = (
+    "SELECT * FROM products WHERE product_name LIKE '%student%' AND product_name <> 'student loans';"
+)
+CATEGORIES_SQL = (
+    "SELECT DISTINCT c.category_name FROM categories c "
+    "JOIN products p ON p.category_id = c.category_id "
+    "JOIN purchases pu ON pu.product_id = p.product_id "
+    "JOIN student s ON s.student_id = pu.student_id "
+    "WHERE s.classroom_id = 2;"
+)
+ANALYSIS_TEXT = (
+    "The result lists the rows that match the original question. "
+    "The data is sufficient to answer it and no further query is required."
+)
+
+
+class MockAIStudio:
+    """
+    Local stand-in for the Azure AI Studio chat completions endpoint, mounted as an
+    `httpx.MockTransport`. It answers query prompts with canned SQL for the sample schema and
+    analysis prompts with a canned text, after a configurable latency.
+
+    Args:
+        latency (float): Base latency in seconds of every completion.
+        jitter (float): Mean of an exponential delay added to the base latency, which gives the
+            long tail real deployments show.
+        seed (Optional[int]): Seed of the jitter, for reproducible runs.
+        token_latency (float): Seconds the model takes per generated word. Completed responses
+            wait for all of them, streamed responses (`"stream": true`) send each word as a
+            server-sent event as soon as it is generated, followed by the usage when the request
+            sets `stream_options.include_usage`.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, seed=None, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    def delay(self):
+        if self.jitter:
+            return self.latency + self.random.expovariate(1 / self.jitter)
+        return self.latency
+
+    @staticmethod
+    def answer(payload):
+        system, user = (
+            "".join(part.get("text", "") for part in message["content"])
+            for message in payload["messages"][:2]
+        )
+        if "data analyst" in system:
+            return ANALYSIS_TEXT
+        if "categor" in user:
+            return CATEGORIES_SQL
+        return PRODUCTS_SQL
+
+    @staticmethod
+    def usage(request, content):
+        prompt_tokens = len(request.content) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    async def events(self, words, usage=None):
+        for index, word in enumerate(words):
+            await asyncio.sleep(self.token_latency)
+            delta = word if index == 0 else " " + word
+            chunk = {"model": "mock", "choices": [{"index": 0, "delta": {"content": delta}}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        if usage is not None:
+            chunk = {"model": "mock", "choices": [], "usage": usage}
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    async def handle(self, request):
+        self.requests += 1
+        payload = json.loads(request.content)
+        await asyncio.sleep(self.delay())
+        content = self.answer(payload)
+        words = content.split(" ")
+        usage = self.usage(request, content)
+        if payload.get("stream"):
+            if not (payload.get("stream_options") or {}).get("include_usage"):
+                usage = None
+            return httpx.Response(
+                200,
+                headers={"Content-Type": "text/event-stream"},
+                content=self.events(words, usage),
+            )
+        await asyncio.sleep(self.token_latency * len(words))
+        return httpx.Response(
+            200,
+            json={
+                "model": "mock",
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            },
+        )
+
+    def transport(self):
+        return httpx.MockTransport(self.handle)
+
+    def client(self):
+        return httpx.AsyncClient(transport=self.transport())
+
+    def attach(self, *generators):
+        """
+        Point the generators' HTTP clients at this mock, closing the ones they created.
+        """
+        for generator in generators:
+            generator.use_http_client(self.client(), owned=True)
@@ -0,0 +1,64 @@
+import time
+import asyncio
+import logging
+
+from telemetry import get_telemetry
+
+
+logger = logging.getLogger(__name__)
+
+
+class StageGraph:
+    """
+    Small async dependency graph. Each stage is a coroutine function that receives the results of
+    its dependencies as keyword arguments; stages whose dependencies are met run concurrently, so
+    the graph takes roughly as long as its longest branch.
+
+    After `run`, `timings` holds the seconds each stage spent running (excluding the time spent
+    waiting for its dependencies) and `elapsed` the wall time of the whole graph.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.timings = {}
+        self.elapsed = 0.0
+
+    def add(self, name, function, depends_on=()):
+        unknown = [dependency for dependency in depends_on if dependency not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on undefined stages: {unknown}")
+        self.stages[name] = (function, tuple(depends_on))
+        return self
+
+    async def run(self):
+        tasks = {}
+
+        async def run_stage(name, function, depends_on):
+            results = await asyncio.gather(*(tasks[dependency] for dependency in depends_on))
+            start = time.perf_counter()
+            try:
+                with get_telemetry().span(f"pipeline.{name}"):
+                    return await function(**dict(zip(depends_on, results)))
+            finally:
+                self.timings[name] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for name, (function, depends_on) in self.stages.items():
+            tasks[name] = asyncio.create_task(run_stage(name, function, depends_on))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            # Let the cancelled stages unwind, releasing what they hold, before the caller cleans up.
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+        logger.info(
+            "Pipeline finished in %.3fs. Stage latencies: %s",
+            self.elapsed,
+            {name: round(seconds, 3) for name, seconds in self.timings.items()},
+        )
+        return dict(zip(tasks, results))
@@ -22,4 +22,12 @@ ANALYSIS_SYSTEM_MESSAGE = """
     In your prompts, you will receive semantic requests to evaluate table results.\n
     Your role is to give a profound evaluation of the data you receive.\n
     Never include the description of the language, execution code, neither any kind of markdown.
-"""
\ No newline at end of file
+"""
+
+
+PARAMETERIZED_QUERY_INSTRUCTIONS = """
+    The question uses the placeholders $placeholders for literal values. Write the query with those
+    placeholders as query parameters instead of literal values, using each of them at least once and
+    never inlining their values. For pattern matches concatenate the wildcards, as in LIKE $$1 || '%'.
+    For reference only, the values of this question are: $values.
+"""
@@ -0,0 +1,126 @@
+import re
+import json
+import logging
+
+import asyncpg
+
+from interfaces import QueryRejection
+
+
+logger = logging.getLogger(__name__)
+
+# Quoted literals and identifiers are matched too, so comment markers inside them are kept.
+COMMENT_PATTERN = re.compile(
+    r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\$([A-Za-z_]\w*|)\$.*?\$\2\$)"
+    r"|--[^\n]*|/\*.*?\*/",
+    re.DOTALL,
+)
+READ_ONLY_PATTERN = re.compile(r"^\s*(\(\s*)*(select|with|values|table)\b", re.IGNORECASE)
+LIMIT_PATTERN = re.compile(
+    r"\blimit\s+(\d+|all)(\s+offset\s+\d+(\s+rows?)?)?\s*$"
+    r"|\bfetch\s+(first|next)\s+\d*\s*rows?\s+only\s*$",
+    re.IGNORECASE,
+)
+
+
+class QueryRejected(ValueError):
+    """
+    Raised when the pre-flight check refuses a query. `rejection` holds the structured reason
+    callers can feed back to the model to regenerate the query.
+    """
+
+    def __init__(self, rejection: QueryRejection):
+        super().__init__(rejection.message)
+        self.rejection = rejection
+
+
+class QueryGuard:
+    """
+    Pre-flight check for generated SQL. Queries without a `LIMIT` are wrapped with one, and the
+    statement that will run is planned with `EXPLAIN (FORMAT JSON)` and rejected when the planner
+    estimates exceed the thresholds. Guarded queries run in a read-only transaction with
+    `statement_timeout`.
+
+    Args:
+        max_cost (Optional[float]): Highest accepted planner total cost.
+        max_rows (Optional[float]): Highest accepted planner row estimate for queries that already
+            have a `LIMIT`; queries without one are limited instead of rejected.
+        default_limit (Optional[int]): `LIMIT` injected into queries that have none. `None`
+            disables the rewrite, so `max_rows` applies to every query.
+        statement_timeout (int): Timeout in milliseconds of guarded statements.
+    """
+
+    def __init__(self, max_cost=1e6, max_rows=1e6, default_limit=1000, statement_timeout=30000):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.default_limit = default_limit
+        self.statement_timeout = statement_timeout
+
+    @staticmethod
+    def normalize(query):
+        """
+        `query` without its comments and trailing semicolons, so a commented-out `LIMIT` is not
+        taken for a real one.
+        """
+        query = COMMENT_PATTERN.sub(lambda match: match.group(1) or " ", query)
+        return query.strip().rstrip(";").strip()
+
+    def add_limit(self, query):
+        if self.default_limit is None or LIMIT_PATTERN.search(query):
+            return query
+        return f"SELECT * FROM (\n{query}\n) AS guarded_query LIMIT {int(self.default_limit)}"
+
+    async def explain(self, connection, query, *args):
+        plan = await connection.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]["Plan"]
+
+    async def check(self, connection, query, *args):
+        """
+        Plan `query` on `connection` and return the statement to run in its place.
+
+        Raises:
+            QueryRejected: If the query is not a read-only statement, cannot be planned, or its
+                estimated cost or rows exceed the thresholds.
+        """
+        query = self.normalize(query)
+        if not READ_ONLY_PATTERN.match(query):
+            raise QueryRejected(
+                QueryRejection(
+                    query=query,
+                    reason="not_read_only",
+                    message="Only read-only SELECT statements can be executed.",
+                )
+            )
+
+        guarded_query = self.add_limit(query)
+        try:
+            plan = await self.explain(connection, guarded_query, *args)
+        except asyncpg.PostgresError as exc:
+            raise QueryRejected(
+                QueryRejection(query=query, reason="invalid", message=str(exc))
+            ) from exc
+
+        cost, rows = plan["Total Cost"], plan["Plan Rows"]
+
+        rejection = None
+        if self.max_cost is not None and cost > self.max_cost:
+            rejection = ("cost", f"Estimated cost {cost} exceeds the limit of {self.max_cost}.")
+        elif self.max_rows is not None and rows > self.max_rows and guarded_query == query:
+            rejection = ("rows", f"Estimated {rows} rows exceed the limit of {self.max_rows}.")
+
+        if rejection is not None:
+            logger.warning("Query rejected by pre-flight check: %s", rejection[1])
+            raise QueryRejected(
+                QueryRejection(
+                    query=query,
+                    reason=rejection[0],
+                    message=rejection[1],
+                    estimated_cost=cost,
+                    estimated_rows=rows,
+                )
+            )
+
+        logger.debug("Query accepted. Estimated cost: %s, rows: %s", cost, rows)
+        return guarded_query
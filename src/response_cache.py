@@ -0,0 +1,146 @@
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from collections import OrderedDict
+
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class ResponseCache:
+    """
+    Cache of generated responses keyed by the prepared prompt, the system message, the
+    generation parameters and the schema fingerprint.
+
+    Entries live in an in-memory LRU with a TTL. When `path` is given they are also written to a
+    SQLite file, so a restarted process still answers repeated questions without a model round
+    trip. Writes are committed in batches, once `commit_every` are pending or `commit_interval`
+    seconds after the last commit, and on `flush` or `close`, so the event loop does not wait on
+    a disk sync per response. A crash loses at most the uncommitted batch.
+
+    Args:
+        max_entries (int): Entries kept in memory before the least recently used is evicted.
+        ttl (Optional[float]): Seconds an entry stays valid. `None` keeps entries until evicted.
+        path (Optional[str]): SQLite file backing the in-memory cache.
+        commit_every (int): Pending writes that trigger a commit.
+        commit_interval (float): Seconds after which pending writes are committed by the next
+            write.
+    """
+
+    def __init__(
+        self, max_entries=1024, ttl=3600, path=None, commit_every=100, commit_interval=1.0
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        self.committed_at = time.monotonic()
+        self.connection = None
+        if path:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT, fingerprint TEXT, expires_at REAL)"
+            )
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(prompt, system_message, parameters, fingerprint=None):
+        content = json.dumps(
+            [
+                WHITESPACE_PATTERN.sub(" ", prompt).strip(),
+                WHITESPACE_PATTERN.sub(" ", system_message).strip(),
+                parameters,
+                fingerprint,
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None and self.connection is not None:
+            entry = self.connection.execute(
+                "SELECT value, fingerprint, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if entry is not None:
+                self._remember(key, entry)
+
+        if entry is None or (entry[2] is not None and entry[2] < time.time()):
+            if entry is not None:
+                self.delete(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, fingerprint=None):
+        entry = (value, fingerprint, time.time() + self.ttl if self.ttl else None)
+        self._remember(key, entry)
+        if self.connection is not None:
+            self._write("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, *entry))
+
+    def delete(self, key):
+        self.entries.pop(key, None)
+        if self.connection is not None:
+            self._write("DELETE FROM responses WHERE key = ?", (key,))
+
+    def invalidate(self, fingerprint):
+        """
+        Drop every entry generated against the schema identified by `fingerprint`.
+        """
+        for key in [key for key, entry in self.entries.items() if entry[1] == fingerprint]:
+            del self.entries[key]
+        if self.connection is not None:
+            self._write("DELETE FROM responses WHERE fingerprint = ?", (fingerprint,))
+
+    def clear(self):
+        self.entries.clear()
+        if self.connection is not None:
+            self._write("DELETE FROM responses")
+
+    def flush(self):
+        if self.connection is not None and self.pending:
+            self.connection.commit()
+        self.pending = 0
+        self.committed_at = time.monotonic()
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def _write(self, statement, parameters=()):
+        self.connection.execute(statement, parameters)
+        self.pending += 1
+        if (
+            self.pending >= self.commit_every
+            or time.monotonic() - self.committed_at >= self.commit_interval
+        ):
+            self.flush()
+
+    def _remember(self, key, entry):
+        self.entries[key] = tuple(entry)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
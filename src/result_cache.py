@@ -0,0 +1,257 @@
+import re
+import time
+import pickle
+import hashlib
+import logging
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+IDENTIFIER_PATTERN = re.compile(r"[a-z_][a-z0-9_$]*")
+
+# TRUNCATE leaves the modification counters alone but gives the table a new relfilenode, so
+# both are part of the version.
+TABLE_VERSIONS_QUERY = """
+SELECT
+    relname AS table_name,
+    string_agg(
+        concat(n_tup_ins + n_tup_upd + n_tup_del, '.', pg_relation_filenode(relid)),
+        ',' ORDER BY relid
+    ) AS version
+FROM pg_catalog.pg_stat_user_tables
+GROUP BY relname
+"""
+
+CHANGE_TRIGGER_DDL = """
+CREATE OR REPLACE FUNCTION {channel}_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {channel}_trigger ON {table};
+CREATE TRIGGER {channel}_trigger AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+    FOR EACH STATEMENT EXECUTE FUNCTION {channel}_notify();
+"""
+
+TRACKED_TABLES_QUERY = """
+SELECT DISTINCT c.relname AS table_name
+FROM pg_catalog.pg_trigger t
+JOIN pg_catalog.pg_class c ON c.oid = t.tgrelid
+WHERE t.tgname = $1
+"""
+
+
+def normalize_sql(query):
+    """
+    Lowercase and collapse whitespace outside quoted literals and identifiers, so queries that
+    only differ in formatting share a cache entry.
+    """
+    parts = QUOTED_PATTERN.split(query.strip().rstrip(";"))
+    return "".join(
+        part if index % 2 else WHITESPACE_PATTERN.sub(" ", part.lower())
+        for index, part in enumerate(parts)
+    ).strip()
+
+
+def referenced_names(normalized_query):
+    names = set()
+    for index, part in enumerate(QUOTED_PATTERN.split(normalized_query)):
+        if index % 2 == 0:
+            names.update(IDENTIFIER_PATTERN.findall(part))
+        elif part.startswith('"'):
+            names.add(part[1:-1].replace('""', '"'))
+    return names
+
+
+class CachedRecord:
+    """
+    Read-only stand-in for `asyncpg.Record` rebuilt from a cache entry. Supports access by
+    position or column name, `keys()`, `values()`, `items()`, `get()` and `dict(record)`.
+    """
+
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return "<CachedRecord " + " ".join(f"{key}={value!r}" for key, value in self.items()) + ">"
+
+    def get(self, key, default=None):
+        return self[key] if key in self._index else default
+
+    def keys(self):
+        return iter(self._index)
+
+    def values(self):
+        return iter(self._values)
+
+    def items(self):
+        return zip(self._index, self._values)
+
+
+class ResultCache:
+    """
+    Memory-bounded LRU cache of executed query results for `PostgresDatabase`.
+
+    Entries are keyed by the normalised SQL and its parameters and stored pickled, which is both
+    compact and immune to callers mutating the returned rows. Each entry remembers the versions
+    of the tables its query mentions, read before the query runs; a table version combines its
+    `pg_stat_user_tables` modification counters and its relfilenode, polled at most every
+    `check_interval` seconds, or is replaced by the NOTIFY trigger once `listen` is active.
+    Entries whose tables changed are dropped on lookup.
+
+    Polling is only eventually consistent: a backend publishes its modification counters when
+    its statistics are flushed, about a second after an idle commit and up to a minute under
+    load, so a cached result can outlive a write by that delay plus `check_interval`. With a
+    `channel`, `PostgresDatabase.connect` calls `listen` instead, and results are only cached for
+    queries whose tables all carry the trigger of `install_change_trigger`.
+
+    Args:
+        max_bytes (int): Memory budget of the encoded entries.
+        check_interval (float): Minimum seconds between two polls of the table counters.
+        ttl (Optional[float]): Upper bound on the age of an entry, which also covers views and
+            functions whose underlying tables cannot be tracked.
+        channel (Optional[str]): NOTIFY channel of the change triggers. `None` polls the table
+            counters.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, check_interval=1.0, ttl=300, channel=None):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.ttl = ttl
+        self.channel = channel
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.versions = {}
+        self.checked_at = 0.0
+        self.listening = False
+        self.tracked = set()
+        self.notifications = 0
+
+    @staticmethod
+    def make_key(query, args):
+        content = pickle.dumps((normalize_sql(query), args), protocol=pickle.HIGHEST_PROTOCOL)
+        return hashlib.sha256(content).hexdigest()
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "bytes": self.size}
+
+    async def refresh_versions(self, db, force=False):
+        if self.listening and self.versions and not force:
+            return self.versions
+        if not force and time.monotonic() - self.checked_at < self.check_interval:
+            return self.versions
+        self.versions = {
+            row["table_name"]: row["version"] for row in await db.fetch(TABLE_VERSIONS_QUERY)
+        }
+        self.checked_at = time.monotonic()
+        return self.versions
+
+    async def get(self, db, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        payload, table_versions, stored_at = entry
+        versions = await self.refresh_versions(db)
+        expired = self.ttl is not None and time.monotonic() - stored_at > self.ttl
+        if expired or any(versions.get(table) != version for table, version in table_versions):
+            self.delete(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        names, rows = pickle.loads(payload)
+        index = {name: position for position, name in enumerate(names)}
+        return [CachedRecord(index, row) for row in rows]
+
+    async def table_versions(self, db, query):
+        """
+        Versions of the tables `query` mentions. Read them before running the query, so a write
+        that lands while it runs makes the entry look stale rather than current. Returns `None`
+        when listening and the query mentions a table without the change trigger, whose writes
+        would go unnoticed.
+        """
+        versions = await self.refresh_versions(db)
+        tables = referenced_names(normalize_sql(query)).intersection(versions)
+        if self.listening and not tables <= self.tracked:
+            return None
+        return tuple((table, versions[table]) for table in tables)
+
+    def set(self, key, records, table_versions):
+        if table_versions is None:
+            return
+        records = list(records)
+        names = list(records[0].keys()) if records else []
+        try:
+            payload = pickle.dumps(
+                (names, [tuple(record.values()) for record in records]),
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        except (pickle.PicklingError, TypeError) as exc:
+            logger.debug("Result not cacheable: %s", str(exc))
+            return
+        if len(payload) > self.max_bytes:
+            return
+
+        self.delete(key)
+        self.entries[key] = (payload, table_versions, time.monotonic())
+        self.size += len(payload)
+        while self.size > self.max_bytes:
+            _, (evicted, _, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def delete(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def table_changed(self, *payload):
+        table = payload[-1]
+        self.notifications += 1
+        self.versions[table] = f"notified.{self.notifications}"
+
+    async def listen(self, db, channel=None):
+        """
+        Switch from polling `pg_stat_user_tables` to push invalidation: the versions are read once
+        and then only replaced by notifications on `channel`, which defaults to `self.channel`.
+        Only the tables carrying the trigger of `install_change_trigger` are cached from then on.
+        """
+        channel = channel or self.channel or "table_changed"
+        await db.add_listener(channel, self.table_changed)
+        self.tracked = {
+            row["table_name"] for row in await db.fetch(TRACKED_TABLES_QUERY, f"{channel}_trigger")
+        }
+        await self.refresh_versions(db, force=True)
+        self.listening = True
+
+
+async def install_change_trigger(db, table, channel="table_changed"):
+    await db.execute(CHANGE_TRIGGER_DDL.format(channel=channel, table=table))
@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+
+from database import introspect_schema
+from schema_model import Schema
+
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = os.path.dirname(__file__)
+DEFAULT_CACHE_DIR = os.environ.get("SCHEMA_CACHE_DIR", os.path.join(CURRENT_DIR, ".schema_cache"))
+
+# One row per table whose hash changes whenever its pg_class, pg_attribute or pg_constraint rows
+# are rewritten by DDL, or its table and column comments are edited. COMMENT ON only writes
+# pg_description, so the comments are hashed themselves. Reading catalog rows never touches
+# user data.
+SCHEMA_FINGERPRINT_QUERY = """
+SELECT
+    c.relname AS table_name,
+    md5(
+        c.xmin::text
+        || ':' || string_agg(
+            a.attnum::text || '.' || a.xmin::text
+            || '.' || COALESCE(md5(col_description(c.oid, a.attnum)), ''),
+            ',' ORDER BY a.attnum
+        )
+        || ':' || COALESCE(md5(obj_description(c.oid, 'pg_class')), '')
+        || ':' || COALESCE((
+            SELECT string_agg(con.xmin::text, ',' ORDER BY con.oid)
+            FROM pg_catalog.pg_constraint AS con
+            WHERE con.conrelid = c.oid
+        ), '')
+    ) AS fingerprint
+FROM pg_catalog.pg_class AS c
+    JOIN pg_catalog.pg_namespace AS n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_attribute AS a ON a.attrelid = c.oid
+WHERE n.nspname = $1
+    AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+    AND a.attnum > 0
+    AND NOT a.attisdropped
+GROUP BY c.oid, c.relname, c.xmin
+"""
+
+NOTIFY_TRIGGER_DDL = """
+CREATE OR REPLACE FUNCTION {channel}_notify() RETURNS event_trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', tg_tag);
+END;
+$$ LANGUAGE plpgsql;
+
+DROP EVENT TRIGGER IF EXISTS {channel}_trigger;
+CREATE EVENT TRIGGER {channel}_trigger ON ddl_command_end EXECUTE FUNCTION {channel}_notify();
+"""
+
+
+async def get_fingerprints(db, schema="public"):
+    return {
+        row["table_name"]: row["fingerprint"]
+        for row in await db.fetch(SCHEMA_FINGERPRINT_QUERY, schema)
+    }
+
+
+def combine_fingerprints(fingerprints):
+    digest = hashlib.sha256()
+    for table_name in sorted(fingerprints):
+        digest.update(f"{table_name}={fingerprints[table_name]};".encode())
+    return digest.hexdigest()
+
+
+class SchemaCache:
+    """
+    On-disk cache of introspected schemas keyed by database and schema name.
+
+    Freshness is checked with a per-table catalog fingerprint, so a warm start costs a single
+    catalog query and only tables whose fingerprint changed are introspected again. When `listen`
+    is active, DDL notifications mark the snapshot stale and the fingerprint query is skipped
+    entirely until the next change.
+
+    With `statistics`, tables also carry row estimates and indexes. These are refreshed together
+    with the DDL, so the row estimates can lag behind the data.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, schema="public", statistics=False):
+        self.cache_dir = cache_dir
+        self.schema = schema
+        self.statistics = statistics
+        self.tables = None
+        self.fingerprints = {}
+        self.listening = False
+        self.stale = True
+        self.lock = asyncio.Lock()
+
+    @property
+    def fingerprint(self):
+        return combine_fingerprints(self.fingerprints)
+
+    def cache_path(self, database):
+        return os.path.join(self.cache_dir, f"{database}.{self.schema}.json")
+
+    def load(self, database):
+        path = self.cache_path(database)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as cache_file:
+                content = json.load(cache_file)
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable schema cache %s: %s", path, str(exc))
+            return
+
+        self.fingerprints = content["fingerprints"]
+        self.tables = Schema.from_dict(content["tables"])
+
+    def save(self, database):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.cache_path(database)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as cache_file:
+            json.dump({"fingerprints": self.fingerprints, "tables": self.tables.to_dict()}, cache_file)
+        os.replace(f"{path}.tmp", path)
+
+    def invalidate(self, *_):
+        self.stale = True
+
+    async def refresh(self, db):
+        if self.tables is None:
+            self.load(db.database)
+
+        fingerprints = await get_fingerprints(db, self.schema)
+        changed = [
+            table_name
+            for table_name, fingerprint in fingerprints.items()
+            if self.fingerprints.get(table_name) != fingerprint
+        ]
+        removed = [table_name for table_name in self.fingerprints if table_name not in fingerprints]
+
+        if self.tables is not None and not changed and not removed:
+            logger.info("Schema cache for %s.%s is fresh", db.database, self.schema)
+            return
+
+        if self.tables is None:
+            self.tables = await introspect_schema(db, self.schema, statistics=self.statistics)
+        elif changed:
+            self.tables.update(
+                await introspect_schema(db, self.schema, changed, statistics=self.statistics)
+            )
+        for table_name in removed:
+            self.tables.pop(table_name, None)
+
+        logger.info(
+            "Schema cache for %s.%s refreshed. Changed: %s, removed: %s",
+            db.database,
+            self.schema,
+            len(changed),
+            len(removed),
+        )
+        self.fingerprints = fingerprints
+        self.save(db.database)
+
+    async def get_tables(self, db):
+        # Concurrent callers share one refresh instead of each running the catalog queries.
+        async with self.lock:
+            if self.stale or not self.listening:
+                # Cleared first, so a DDL notification arriving during the refresh is kept.
+                self.stale = False
+                try:
+                    await self.refresh(db)
+                except BaseException:
+                    self.stale = True
+                    raise
+        return self.tables
+
+    async def listen(self, db, channel="schema_changed"):
+        """
+        Subscribe to DDL notifications on `channel` so the fingerprint check only runs after a
+        change. Pair with `install_notify_trigger`, which needs a superuser once per database.
+        """
+        await db.add_listener(channel, self.invalidate)
+        self.listening = True
+
+
+async def install_notify_trigger(db, channel="schema_changed"):
+    await db.execute(NOTIFY_TRIGGER_DDL.format(channel=channel))
@@ -0,0 +1,110 @@
+import re
+import math
+from collections import Counter
+
+
+TOKEN_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+STOP_WORDS = {
+    "a", "all", "an", "and", "are", "as", "at", "be", "by", "for", "from", "had", "has", "have",
+    "in", "is", "it", "not", "of", "on", "or", "that", "the", "their", "this", "to", "was",
+    "were", "which", "with", "where", "who", "retrieve", "information", "name", "id",
+}
+
+
+def tokenize(text):
+    """
+    Split free text and identifiers (`snake_case`, `camelCase`) into lowercase terms with a
+    naive plural strip, so `students` in a question matches the `student` table.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text or ""):
+        token = token.lower()
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+
+class SchemaIndex:
+    """
+    BM25 index over the tables of an introspected schema, built once at schema-load time.
+
+    Every table is a document made of its name (weighted twice), column names and comments.
+    `prune` keeps the `top_k` best scoring tables for a question and expands them with their
+    foreign-key neighbours so the generated joins stay resolvable.
+
+    Args:
+        tables (Schema): Output of `database.introspect_schema`.
+        top_k (Optional[int]): Tables kept before expansion. `None` disables pruning, which is
+            the full-schema baseline.
+        expand_foreign_keys (bool): Whether to add tables one foreign-key hop away.
+    """
+
+    def __init__(self, tables, top_k=5, expand_foreign_keys=True, k1=1.5, b=0.75):
+        self.tables = tables
+        self.top_k = top_k
+        self.expand_foreign_keys = expand_foreign_keys
+        self.k1 = k1
+        self.b = b
+
+        self.documents = {
+            table_name: Counter(self._document_terms(table_name, table))
+            for table_name, table in tables.items()
+        }
+        self.lengths = {name: sum(terms.values()) for name, terms in self.documents.items()}
+        self.average_length = sum(self.lengths.values()) / max(len(self.lengths), 1)
+
+        frequencies = Counter(term for terms in self.documents.values() for term in terms)
+        total = len(self.documents)
+        self.idf = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in frequencies.items()
+        }
+
+        self.neighbours = {table_name: set() for table_name in tables}
+        for table_name, table in tables.items():
+            for foreign_table, _ in table.foreign_keys.values():
+                if foreign_table in self.neighbours and foreign_table != table_name:
+                    self.neighbours[table_name].add(foreign_table)
+                    self.neighbours[foreign_table].add(table_name)
+
+    @staticmethod
+    def _document_terms(table_name, table):
+        terms = tokenize(table_name) * 2 + tokenize(table.comment)
+        for column_name, _, comment in table.columns:
+            terms += tokenize(column_name) + tokenize(comment)
+        return terms
+
+    def search(self, question):
+        terms = [term for term in tokenize(question) if term in self.idf]
+        scores = {}
+        for table_name, document in self.documents.items():
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[table_name] / self.average_length)
+            score = sum(
+                self.idf[term] * document[term] * (self.k1 + 1) / (document[term] + norm)
+                for term in terms
+                if term in document
+            )
+            if score > 0:
+                scores[table_name] = score
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    def relevant_tables(self, question):
+        if self.top_k is None:
+            return list(self.tables)
+
+        selected = [table_name for table_name, _ in self.search(question)[: self.top_k]]
+        if not selected:
+            return list(self.tables)
+        if self.expand_foreign_keys:
+            expanded = set(selected)
+            for table_name in selected:
+                expanded |= self.neighbours[table_name]
+            selected += sorted(expanded.difference(selected))
+        return selected
+
+    def prune(self, question):
+        return self.tables.subset(self.relevant_tables(question))
@@ -0,0 +1,204 @@
+TYPE_ABBREVIATIONS = {
+    "character varying": "varchar",
+    "character": "char",
+    "timestamp without time zone": "timestamp",
+    "timestamp with time zone": "timestamptz",
+    "time without time zone": "time",
+    "time with time zone": "timetz",
+    "double precision": "float8",
+}
+
+
+def abbreviate_type(data_type):
+    for name, abbreviation in TYPE_ABBREVIATIONS.items():
+        if data_type.startswith(name):
+            return abbreviation + data_type[len(name):]
+    return data_type
+
+
+class Column:
+    __slots__ = ("name", "data_type", "comment")
+
+    def __init__(self, name, data_type, comment=None):
+        self.name = name
+        self.data_type = data_type
+        self.comment = comment
+
+    def __iter__(self):
+        return iter((self.name, self.data_type, self.comment))
+
+    def __repr__(self):
+        return f"Column({self.name!r}, {self.data_type!r})"
+
+
+class Table:
+    """
+    One table of an introspected schema. `foreign_keys` maps a column name to its
+    `(foreign_table, foreign_column)`, `indexes` holds the column names of every index, and
+    `row_count` is the planner estimate, or None when statistics were not read.
+    """
+
+    __slots__ = (
+        "name",
+        "comment",
+        "columns",
+        "primary_key",
+        "foreign_keys",
+        "row_count",
+        "indexes",
+        "_rendered",
+    )
+
+    def __init__(
+        self,
+        name,
+        columns=(),
+        primary_key=(),
+        foreign_keys=None,
+        comment=None,
+        row_count=None,
+        indexes=(),
+    ):
+        self.name = name
+        self.comment = comment
+        self.columns = list(columns)
+        self.primary_key = list(primary_key)
+        self.foreign_keys = dict(foreign_keys or {})
+        self.row_count = row_count
+        self.indexes = [tuple(index) for index in indexes]
+        self._rendered = None
+
+    def __repr__(self):
+        return f"Table({self.name!r}, columns={len(self.columns)})"
+
+    def render(self):
+        """
+        One DDL-like line, e.g. `student(student_id integer PK, classroom_id integer FK
+        classroom.classroom_id) ~1200 rows`. Computed once; call `invalidate` after mutating
+        the table.
+        """
+        if self._rendered is None:
+            columns = []
+            for column in self.columns:
+                text = f"{column.name} {abbreviate_type(column.data_type)}"
+                if column.name in self.primary_key:
+                    text += " PK"
+                if column.name in self.foreign_keys:
+                    text += " FK {}.{}".format(*self.foreign_keys[column.name])
+                if column.comment:
+                    text += f" [{column.comment}]"
+                columns.append(text)
+
+            line = f"{self.name}({', '.join(columns)})"
+            if self.row_count is not None:
+                line += f" ~{self.row_count} rows"
+            if self.indexes:
+                line += " indexed on " + ", ".join(f"({', '.join(index)})" for index in self.indexes)
+            if self.comment:
+                line += f" -- {self.comment}"
+            self._rendered = line
+        return self._rendered
+
+    def invalidate(self):
+        self._rendered = None
+
+    def to_dict(self):
+        return {
+            "comment": self.comment,
+            "columns": [list(column) for column in self.columns],
+            "primary_key": self.primary_key,
+            "foreign_keys": self.foreign_keys,
+            "row_count": self.row_count,
+            "indexes": self.indexes,
+        }
+
+    @classmethod
+    def from_dict(cls, name, content):
+        return cls(
+            name,
+            columns=[Column(*column) for column in content["columns"]],
+            primary_key=content["primary_key"],
+            foreign_keys={
+                column: tuple(target) for column, target in content["foreign_keys"].items()
+            },
+            comment=content.get("comment"),
+            row_count=content.get("row_count"),
+            indexes=content.get("indexes", ()),
+        )
+
+
+class Schema:
+    """
+    Tables of a database schema, keyed by table name and kept in introspection order.
+
+    `str(schema)` is the prompt representation: one `Table.render` line per table, which carries
+    every column exactly once and keeps identically named columns of different tables apart.
+    The rendering is memoized and reset by `update`, `pop` and item assignment.
+    """
+
+    __slots__ = ("tables", "_rendered")
+
+    def __init__(self, tables=()):
+        self.tables = {table.name: table for table in tables}
+        self._rendered = None
+
+    def __getitem__(self, table_name):
+        return self.tables[table_name]
+
+    def __setitem__(self, table_name, table):
+        self.tables[table_name] = table
+        self._rendered = None
+
+    def __contains__(self, table_name):
+        return table_name in self.tables
+
+    def __iter__(self):
+        return iter(self.tables)
+
+    def __len__(self):
+        return len(self.tables)
+
+    def __bool__(self):
+        return bool(self.tables)
+
+    def __str__(self):
+        return self.render()
+
+    def __repr__(self):
+        return f"Schema({list(self.tables)})"
+
+    def get(self, table_name, default=None):
+        return self.tables.get(table_name, default)
+
+    def items(self):
+        return self.tables.items()
+
+    def values(self):
+        return self.tables.values()
+
+    def update(self, other):
+        self.tables.update(other.items())
+        self._rendered = None
+
+    def pop(self, table_name, default=None):
+        self._rendered = None
+        return self.tables.pop(table_name, default)
+
+    def subset(self, table_names):
+        """
+        Schema restricted to `table_names`, in that order. Tables are shared, so their
+        memoized renderings are reused.
+        """
+        return Schema(self.tables[table_name] for table_name in table_names)
+
+    def render(self):
+        if self._rendered is None:
+            self._rendered = "\n".join(table.render() for table in self.tables.values())
+        return self._rendered
+
+    def to_dict(self):
+        return {table_name: table.to_dict() for table_name, table in self.tables.items()}
+
+    @classmethod
+    def from_dict(cls, content):
+        return cls(Table.from_dict(table_name, table) for table_name, table in content.items())
@@ -0,0 +1,529 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from collections import deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from telemetry import get_telemetry
+
+
+# Only the standard library, dotenv and `telemetry` are imported here. The generators, asyncpg,
+# tiktoken and the Azure Monitor exporters pulled in by `aistudio_requests` are imported by
+# `NLToSQLService.warm_up`, so their cost is a startup phase of its own and `--help` stays instant.
+
+MODULE_LOADED = time.perf_counter()
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO)
+
+CURRENT_DIR = os.path.dirname(__file__)
+dotenv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env")
+load_dotenv(dotenv_path)
+
+PARAMETERS = {
+    "temperature": 0.0,
+    "top_p": 0.95,
+    "max_tokens": 2000,
+}
+ANALYSIS_PROMPT = "Explain the data in the following data, considering the original question provided."
+HTTP_STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+
+def error_status(exc):
+    if hasattr(exc, "rejection"):
+        return 422
+    if isinstance(exc, LookupError):
+        return 404
+    if isinstance(exc, (ValueError, TypeError)):
+        return 400
+    return 500
+
+
+def error_body(exc):
+    body = {"error": f"{type(exc).__name__}: {exc}"}
+    if hasattr(exc, "rejection"):
+        body["rejection"] = exc.rejection.model_dump()
+    return body
+
+
+class NLToSQLService:
+    """
+    Long-running NL to SQL pipeline that keeps its generators, HTTP connections, database pools
+    and schemas warm across requests.
+
+    `warm_up` imports the pipeline modules, builds one shared HTTP client and the generators,
+    connects the default database, loads its schema and tokenizer, and optionally answers a few
+    questions to prime the caches. Each of these phases is timed into `startup`, so cold start and
+    per-request overhead are reported separately by `stats`. Requests made before `warm_up` run it
+    first.
+
+    Every database gets its own query generators, keyed to its schema fingerprint so cached
+    answers are dropped when its schema changes. The schema index of its `ComplexQueryGenerator`
+    is built on the first complex question and rebuilt only after such a change. The generators
+    are released when the registry closes the engine of their database.
+
+    Args:
+        database_name (str): Database of the questions that do not name one in `db_params`.
+        concurrency (int): Requests answered at the same time, further ones wait.
+        window (int): Number of recent request latencies `stats` is computed over.
+    """
+
+    def __init__(self, database_name="postgres", concurrency=8, window=1000):
+        self.database_name = database_name
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.startup = {}
+        self.ready = False
+        self.warming = asyncio.Lock()
+        self.latencies = deque(maxlen=window)
+        self.overheads = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.registry = None
+        self.http_client = None
+        self.response_cache = None
+        self.rate_limiter = None
+        self.analysis_generator = None
+        self.generators = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup[name] = (time.perf_counter() - start) * 1000
+
+    def generator_settings(self):
+        from config import make_dispatcher
+
+        url: str = os.environ.get("GPT4V_URL", "")
+        key: str = os.environ.get("GPT4V_KEY", "")
+        return {
+            "aistudio_url": url,
+            "aistudio_key": key,
+            "dispatcher": make_dispatcher(url, key),
+            "rate_limiter": self.rate_limiter,
+            "http_client": self.http_client,
+        }
+
+    async def warm_up(self, questions=()):
+        """
+        Bring the service to its steady state and record the duration of every phase in
+        milliseconds. Later calls return at once.
+        """
+        async with self.warming:
+            if self.ready:
+                return self.startup
+            start = time.perf_counter()
+
+            with self.phase("imports"):
+                # pylint: disable=import-outside-toplevel
+                import httpx
+                from config import (
+                    DB_IDLE_TIMEOUT,
+                    DB_MAX_CONNECTIONS,
+                    make_engine,
+                    make_rate_limiter,
+                    make_response_cache,
+                )
+                from llms import TableToNaturalGenerator
+                from dispatch import DEFAULT_TIMEOUT
+                from engine_registry import EngineRegistry
+                from telemetry import OpenCensusTelemetry, set_telemetry
+                from tokenizer import get_encoding
+                from prompts import ANALYSIS_SYSTEM_MESSAGE
+
+            with self.phase("clients"):
+                az_monitor: str = os.environ.get("AZ_CONNECTION_LOG", "")
+                if az_monitor:
+                    set_telemetry(OpenCensusTelemetry(az_monitor))
+                self.http_client = httpx.AsyncClient(timeout=DEFAULT_TIMEOUT)
+                self.response_cache = make_response_cache()
+                self.rate_limiter = make_rate_limiter()
+                self.analysis_generator = TableToNaturalGenerator(**self.generator_settings())
+                self.analysis_generator.system_message = ANALYSIS_SYSTEM_MESSAGE
+
+            with self.phase("database"):
+                self.registry = EngineRegistry(
+                    engine_factory=make_engine,
+                    max_connections=DB_MAX_CONNECTIONS,
+                    idle_timeout=DB_IDLE_TIMEOUT,
+                    on_close=self.release_generators,
+                )
+                self.registry.start()
+                async with self.registry.lease(self.database_name) as tenant:
+                    with self.phase("schema"):
+                        await self.tenant_generator(tenant, complex_query=True)
+
+            with self.phase("tokenizer"):
+                get_encoding()
+
+            if questions:
+                with self.phase("questions"):
+                    for question in questions:
+                        await self.answer(question)
+
+            self.startup["total"] = (time.perf_counter() - start) * 1000
+            self.ready = True
+            logger.info("Service ready. Startup phases in ms: %s", self.startup)
+            return self.startup
+
+    async def tenant_generator(self, tenant, complex_query=False):
+        """
+        Query generator of a leased database, or its complex query generator with a schema index
+        matching its current schema fingerprint.
+        """
+        from llms import QueryGenerator, ComplexQueryGenerator
+        from schema_index import SchemaIndex
+        from prompts import QUERY_SYSTEM_MESSAGE
+        from config import SCHEMA_TOP_K
+
+        schema = await tenant.schema()
+        fingerprint = tenant.schema_cache.fingerprint
+        generators = self.generators.get(tenant.name)
+        if generators is None:
+            generators = (
+                QueryGenerator(
+                    response_cache=self.response_cache,
+                    schema_fingerprint=fingerprint,
+                    **self.generator_settings(),
+                ),
+                ComplexQueryGenerator(
+                    response_cache=self.response_cache,
+                    schema_fingerprint=fingerprint,
+                    **self.generator_settings(),
+                ),
+            )
+            for generator in generators:
+                generator.system_message = QUERY_SYSTEM_MESSAGE
+            self.generators[tenant.name] = generators
+
+        query_generator, complex_generator = generators
+        if complex_generator.schema_fingerprint != fingerprint:
+            complex_generator.schema_index = None
+        query_generator.schema_fingerprint = fingerprint
+        complex_generator.schema_fingerprint = fingerprint
+        if not complex_query:
+            return query_generator, schema
+        if complex_generator.schema_index is None:
+            complex_generator.schema_index = SchemaIndex(schema, top_k=SCHEMA_TOP_K)
+        return complex_generator, schema
+
+    def release_generators(self, tenant):
+        self.generators.pop(tenant.name, None)
+
+    async def answer(self, question, on_delta=None):
+        """
+        Generate, run and explain the query of one question. `question` has the fields of a
+        `batch` input line: `question`, and optionally `complex`, `db_params`, `analyse` and
+        `analysis_prompt`. When `on_delta` is given the analysis is streamed to it.
+
+        Returns:
+            dict: The query, column names, rows as lists and analysis, with the duration of every stage in milliseconds
+                and the remaining `overhead` of the service itself.
+        """
+        from config import ANALYSIS_TOKEN_BUDGET, MAX_RESULT_ROWS
+        from interfaces import QueryTemplate, ComplexQueryTemplate, TableToNaturalTemplate
+        from summarization import summarize_records
+        from columnar import ColumnarResult
+
+        if not question.get("question"):
+            raise ValueError("The question is required.")
+        timings = {}
+        start = time.perf_counter()
+        db_params = {
+            "database_name": self.database_name,
+            "table_name": question.get("table_name", ""),
+            **(question.get("db_params") or {}),
+        }
+
+        async with self.registry.lease(db_params["database_name"]) as tenant:
+            stage = time.perf_counter()
+            generator, schema = await self.tenant_generator(tenant, question.get("complex", False))
+            if question.get("complex"):
+                template = ComplexQueryTemplate(
+                    prompt=question["question"],
+                    query_type="Postgres",
+                    programming_language="SQL",
+                    db_params=db_params,
+                    db_mapping=schema,
+                )
+            else:
+                template = QueryTemplate(
+                    prompt=question["question"],
+                    query_type="Postgres",
+                    programming_language="SQL",
+                    db_params=db_params,
+                )
+            sql = await generator.send_request(template, PARAMETERS)  # type: ignore
+            timings["generate"] = (time.perf_counter() - stage) * 1000
+
+            stage = time.perf_counter()
+            async with tenant.engine.stream(
+                sql, max_rows=MAX_RESULT_ROWS, guarded=True, cached=True
+            ) as records:
+                rows = await ColumnarResult.from_stream(records)
+            timings["execute"] = (time.perf_counter() - stage) * 1000
+
+        analysis = None
+        if question.get("analyse", True):
+            stage = time.perf_counter()
+            analysis_template = TableToNaturalTemplate(
+                prompt=question.get("analysis_prompt", ANALYSIS_PROMPT),
+                data=summarize_records(
+                    rows, token_budget=ANALYSIS_TOKEN_BUDGET, truncated=rows.truncated
+                ),
+                original_prompt=template.prompt,
+            )
+            if on_delta is None:
+                analysis = await self.analysis_generator.send_request(analysis_template, PARAMETERS)
+            else:
+                deltas = []
+                stream = self.analysis_generator.stream_request(analysis_template, PARAMETERS)
+                async for delta in stream:
+                    deltas.append(delta)
+                    on_delta(delta)
+                analysis = "".join(deltas)
+            timings["analyse"] = (time.perf_counter() - stage) * 1000
+
+        total = (time.perf_counter() - start) * 1000
+        timings["overhead"] = total - sum(timings.values())
+        timings["total"] = total
+        return {
+            "sql": sql,
+            "columns": rows.names,
+            "rows": list(rows.tuples()),
+            "truncated": rows.truncated,
+            "analysis": analysis,
+            "timings": timings,
+        }
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "uptime": time.perf_counter() - MODULE_LOADED,
+            "startup": self.startup,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency_p50": percentile(self.latencies, 0.50),
+            "latency_p95": percentile(self.latencies, 0.95),
+            "overhead_p50": percentile(self.overheads, 0.50),
+            "overhead_p95": percentile(self.overheads, 0.95),
+            "engines": self.registry.stats if self.registry is not None else None,
+        }
+
+    async def call(self, method, params=None, on_delta=None):
+        """
+        Run one service method: `ask` (the parameters of `answer`), `warm_up`, `stats` or
+        `health`.
+
+        Raises:
+            LookupError: When the method does not exist.
+        """
+        params = params or {}
+        match method:
+            case "health":
+                return {"ready": self.ready}
+            case "stats":
+                return self.stats()
+            case "warm_up":
+                return await self.warm_up()
+            case "ask":
+                await self.warm_up()
+                telemetry = get_telemetry()
+                async with self.semaphore:
+                    self.requests += 1
+                    start = time.perf_counter()
+                    try:
+                        with telemetry.span("service.ask"):
+                            result = await self.answer(params, on_delta)
+                    except Exception:
+                        self.errors += 1
+                        raise
+                    finally:
+                        self.latencies.append((time.perf_counter() - start) * 1000)
+                self.overheads.append(result["timings"]["overhead"])
+                telemetry.histogram("service.overhead", result["timings"]["overhead"])
+                return result
+            case _:
+                raise LookupError(f"Unknown method {method!r}.")
+
+    async def handle_line(self, line, write):
+        """
+        Answer one JSON-lines request, `{"id": ..., "method": "ask", "params": {...}}`, with
+        `{"id": ..., "result": ...}` or `{"id": ..., "error": ...}`. When `params.stream` is set the
+        analysis deltas are written as `{"id": ..., "delta": ...}` lines before the result.
+        """
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            params = request.get("params") or {}
+            on_delta = None
+            if params.get("stream"):
+
+                def on_delta(delta):
+                    write({"id": request_id, "delta": delta})
+
+            result = await self.call(request.get("method", "ask"), params, on_delta)
+            write({"id": request_id, "result": result})
+        except Exception as exc:  # pylint: disable=broad-except
+            logger.error("Request %s failed: %s", request_id, str(exc))
+            write({"id": request_id, **error_body(exc)})
+
+    async def serve_stdio(self):
+        """
+        Read JSON-lines requests from stdin until it closes and write one response line per
+        request to stdout. Requests are answered concurrently, so responses can come out of order.
+        """
+        loop = asyncio.get_running_loop()
+
+        def write(message):
+            sys.stdout.write(json.dumps(message, default=str) + "\n")
+            sys.stdout.flush()
+
+        tasks = set()
+        while True:
+            # A reader thread works for pipes, terminals and redirected files alike.
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            if not line.strip():
+                continue
+            task = asyncio.create_task(self.handle_line(line, write))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    async def handle_http(self, reader, writer):
+        """
+        Minimal HTTP/1.1 with keep-alive: `POST /ask` takes the `answer` parameters as JSON, and
+        `GET /health`, `GET /stats` and `POST /warm_up` map to the methods of the same name.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                verb, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if not header.strip():
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status = 200
+                try:
+                    method = path.split("?", 1)[0].strip("/")
+                    if (verb == "POST") != (method in ("ask", "warm_up")):
+                        raise LookupError(f"{verb} /{method} is not supported.")
+                    payload = await self.call(method, json.loads(body) if body else {})
+                except Exception as exc:  # pylint: disable=broad-except
+                    status = error_status(exc)
+                    payload = error_body(exc)
+                    logger.error("%s %s failed: %s", verb, path, str(exc))
+
+                content = json.dumps(payload, default=str).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                    + content
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_http(self, host="127.0.0.1", port=8080):
+        server = await asyncio.start_server(self.handle_http, host, port)
+        logger.info("Serving on http://%s:%s", host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def close(self):
+        if self.registry is not None:
+            from config import save_workload_log
+
+            await self.registry.close()
+            save_workload_log()
+        if self.http_client is not None:
+            await self.http_client.aclose()
+        if self.response_cache is not None:
+            self.response_cache.close()
+
+
+def read_warm_up_questions(path):
+    if not path:
+        return []
+    with open(path, "r", encoding="utf-8") as questions_file:
+        return [json.loads(line) for line in questions_file if line.strip()]
+
+
+async def serve(mode, host, port, database_name, concurrency, warm_up_path, lazy):
+    service = NLToSQLService(database_name=database_name, concurrency=concurrency)
+    try:
+        if not lazy:
+            await service.warm_up(read_warm_up_questions(warm_up_path))
+        if mode == "http":
+            await service.serve_http(host, port)
+        else:
+            await service.serve_stdio()
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve NL to SQL questions from a warm process.")
+    parser.add_argument("mode", choices=["stdio", "http"], nargs="?", default="stdio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--database", default="postgres")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--warm-up",
+        help="JSONL file of questions answered before serving, to prime the caches.",
+    )
+    parser.add_argument(
+        "--lazy",
+        action="store_true",
+        help="Skip the warm-up and pay it on the first request, to measure a cold start.",
+    )
+    arguments = parser.parse_args()
+    asyncio.run(
+        serve(
+            arguments.mode,
+            arguments.host,
+            arguments.port,
+            arguments.database,
+            arguments.concurrency,
+            arguments.warm_up,
+            arguments.lazy,
+        )
+    )
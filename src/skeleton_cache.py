@@ -0,0 +1,95 @@
+import re
+import datetime
+from decimal import Decimal, InvalidOperation
+
+
+# Quoted strings first, so numbers and dates inside them stay part of the string.
+LITERAL_PATTERN = re.compile(
+    r"(?<!\w)'(?P<single>[^']+)'(?!\w)"
+    r"|(?<!\w)\"(?P<double>[^\"]+)\"(?!\w)"
+    r"|(?<![\w$.-])(?P<date>\d{4}-\d{2}-\d{2})(?![\w.])"
+    r"|(?<![\w$.])(?P<number>-?\d+(?:\.\d+)?)(?![\w.])"
+)
+PLACEHOLDER_PATTERN = re.compile(r"\$(\d+)")
+
+INTEGER_TYPES = {"int2", "int4", "int8", "oid"}
+FLOAT_TYPES = {"float4", "float8"}
+TIMESTAMP_TYPES = {"timestamp", "timestamptz"}
+BOOLEAN_VALUES = {"true", "t", "yes", "y", "1"}
+
+
+def extract_literals(question):
+    """
+    Replace the quoted strings, ISO dates and numbers of a question with `$1`, `$2`... in order
+    of appearance. Unquoted names cannot be told apart from schema words, so they stay part of
+    the shape.
+
+    Returns:
+        Tuple[str, List[str], List[str]]: The literal-free shape, the literal values and their
+            kinds (`str`, `date`, `int` or `number`).
+    """
+    values = []
+    kinds = []
+
+    def replace(match):
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind in ("single", "double"):
+            kind = "str"
+        elif kind == "number":
+            kind = "int" if "." not in value else "number"
+        values.append(value)
+        kinds.append(kind)
+        return f"${len(values)}"
+
+    return LITERAL_PATTERN.sub(replace, question), values, kinds
+
+
+def is_parameterized(query, count):
+    """
+    Whether `query` uses exactly the placeholders `$1` to `$count`, so it can be reused for any
+    question of the same shape.
+    """
+    return {int(number) for number in PLACEHOLDER_PATTERN.findall(query)} == set(
+        range(1, count + 1)
+    )
+
+
+def coerce_argument(type_name, value):
+    if type_name in INTEGER_TYPES:
+        return int(Decimal(value))
+    if type_name == "numeric":
+        return Decimal(value)
+    if type_name in FLOAT_TYPES:
+        return float(value)
+    if type_name == "date":
+        return datetime.date.fromisoformat(value)
+    if type_name in TIMESTAMP_TYPES:
+        return datetime.datetime.fromisoformat(value)
+    if type_name == "bool":
+        return value.lower() in BOOLEAN_VALUES
+    return value
+
+
+def coerce_arguments(type_names, values):
+    """
+    Convert the extracted literal strings to the Python types asyncpg expects for the parameter
+    types Postgres inferred. Values that do not convert are passed as strings, so the database
+    reports the mismatch.
+    """
+    arguments = []
+    for type_name, value in zip(type_names, values):
+        try:
+            arguments.append(coerce_argument(type_name, value))
+        except (ValueError, InvalidOperation):
+            arguments.append(value)
+    return arguments
+
+
+async def bind_arguments(db, query, values):
+    """
+    Arguments of a parameterized query, typed after the parameters of its prepared statement.
+    """
+    if not values:
+        return []
+    return coerce_arguments(await db.parameter_types(query), values)
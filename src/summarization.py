@@ -0,0 +1,173 @@
+import io
+import csv
+import numbers
+from collections import Counter
+
+import numpy as np
+
+from columnar import ColumnarResult, is_typed, take
+from tokenizer import count_tokens, get_encoding
+from telemetry import get_telemetry
+
+
+SUMMARY_MODES = ("auto", "csv", "sample", "stats")
+
+
+def to_columns(records):
+    """
+    Transpose records (asyncpg `Record`s or dicts) into column names and one list of values per
+    column, reading every record once. The columns of a `ColumnarResult` are used as they are.
+    """
+    if isinstance(records, ColumnarResult):
+        return records.names, records.columns
+    records = list(records)
+    if not records:
+        return [], []
+    names = list(records[0].keys())
+    columns = [list(values) for values in zip(*(tuple(record.values()) for record in records))]
+    return names, columns
+
+
+def encode_csv(names, columns, indexes):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(names)
+    # csv writes None as an empty field.
+    writer.writerows(zip(*(take(column, indexes) for column in columns)))
+    return buffer.getvalue()
+
+
+def is_numeric(values):
+    if is_typed(values):
+        return len(values) > 0
+    return bool(values) and all(
+        isinstance(value, numbers.Number) and not isinstance(value, bool) for value in values
+    )
+
+
+def column_statistics(values, top_k=5, bins=5):
+    # Typed columns never hold nulls.
+    present = values if is_typed(values) else [value for value in values if value is not None]
+    statistics = {"count": len(values), "nulls": len(values) - len(present)}
+    if not len(present):
+        return statistics
+
+    if is_numeric(present):
+        statistics.update(numeric_statistics(present, bins))
+    else:
+        try:
+            statistics["min"], statistics["max"] = min(present), max(present)
+        except TypeError:
+            pass
+        statistics["top"] = top_values(present, top_k)
+    return statistics
+
+
+def numeric_statistics(values, bins):
+    array = np.asarray(values, dtype=np.float64)
+    counts, _ = np.histogram(array, bins=bins)
+    return {
+        "min": float(array.min()),
+        "max": float(array.max()),
+        "mean": round(float(array.mean()), 4),
+        "histogram": counts.tolist(),
+    }
+
+
+def top_values(values, top_k):
+    # Counting the values themselves reuses their cached hashes, which is much cheaper than
+    # converting every value to a string first; only the most frequent ones are converted.
+    try:
+        counts = Counter(values)
+    except TypeError:
+        counts = Counter(map(str, values))
+    return [(str(value), count) for value, count in counts.most_common(top_k)]
+
+
+def render_statistics(names, columns):
+    lines = []
+    for name, values in zip(names, columns):
+        statistics = column_statistics(values)
+        lines.append(f"{name}: " + ", ".join(f"{key}={value}" for key, value in statistics.items()))
+    return "\n".join(lines)
+
+
+def sample_indexes(total, sample_rows):
+    if total <= sample_rows:
+        return list(range(total))
+    head = (sample_rows + 1) // 2
+    return list(range(head)) + list(range(total - (sample_rows - head), total))
+
+
+def truncate_to_budget(text, token_budget):
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= token_budget:
+        return text
+    return encoding.decode(tokens[:token_budget])
+
+
+def summarize_records(records, token_budget=None, mode="auto", sample_rows=20, truncated=False):
+    """
+    Serialise a query result for the analysis prompt within `token_budget` tokens.
+
+    Modes:
+        csv: every row as compact CSV with a single header line, falling back to head and tail
+            rows when it does not fit the budget.
+        sample: head and tail rows only.
+        stats: per-column statistics only (counts, nulls, min/max, mean and histogram for numeric
+            columns, most frequent values otherwise).
+        auto: `csv` when the full result fits the budget, otherwise statistics followed by the
+            largest head and tail sample that fits.
+
+    Args:
+        records (Iterable[Mapping]): asyncpg records or dicts.
+        token_budget (Optional[int]): Maximum tokens of the returned text. `None` means no limit.
+        sample_rows (int): Rows kept by the `sample` mode and the starting sample for `auto`.
+        truncated (bool): Whether the result was already capped when it was fetched.
+
+    Returns:
+        str: The serialised result.
+    """
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"Unknown summary mode {mode}. Expected one of {SUMMARY_MODES}.")
+
+    with get_telemetry().span("row_serialisation", mode=mode):
+        return _summarize(records, token_budget, mode, sample_rows, truncated)
+
+
+def _summarize(records, token_budget, mode, sample_rows, truncated):
+    names, columns = to_columns(records)
+    total = len(columns[0]) if columns else 0
+    header = f"{total} rows" + (" (result truncated when fetched)" if truncated else "") + "\n"
+
+    def fits(text):
+        return token_budget is None or count_tokens(text) <= token_budget
+
+    # A CSV line with a comma is at least one token, so larger results are not encoded in full
+    # only to be counted and thrown away.
+    too_many_rows = token_budget is not None and len(names) > 1 and total > token_budget
+    if mode in ("auto", "csv") and not too_many_rows:
+        text = header + encode_csv(names, columns, range(total))
+        if fits(text):
+            return text
+
+    statistics = ""
+    if mode in ("auto", "stats"):
+        statistics = "COLUMN STATISTICS:\n" + render_statistics(names, columns) + "\n"
+        if mode == "stats":
+            text = header + statistics
+            return text if fits(text) else truncate_to_budget(text, token_budget)
+
+    size = min(sample_rows, total)
+    while True:
+        indexes = sample_indexes(total, size)
+        text = header + statistics
+        if indexes:
+            text += f"SAMPLE ROWS ({len(indexes)} of {total}, head and tail):\n"
+            text += encode_csv(names, columns, indexes)
+        if fits(text) or size == 0:
+            break
+        size //= 2
+
+    return text if fits(text) else truncate_to_budget(text, token_budget)
@@ -0,0 +1,164 @@
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Telemetry:
+    """
+    No-op telemetry. Subclasses export spans, histograms and counters somewhere.
+
+    Instrumented code only calls `span`, `histogram` and `counter`; every span also records its
+    duration in milliseconds into the histogram of the same name.
+    """
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start = time.perf_counter()
+        with self.start_span(name, attributes):
+            try:
+                yield
+            finally:
+                self.histogram(name, (time.perf_counter() - start) * 1000)
+
+    @contextmanager
+    def start_span(self, name, attributes):
+        yield
+
+    def histogram(self, name, value):
+        pass
+
+    def counter(self, name, value=1):
+        pass
+
+
+class InMemoryTelemetry(Telemetry):
+    """
+    Collects every span, histogram value and counter in process, for tests and benchmarks.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.histograms = defaultdict(list)
+        self.counters = defaultdict(float)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def start_span(self, name, attributes):
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.spans.append({"name": name, "start": start, "end": time.time(), **attributes})
+
+    def histogram(self, name, value):
+        with self.lock:
+            self.histograms[name].append(value)
+
+    def counter(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def summary(self):
+        summary = {"counters": dict(self.counters), "histograms": {}}
+        for name, values in self.histograms.items():
+            ordered = sorted(values)
+            summary["histograms"][name] = {
+                "count": len(ordered),
+                "p50": ordered[int(0.50 * (len(ordered) - 1))],
+                "p95": ordered[int(0.95 * (len(ordered) - 1))],
+                "p99": ordered[int(0.99 * (len(ordered) - 1))],
+            }
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.spans.clear()
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class OpenCensusTelemetry(Telemetry):
+    """
+    Exports spans and metrics to Azure Monitor through `opencensus-ext-azure`. Histograms become
+    distribution views and counters sum views, registered the first time a name is recorded.
+
+    Args:
+        connection_string (str): Azure Monitor connection string (`AZ_CONNECTION_LOG`).
+        sampling_rate (float): Fraction of spans exported.
+        boundaries (List[float]): Histogram bucket boundaries, in the unit of the recorded values.
+    """
+
+    def __init__(
+        self,
+        connection_string,
+        sampling_rate=1.0,
+        boundaries=(5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000),
+    ):
+        # pylint: disable=import-outside-toplevel
+        from opencensus.ext.azure import metrics_exporter
+        from opencensus.ext.azure.trace_exporter import AzureExporter
+        from opencensus.stats import aggregation, measure, stats, view
+        from opencensus.trace.samplers import ProbabilitySampler
+        from opencensus.trace.tracer import Tracer
+
+        self.aggregation = aggregation
+        self.measure = measure
+        self.view = view
+        self.boundaries = list(boundaries)
+        self.tracer = Tracer(
+            exporter=AzureExporter(connection_string=connection_string),
+            sampler=ProbabilitySampler(sampling_rate),
+        )
+        self.recorder = stats.stats.stats_recorder
+        self.view_manager = stats.stats.view_manager
+        self.view_manager.register_exporter(
+            metrics_exporter.new_metrics_exporter(connection_string=connection_string)
+        )
+        self.measures = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def start_span(self, name, attributes):
+        with self.tracer.span(name=name) as span:
+            for key, value in attributes.items():
+                span.add_attribute(key, value)
+            yield
+
+    def get_measure(self, name, aggregation):
+        with self.lock:
+            if name not in self.measures:
+                measure = self.measure.MeasureFloat(name, name, "1")
+                self.view_manager.register_view(
+                    self.view.View(name, name, [], measure, aggregation)
+                )
+                self.measures[name] = measure
+            return self.measures[name]
+
+    def record(self, measure, value):
+        measurement_map = self.recorder.new_measurement_map()
+        measurement_map.measure_float_put(measure, value)
+        measurement_map.record()
+
+    def histogram(self, name, value):
+        self.record(
+            self.get_measure(name, self.aggregation.DistributionAggregation(self.boundaries)),
+            value,
+        )
+
+    def counter(self, name, value=1):
+        self.record(self.get_measure(name, self.aggregation.SumAggregation()), value)
+
+
+_telemetry = Telemetry()
+
+
+def get_telemetry():
+    return _telemetry
+
+
+def set_telemetry(telemetry):
+    global _telemetry  # pylint: disable=global-statement
+    _telemetry = telemetry
+    return telemetry
@@ -0,0 +1,229 @@
+import time
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from telemetry import get_telemetry
+
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+def retry_after(response):
+    """
+    Seconds the server asked to wait, from Azure's `retry-after-ms` or the standard
+    `Retry-After` header (seconds or an HTTP date), or None when neither is present.
+    """
+    milliseconds = response.headers.get("retry-after-ms") or response.headers.get(
+        "x-ms-retry-after-ms"
+    )
+    if milliseconds:
+        try:
+            return max(float(milliseconds) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Continuously refilled bucket holding at most one minute of quota, so a burst can spend the
+    whole per-minute allowance and then proceeds at the sustained rate.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        self.refill()
+        return max(min(amount, self.capacity) - self.level, 0.0) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def give(self, amount):
+        self.refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Client-side limiter for one deployment's requests-per-minute and tokens-per-minute quotas,
+    with jittered exponential backoff for throttled and failed requests.
+
+    Callers reserve an estimate of the request tokens (prompt plus `max_tokens`, which is how
+    Azure OpenAI accounts them) and settle with the actual usage afterwards, returning the
+    unused part to the bucket. A `Retry-After` answer pauses every caller sharing the limiter,
+    not only the one that was throttled.
+
+    Args:
+        requests_per_minute (Optional[float]): Request quota, None for unlimited.
+        tokens_per_minute (Optional[float]): Token quota, None for unlimited.
+        max_retries (int): Retries of a throttled or failed request before giving up.
+        base_delay (float): First backoff delay in seconds when the server gives no `Retry-After`.
+        max_delay (float): Upper bound of a single backoff delay.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_retries=6,
+        base_delay=0.5,
+        max_delay=60.0,
+    ):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+        self.throttled = 0
+        self.retries = 0
+
+    async def acquire(self, tokens=0):
+        """
+        Wait until the quotas allow a request of `tokens` tokens and reserve them. Returns the
+        seconds spent waiting.
+        """
+        start = time.monotonic()
+        async with self.lock:
+            while True:
+                wait = max(self.paused_until - time.monotonic(), 0.0)
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1))
+                if self.tokens is not None:
+                    wait = max(wait, self.tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+        return time.monotonic() - start
+
+    def settle(self, reserved, used):
+        if self.tokens is not None and used is not None and used < reserved:
+            self.tokens.give(reserved - used)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def call(self, request, tokens=0, stage="generation"):
+        """
+        Run `request()` within the quotas, retrying retryable HTTP statuses and network errors.
+        `request` returns the JSON response body; its `usage.total_tokens` settles the
+        reservation. Waits, throttles and retries are reported to telemetry under `stage`.
+
+        Raises:
+            httpx.HTTPError: When the last retry failed or the status is not retryable.
+        """
+        telemetry = get_telemetry()
+        attempt = 0
+        while True:
+            telemetry.histogram(f"{stage}.rate_limit_wait", await self.acquire(tokens) * 1000)
+            try:
+                response = await request()
+            except httpx.HTTPStatusError as exc:
+                self.settle(tokens, 0)
+                status = exc.response.status_code
+                if status not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    raise
+                delay = retry_after(exc.response)
+                if status == 429:
+                    self.throttled += 1
+                    telemetry.counter(f"{stage}.throttled")
+                    if delay is not None:
+                        self.pause(delay)
+                delay = self.backoff(attempt) if delay is None else delay
+                logger.warning("Request failed with %s. Retrying in %.2fs.", status, delay)
+            except httpx.TransportError as exc:
+                self.settle(tokens, 0)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning("Request failed: %s. Retrying in %.2fs.", str(exc), delay)
+            else:
+                self.settle(tokens, response.get("usage", {}).get("total_tokens"))
+                return response
+            attempt += 1
+            self.retries += 1
+            telemetry.counter(f"{stage}.retries")
+            await asyncio.sleep(delay)
+
+
+    @asynccontextmanager
+    async def reserve(self, tokens=0, stage="generation"):
+        """
+        Reserve `tokens` for a request whose usage is only known once it ends, such as a stream.
+        The block stores the final `usage` in the yielded dict, which settles the reservation; a
+        request ending without it keeps the whole reservation. A throttled request pauses the
+        limiter like `call`, but is not retried.
+        """
+        telemetry = get_telemetry()
+        telemetry.histogram(f"{stage}.rate_limit_wait", await self.acquire(tokens) * 1000)
+        usage = {}
+        try:
+            yield usage
+        except httpx.HTTPStatusError as exc:
+            usage.setdefault("total_tokens", 0)
+            if exc.response.status_code == 429:
+                self.throttled += 1
+                telemetry.counter(f"{stage}.throttled")
+                delay = retry_after(exc.response)
+                if delay is not None:
+                    self.pause(delay)
+            raise
+        finally:
+            self.settle(tokens, usage.get("total_tokens"))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution whose result, or error, is
+    shared by every caller. A caller being cancelled does not cancel the shared call.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def run(self, key, function):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
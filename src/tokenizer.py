@@ -0,0 +1,15 @@
+from functools import lru_cache
+
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name=DEFAULT_ENCODING):
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text, encoding_name=DEFAULT_ENCODING):
+    return len(get_encoding(encoding_name).encode(text, disallowed_special=()))
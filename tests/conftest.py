@@ -0,0 +1,63 @@
+import pytest
+
+import tokenizer
+import summarization
+
+
+class ByteEncoding:
+    """
+    Stand-in for the tiktoken encoding, whose vocabulary is downloaded on first use: one token
+    per UTF-8 byte, which is enough for budgets and reservations to be checked offline.
+    """
+
+    @staticmethod
+    def encode(text, disallowed_special=()):
+        return list(text.encode())
+
+    @staticmethod
+    def decode(tokens):
+        return bytes(tokens).decode(errors="ignore")
+
+
+class FakeDatabase:
+    """
+    `PostgresDatabase` stand-in answering the catalog queries of the caches. `versions` maps the
+    table names to the versions `pg_stat_user_tables` would report.
+    """
+
+    def __init__(self, versions=None, tracked=(), parameter_types=()):
+        self.versions = dict(versions or {})
+        self.tracked = list(tracked)
+        self.types = list(parameter_types)
+        self.listeners = {}
+        self.queries = []
+
+    async def fetch(self, query, *args):
+        self.queries.append(query)
+        if "pg_trigger" in query:
+            return [{"table_name": table} for table in self.tracked]
+        return [
+            {"table_name": table, "version": version} for table, version in self.versions.items()
+        ]
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    async def parameter_types(self, query):
+        return self.types
+
+    def notify(self, channel, payload):
+        self.listeners[channel](None, 0, channel, payload)
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    encoding = ByteEncoding()
+    monkeypatch.setattr(tokenizer, "get_encoding", lambda *_: encoding)
+    monkeypatch.setattr(summarization, "get_encoding", lambda *_: encoding)
+    return encoding
+
+
+@pytest.fixture
+def database():
+    return FakeDatabase()
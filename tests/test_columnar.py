@@ -0,0 +1,72 @@
+import datetime
+import json
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from columnar import ColumnarResult, compact
+from result_cache import CachedRecord
+
+
+def test_compact_types_null_free_numbers_and_interns_strings():
+    integers = compact([1, 2, 3])
+    assert isinstance(integers, np.ndarray) and integers.dtype == np.int64
+    assert compact([1.5, 2.0]).dtype == np.float64
+
+    names = compact(["".join(["bo", "ok"]), "book", None])
+    assert names == ["book", "book", None]
+    assert names[0] is names[1]
+
+    assert compact([1, None]) == [1, None]
+    assert compact([Decimal("1.5")]) == [Decimal("1.5")]
+    assert compact([2**70]) == [2**70]
+
+
+def rows():
+    return [
+        {"id": 1, "name": "book", "price": Decimal("9.90"), "sold": datetime.date(2024, 1, 31)},
+        {"id": 2, "name": "pen", "price": None, "sold": None},
+    ]
+
+
+def test_rows_read_like_records():
+    result = ColumnarResult.from_records(rows(), truncated=True)
+
+    assert len(result) == 2
+    assert result.truncated
+    assert result.names == ["id", "name", "price", "sold"]
+    assert result[0]["name"] == "book"
+    assert type(result[1]["id"]) is int
+    assert dict(result[-1]) == rows()[1]
+    assert result.to_records() == rows()
+    assert list(result.tuples([1])) == [(2, "pen", None, None)]
+    with pytest.raises(IndexError):
+        result[2]
+
+
+def test_extend_accepts_cached_records_until_columns_are_read():
+    index = {"id": 0, "name": 1}
+    result = ColumnarResult()
+    result.extend([CachedRecord(index, (1, "book"))])
+    result.extend([CachedRecord(index, (2, "pen"))])
+
+    assert result.column("id").tolist() == [1, 2]
+    with pytest.raises(ValueError):
+        result.extend([CachedRecord(index, (3, "desk"))])
+
+
+def test_encodes_json_and_csv_from_the_columns():
+    result = ColumnarResult.from_records(rows())
+
+    assert json.loads(result.to_json()) == {
+        "columns": ["id", "name", "price", "sold"],
+        "data": [[1, "book", "9.90", "2024-01-31"], [2, "pen", None, None]],
+    }
+    assert json.loads(result.to_json("columns"))["id"] == [1, 2]
+    assert json.loads(result.to_json("records"))[1] == {
+        "id": 2, "name": "pen", "price": None, "sold": None
+    }
+    assert result.to_csv() == "id,name,price,sold\n1,book,9.90,2024-01-31\n2,pen,,\n"
+    with pytest.raises(ValueError):
+        result.to_json("table")
@@ -0,0 +1,116 @@
+import asyncio
+
+import httpx
+import pytest
+
+from dispatch import HedgedDispatcher
+from throttling import RateLimiter
+
+
+class Deployments:
+    """
+    HTTP client whose deployments, keyed by URL, answer after a latency or fail with a status.
+    """
+
+    def __init__(self, latencies=None, statuses=None):
+        self.latencies = latencies or {}
+        self.statuses = statuses or {}
+        self.calls = []
+
+    async def post(self, url, json, headers):
+        self.calls.append((url, headers["api-key"]))
+        await asyncio.sleep(self.latencies.get(url, 0))
+        status = self.statuses.get(url, 200)
+        return httpx.Response(
+            status,
+            json={"url": url, "usage": {"total_tokens": 10}},
+            request=httpx.Request("POST", url),
+        )
+
+
+class Generator:
+    stage_name = "generation"
+    aistudio_url = "http://primary"
+    aistudio_key = "primary-key"
+    headers = {"Content-Type": "application/json"}
+
+    def __init__(self, http_client, rate_limiter=None):
+        self.http_client = http_client
+        self.rate_limiter = rate_limiter
+
+
+ENDPOINTS = [("http://a", "key-a"), ("http://b", "key-b")]
+
+
+def test_delay_uses_the_percentile_once_enough_latencies_are_known():
+    dispatcher = HedgedDispatcher(
+        hedge_percentile=0.5, initial_delay=2.0, min_delay=0.05, min_samples=4
+    )
+    assert dispatcher.delay() == 2.0
+    dispatcher.latencies.extend([0.1, 0.2, 0.3, 0.4])
+    assert dispatcher.delay() == 0.2
+    dispatcher.latencies.extend([0.01] * 10)
+    assert dispatcher.delay() == 0.05
+
+
+def test_rejects_invalid_percentiles():
+    with pytest.raises(ValueError):
+        HedgedDispatcher(hedge_percentile=0)
+
+
+@pytest.mark.asyncio
+async def test_hedges_a_slow_request_and_takes_the_first_answer():
+    client = Deployments(latencies={"http://a": 1.0})
+    dispatcher = HedgedDispatcher(ENDPOINTS, initial_delay=0.02)
+
+    body = await dispatcher.request(Generator(client), {})
+
+    assert body["url"] == "http://b"
+    assert client.calls == [("http://a", "key-a"), ("http://b", "key-b")]
+    assert dispatcher.stats["hedges"] == 1
+    assert dispatcher.stats["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_fails_over_to_the_next_endpoint():
+    client = Deployments(statuses={"http://a": 503})
+    dispatcher = HedgedDispatcher(ENDPOINTS, initial_delay=1.0)
+
+    assert (await dispatcher.request(Generator(client), {}))["url"] == "http://b"
+    assert dispatcher.failovers == 1
+    assert dispatcher.hedges == 0
+
+
+@pytest.mark.asyncio
+async def test_raises_the_last_error_when_every_attempt_fails():
+    client = Deployments(statuses={"http://a": 500, "http://b": 502})
+    dispatcher = HedgedDispatcher(ENDPOINTS, initial_delay=1.0)
+
+    with pytest.raises(httpx.HTTPStatusError) as raised:
+        await dispatcher.request(Generator(client), {})
+    assert raised.value.response.status_code == 502
+
+
+@pytest.mark.asyncio
+async def test_rotates_requests_and_streams_across_endpoints():
+    client = Deployments()
+    dispatcher = HedgedDispatcher(ENDPOINTS)
+    generator = Generator(client)
+
+    await dispatcher.request(generator, {})
+    assert dispatcher.next_endpoint(generator) == ("http://b", "key-b")
+    await dispatcher.request(generator, {})
+    assert [url for url, _ in client.calls] == ["http://a", "http://a"]
+    assert HedgedDispatcher().next_endpoint(generator) == ("http://primary", "primary-key")
+
+
+@pytest.mark.asyncio
+async def test_hedges_are_charged_to_the_rate_limiter():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    client = Deployments(latencies={"http://a": 1.0})
+    dispatcher = HedgedDispatcher(ENDPOINTS, initial_delay=0.02)
+
+    await dispatcher.request(Generator(client, limiter), {}, tokens=100)
+
+    # Only the hedge is charged here, the caller's `RateLimiter.call` reserves the request.
+    assert limiter.tokens.level == pytest.approx(990, abs=1)
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from engine_registry import EngineRegistry
+
+
+class FakeEngine:
+    def __init__(self, database, max_connections=4):
+        self.database = database
+        self.max_connections = max_connections
+        self.connected = False
+        self.disconnects = 0
+
+    async def connect(self):
+        await asyncio.sleep(0.01)
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+        self.disconnects += 1
+
+
+@pytest.fixture
+def engines():
+    return []
+
+
+@pytest.fixture
+def registry_factory(engines, tmp_path):
+    def make(max_connections=8, sizes=None, **kwargs):
+        def engine_factory(database_name):
+            engine = FakeEngine(database_name, (sizes or {}).get(database_name, 4))
+            engines.append(engine)
+            return engine
+
+        return EngineRegistry(
+            engine_factory=engine_factory,
+            max_connections=max_connections,
+            schema_cache_dir=str(tmp_path),
+            **kwargs,
+        )
+
+    return make
+
+
+@pytest.mark.asyncio
+async def test_reuses_the_engine_of_a_database(registry_factory):
+    registry = registry_factory()
+    async with registry.lease("sales") as first:
+        assert first.engine.connected
+    async with registry.lease("sales") as second:
+        assert second is first
+    assert registry.stats["reserved_connections"] == 4
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_leases_open_one_engine(registry_factory, engines):
+    registry = registry_factory()
+
+    async def lease():
+        async with registry.lease("sales") as tenant:
+            return tenant
+
+    first, second = await asyncio.gather(lease(), lease())
+    assert first is second
+    assert len(engines) == 1
+
+
+@pytest.mark.asyncio
+async def test_closes_the_least_recently_used_idle_engine(registry_factory):
+    closed = []
+    registry = registry_factory(on_close=lambda tenant: closed.append(tenant.name))
+    for name in ("a", "b", "a", "c"):
+        async with registry.lease(name):
+            pass
+
+    assert list(registry.tenants) == ["a", "c"]
+    assert closed == ["b"]
+    assert registry.evictions == 1
+
+
+@pytest.mark.asyncio
+async def test_waits_for_a_lease_to_end_when_nothing_can_be_closed(registry_factory):
+    registry = registry_factory(max_connections=4)
+    released = asyncio.Event()
+
+    async def hold():
+        async with registry.lease("a"):
+            await released.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0.02)
+    waiter = asyncio.create_task(registry.lease("b").__aenter__())
+    await asyncio.sleep(0.02)
+    assert not waiter.done()
+
+    released.set()
+    await holder
+    tenant = await waiter
+    assert tenant.name == "b"
+    assert list(registry.tenants) == ["b"]
+
+
+@pytest.mark.asyncio
+async def test_rejects_engines_larger_than_the_budget(registry_factory):
+    registry = registry_factory(max_connections=4, sizes={"big": 5})
+    with pytest.raises(ValueError):
+        async with registry.lease("big"):
+            pass
+    assert not registry.tenants
+
+
+@pytest.mark.asyncio
+async def test_evict_idle_closes_engines_past_the_timeout(registry_factory, engines):
+    registry = registry_factory(idle_timeout=0)
+    async with registry.lease("a"):
+        await registry.evict_idle()
+        assert "a" in registry.tenants
+    await registry.evict_idle()
+
+    assert not registry.tenants
+    assert engines[0].disconnects == 1
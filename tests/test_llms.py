@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from interfaces import QueryTemplate, TableToNaturalTemplate
+from llms import QueryGenerator, TableToNaturalGenerator
+from mock_aistudio import ANALYSIS_TEXT, PRODUCTS_SQL, MockAIStudio
+from prompts import ANALYSIS_SYSTEM_MESSAGE, QUERY_SYSTEM_MESSAGE
+from response_cache import ResponseCache
+from throttling import RateLimiter
+
+PARAMETERS = {"temperature": 0.0, "max_tokens": 200}
+PARAMETERIZED_SQL = "SELECT * FROM products WHERE product_name = $1"
+
+
+class RecordingAIStudio(MockAIStudio):
+    def usage(self, request, content):
+        self.last_usage = super().usage(request, content)
+        return self.last_usage
+
+
+class ParameterizedAIStudio(MockAIStudio):
+    @staticmethod
+    def answer(payload):
+        return PARAMETERIZED_SQL
+
+
+def query_template(prompt="Retrieve all the products"):
+    return QueryTemplate(
+        prompt=prompt,
+        query_type="Postgres",
+        programming_language="SQL",
+        db_params={"database_name": "postgres", "table_name": "products"},
+    )
+
+
+def analysis_template():
+    return TableToNaturalTemplate(
+        prompt="Explain the data.", data="product_id,name\n1,book", original_prompt="Products?"
+    )
+
+
+@pytest_asyncio.fixture
+async def make_generator():
+    generators = []
+
+    def make(generator_class, mock=None, system_message=QUERY_SYSTEM_MESSAGE, **kwargs):
+        generator = generator_class(aistudio_url="http://mock", aistudio_key="key", **kwargs)
+        generator.system_message = system_message
+        (mock or MockAIStudio(latency=0)).attach(generator)
+        generators.append(generator)
+        return generator
+
+    yield make
+    for generator in generators:
+        await generator.close()
+
+
+@pytest.mark.asyncio
+async def test_repeated_prompts_are_answered_from_the_cache(make_generator):
+    mock = MockAIStudio(latency=0)
+    generator = make_generator(QueryGenerator, mock, response_cache=ResponseCache())
+
+    assert await generator.send_request(query_template(), PARAMETERS) == PRODUCTS_SQL
+    assert await generator.send_request(query_template(), PARAMETERS) == PRODUCTS_SQL
+    assert mock.requests == 1
+
+    generator.schema_fingerprint = "v2"
+    await generator.send_request(query_template(), PARAMETERS)
+    assert mock.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_identical_prompts_in_flight_share_one_completion(make_generator):
+    mock = MockAIStudio(latency=0.05)
+    generator = make_generator(QueryGenerator, mock)
+
+    answers = await asyncio.gather(
+        *(generator.send_request(query_template(), PARAMETERS) for _ in range(4)),
+        generator.send_request(query_template("Retrieve the categories"), PARAMETERS),
+    )
+
+    assert answers[:4] == [PRODUCTS_SQL] * 4
+    assert mock.requests == 2
+    assert generator.inflight.coalesced == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_settles_completions_with_their_usage(make_generator):
+    limiter = RateLimiter(tokens_per_minute=6000)
+    generator = make_generator(QueryGenerator, rate_limiter=limiter)
+
+    response = await generator.send_request(query_template(), PARAMETERS, complete_response=True)
+    assert limiter.tokens.level == pytest.approx(6000 - response["usage"]["total_tokens"], abs=5)
+
+
+@pytest.mark.asyncio
+async def test_questions_differing_in_literals_reuse_the_parameterized_query(make_generator):
+    mock = ParameterizedAIStudio(latency=0)
+    generator = make_generator(QueryGenerator, mock, response_cache=ResponseCache())
+
+    first = await generator.send_parameterized_request(
+        query_template("Retrieve the product named 'book'"), PARAMETERS
+    )
+    second = await generator.send_parameterized_request(
+        query_template("Retrieve the product named 'pen'"), PARAMETERS
+    )
+
+    assert first == (PARAMETERIZED_SQL, ["book"])
+    assert second == (PARAMETERIZED_SQL, ["pen"])
+    assert mock.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_answers_without_placeholders_are_used_as_is(make_generator):
+    mock = MockAIStudio(latency=0)
+    generator = make_generator(QueryGenerator, mock, response_cache=ResponseCache())
+
+    template = query_template("Retrieve the product named 'book'")
+    assert await generator.send_parameterized_request(template, PARAMETERS) == (PRODUCTS_SQL, [])
+    await generator.send_parameterized_request(template, PARAMETERS)
+    assert mock.requests == 2
+
+
+@pytest.mark.asyncio
+async def test_streams_are_cached_and_charged_with_their_usage(make_generator):
+    mock = RecordingAIStudio(latency=0)
+    limiter = RateLimiter(tokens_per_minute=6000)
+    generator = make_generator(
+        TableToNaturalGenerator,
+        mock,
+        system_message=ANALYSIS_SYSTEM_MESSAGE,
+        response_cache=ResponseCache(),
+        rate_limiter=limiter,
+    )
+
+    deltas = [delta async for delta in generator.stream_request(analysis_template(), PARAMETERS)]
+    assert "".join(deltas) == ANALYSIS_TEXT
+    assert len(deltas) > 1
+    assert limiter.tokens.level == pytest.approx(6000 - mock.last_usage["total_tokens"], abs=5)
+
+    cached = [delta async for delta in generator.stream_request(analysis_template(), PARAMETERS)]
+    assert cached == [ANALYSIS_TEXT]
+    assert mock.requests == 1
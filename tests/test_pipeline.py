@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from pipeline import StageGraph
+
+
+@pytest.mark.asyncio
+async def test_runs_independent_stages_concurrently():
+    async def schema():
+        await asyncio.sleep(0.05)
+        return "schema"
+
+    async def simple():
+        await asyncio.sleep(0.05)
+        return "simple"
+
+    async def complex_query(schema):
+        return f"query over {schema}"
+
+    graph = StageGraph()
+    graph.add("schema", schema).add("simple", simple)
+    graph.add("complex", complex_query, depends_on=("schema",))
+    results = await graph.run()
+
+    assert results == {"schema": "schema", "simple": "simple", "complex": "query over schema"}
+    assert graph.elapsed < 0.09
+    assert set(graph.timings) == {"schema", "simple", "complex"}
+
+
+def test_rejects_undefined_dependencies():
+    async def stage():
+        return None
+
+    with pytest.raises(ValueError):
+        StageGraph().add("analysis", stage, depends_on=("query",))
+
+
+@pytest.mark.asyncio
+async def test_failure_cancels_and_unwinds_the_other_stages():
+    released = asyncio.Event()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("generation failed")
+
+    async def holding():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            released.set()
+
+    async def dependent(failing):
+        raise AssertionError("must not run")
+
+    graph = StageGraph()
+    graph.add("failing", failing).add("holding", holding)
+    graph.add("dependent", dependent, depends_on=("failing",))
+    with pytest.raises(RuntimeError, match="generation failed"):
+        await graph.run()
+    assert released.is_set()
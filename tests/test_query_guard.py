@@ -0,0 +1,87 @@
+import asyncpg
+import pytest
+
+from query_guard import LIMIT_PATTERN, QueryGuard, QueryRejected
+
+
+class ExplainConnection:
+    def __init__(self, cost=10.0, rows=100.0, error=None):
+        self.plan = {"Total Cost": cost, "Plan Rows": rows}
+        self.error = error
+        self.explained = []
+
+    async def fetchval(self, query, *args):
+        self.explained.append(query)
+        if self.error is not None:
+            raise self.error
+        return [{"Plan": self.plan}]
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT * FROM products LIMIT 10",
+        "select * from products limit all",
+        "SELECT * FROM products LIMIT 10 OFFSET 20",
+        "SELECT * FROM products FETCH FIRST 5 ROWS ONLY",
+    ],
+)
+def test_limit_pattern_matches_a_final_limit(query):
+    assert LIMIT_PATTERN.search(query)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT * FROM (SELECT * FROM products LIMIT 10) p JOIN categories c USING (category_id)",
+        "SELECT 'limit 10' FROM products",
+        "SELECT * FROM products",
+    ],
+)
+def test_limit_pattern_ignores_inner_or_quoted_limits(query):
+    assert not LIMIT_PATTERN.search(query)
+
+
+def test_normalize_strips_comments_and_semicolons_outside_literals():
+    query = "SELECT '--not a comment', $$/* kept */$$ -- LIMIT 5\nFROM t /* LIMIT 5 */;;"
+    assert QueryGuard.normalize(query) == "SELECT '--not a comment', $$/* kept */$$  \nFROM t"
+
+
+@pytest.mark.asyncio
+async def test_wraps_queries_without_limit():
+    connection = ExplainConnection()
+    guarded = await QueryGuard(default_limit=50).check(
+        connection, "SELECT * FROM products -- LIMIT 5\n;"
+    )
+
+    assert guarded.endswith("LIMIT 50")
+    assert "-- LIMIT 5" not in guarded
+    assert connection.explained == [f"EXPLAIN (FORMAT JSON) {guarded}"]
+
+
+@pytest.mark.asyncio
+async def test_keeps_an_existing_limit():
+    guard = QueryGuard(default_limit=50)
+    assert await guard.check(ExplainConnection(), "SELECT * FROM products LIMIT 5;") == (
+        "SELECT * FROM products LIMIT 5"
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "query, connection, reason",
+    [
+        ("DELETE FROM products", ExplainConnection(), "not_read_only"),
+        ("SELECT * FROM products", ExplainConnection(cost=1e9), "cost"),
+        ("SELECT * FROM products LIMIT 5", ExplainConnection(rows=1e9), "rows"),
+        (
+            "SELECT missing FROM products",
+            ExplainConnection(error=asyncpg.UndefinedColumnError("missing")),
+            "invalid",
+        ),
+    ],
+)
+async def test_rejects_unsafe_or_expensive_queries(query, connection, reason):
+    with pytest.raises(QueryRejected) as raised:
+        await QueryGuard(max_cost=1e6, max_rows=1e6).check(connection, query)
+    assert raised.value.rejection.reason == reason
@@ -0,0 +1,71 @@
+import sqlite3
+
+import response_cache
+from response_cache import ResponseCache
+
+
+def test_make_key_ignores_whitespace_but_not_fingerprint():
+    key = ResponseCache.make_key("List  the\nproducts", "system", {"temperature": 0}, "v1")
+    assert key == ResponseCache.make_key("List the products ", "system", {"temperature": 0}, "v1")
+    assert key != ResponseCache.make_key("List the products", "system", {"temperature": 0}, "v2")
+
+
+def test_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats["entries"] == 2
+
+
+def test_expires_entries_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    cache.set("key", "value")
+
+    now[0] += 9
+    assert cache.get("key") == "value"
+    now[0] += 2
+    assert cache.get("key") is None
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 1
+
+
+def test_invalidate_drops_entries_of_a_fingerprint():
+    cache = ResponseCache()
+    cache.set("old", "1", fingerprint="v1")
+    cache.set("new", "2", fingerprint="v2")
+    cache.invalidate("v1")
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "2"
+
+
+def test_persists_and_batches_commits(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    cache = ResponseCache(path=path, commit_every=3, commit_interval=3600)
+
+    def committed():
+        with sqlite3.connect(path) as connection:
+            return connection.execute("SELECT count(*) FROM responses").fetchone()[0]
+
+    cache.set("a", "1", fingerprint="v1")
+    cache.set("b", "2", fingerprint="v1")
+    assert committed() == 0
+    cache.set("c", "3", fingerprint="v1")
+    assert committed() == 3
+
+    cache.set("d", "4", fingerprint="v2")
+    cache.close()
+    reopened = ResponseCache(path=path)
+    assert reopened.get("d") == "4"
+    reopened.invalidate("v1")
+    reopened.flush()
+    assert committed() == 1
+    reopened.close()
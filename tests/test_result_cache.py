@@ -0,0 +1,84 @@
+import pytest
+
+from result_cache import ResultCache, normalize_sql, referenced_names
+
+
+class Record(dict):
+    """Mapping with the `keys()` and `values()` of an `asyncpg.Record`."""
+
+
+def test_normalize_sql_ignores_formatting_outside_literals():
+    assert normalize_sql("SELECT *\n  FROM  Products WHERE name = 'A  B';") == (
+        "select * from products where name = 'A  B'"
+    )
+    assert normalize_sql('select "Mixed  Case" from t') == 'select "Mixed  Case" from t'
+
+
+def test_referenced_names_skips_string_literals():
+    query = "SELECT * FROM purchases p JOIN \"Student\" s ON 'products'"
+    names = referenced_names(normalize_sql(query))
+    assert {"purchases", "Student", "p", "s"} <= names
+    assert "products" not in names
+
+
+@pytest.mark.asyncio
+async def test_serves_hits_until_a_table_changes(database):
+    database.versions = {"products": "1.1", "student": "5.1"}
+    cache = ResultCache(check_interval=0)
+    query = "SELECT * FROM products"
+    key = cache.make_key(query, ())
+
+    versions = await cache.table_versions(database, query)
+    cache.set(key, [Record(product_id=1, product_name="book")], versions)
+    records = await cache.get(database, key)
+    assert [dict(record.items()) for record in records] == [
+        {"product_id": 1, "product_name": "book"}
+    ]
+    assert records[0]["product_name"] == "book"
+
+    database.versions["student"] = "6.1"
+    assert await cache.get(database, key) is not None
+    database.versions["products"] = "2.1"
+    assert await cache.get(database, key) is None
+    assert cache.stats == {"hits": 2, "misses": 1, "entries": 0, "bytes": 0}
+
+
+@pytest.mark.asyncio
+async def test_versions_read_before_the_query_make_concurrent_writes_stale(database):
+    database.versions = {"products": "1.1"}
+    cache = ResultCache(check_interval=0)
+    query = "SELECT * FROM products"
+    versions = await cache.table_versions(database, query)
+    database.versions["products"] = "2.1"  # A write commits while the query runs.
+    cache.set("key", [Record(product_id=1)], versions)
+
+    assert await cache.get(database, "key") is None
+
+
+@pytest.mark.asyncio
+async def test_listening_invalidates_on_notifications_and_skips_untracked_tables(database):
+    database.versions = {"products": "1.1", "student": "1.1"}
+    database.tracked = ["products"]
+    cache = ResultCache(channel="table_changed")
+    await cache.listen(database)
+
+    assert await cache.table_versions(database, "SELECT * FROM student") is None
+    cache.set("untracked", [Record(student_id=1)], None)
+    assert "untracked" not in cache.entries
+
+    versions = await cache.table_versions(database, "SELECT * FROM products")
+    cache.set("key", [Record(product_id=1)], versions)
+    queries = len(database.queries)
+    assert await cache.get(database, "key") is not None
+    assert len(database.queries) == queries
+    database.notify("table_changed", "products")
+    assert await cache.get(database, "key") is None
+
+
+def test_evicts_least_recently_used_within_the_memory_budget():
+    cache = ResultCache(max_bytes=300)
+    for index in range(4):
+        cache.set(f"key{index}", [Record(value="x" * 100)], ())
+
+    assert cache.size <= 300
+    assert list(cache.entries) == ["key2", "key3"]
@@ -0,0 +1,55 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+from skeleton_cache import bind_arguments, coerce_arguments, extract_literals, is_parameterized
+
+
+def test_extract_literals_replaces_strings_dates_and_numbers_in_order():
+    shape, values, kinds = extract_literals(
+        "Products named 'pen 2' bought after 2024-01-31 by more than 3 students at 1.5"
+    )
+
+    assert shape == "Products named $1 bought after $2 by more than $3 students at $4"
+    assert values == ["pen 2", "2024-01-31", "3", "1.5"]
+    assert kinds == ["str", "date", "int", "number"]
+
+
+def test_extract_literals_keeps_words_and_identifiers():
+    shape, values, _ = extract_literals("Top products of classroom_2 in v1.2")
+    assert shape == "Top products of classroom_2 in v1.2"
+    assert values == []
+
+
+def test_questions_of_the_same_shape_share_it():
+    assert extract_literals("Students in 'Classroom A'")[0] == extract_literals(
+        "Students in 'Classroom B'"
+    )[0]
+
+
+@pytest.mark.parametrize(
+    "query, count, expected",
+    [
+        ("SELECT * FROM t WHERE a = $1 AND b = $2", 2, True),
+        ("SELECT * FROM t WHERE a = $1 OR b = $1", 1, True),
+        ("SELECT * FROM t WHERE a = $1", 2, False),
+        ("SELECT * FROM t WHERE a = $2", 1, False),
+    ],
+)
+def test_is_parameterized(query, count, expected):
+    assert is_parameterized(query, count) is expected
+
+
+def test_coerce_arguments_falls_back_to_strings():
+    assert coerce_arguments(
+        ["int4", "numeric", "date", "bool", "int4", "text"],
+        ["3", "1.50", "2024-01-31", "yes", "three", "pen"],
+    ) == [3, Decimal("1.50"), datetime.date(2024, 1, 31), True, "three", "pen"]
+
+
+@pytest.mark.asyncio
+async def test_bind_arguments_uses_the_inferred_parameter_types(database):
+    database.types = ["int8", "float8"]
+    assert await bind_arguments(database, "SELECT $1::int8, $2::float8", ["7", "2.5"]) == [7, 2.5]
+    assert await bind_arguments(database, "SELECT 1", []) == []
@@ -0,0 +1,126 @@
+import asyncio
+import email.utils
+import time
+
+import httpx
+import pytest
+
+from throttling import RateLimiter, SingleFlight, TokenBucket, retry_after
+
+
+def response(status=200, headers=None, json=None):
+    request = httpx.Request("POST", "http://test")
+    return httpx.Response(status, headers=headers, json=json, request=request)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"x-ms-retry-after-ms": "250"}, 0.25),
+        ({"retry-after": "3"}, 3.0),
+        ({"retry-after": "soon"}, None),
+        ({}, None),
+    ],
+)
+def test_retry_after(headers, expected):
+    assert retry_after(response(429, headers)) == expected
+
+
+def test_retry_after_http_date():
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 < retry_after(response(429, {"retry-after": date})) <= 30
+
+
+def test_token_bucket_bursts_then_waits_for_refill():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+
+    bucket.give(30)
+    assert bucket.wait_time(30) == 0
+    # Requests larger than the bucket wait for a full bucket instead of forever.
+    assert bucket.wait_time(1000) == pytest.approx(30.0, abs=0.1)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    results = await asyncio.gather(*(flight.run("key", call) for _ in range(5)))
+    assert results == ["answer"] * 5
+    assert len(calls) == 1
+    assert flight.coalesced == 4
+    assert not flight.calls
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_a_cancelled_caller():
+    flight = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    first = asyncio.create_task(flight.run("key", call))
+    second = asyncio.create_task(flight.run("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "answer"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_retries_throttled_requests_and_settles_usage():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    answers = [
+        response(429, {"retry-after-ms": "10"}),
+        response(json={"usage": {"total_tokens": 40}}),
+    ]
+
+    async def request():
+        answer = answers.pop(0)
+        answer.raise_for_status()
+        return answer.json()
+
+    assert await limiter.call(request, tokens=300) == {"usage": {"total_tokens": 40}}
+    assert limiter.throttled == 1
+    assert limiter.retries == 1
+    assert limiter.tokens.level == pytest.approx(960, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_does_not_retry_client_errors():
+    limiter = RateLimiter(max_retries=3)
+
+    async def request():
+        response(400).raise_for_status()
+
+    with pytest.raises(httpx.HTTPStatusError):
+        await limiter.call(request)
+    assert limiter.retries == 0
+
+
+@pytest.mark.asyncio
+async def test_reserve_settles_with_the_reported_usage():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    async with limiter.reserve(300) as usage:
+        assert limiter.tokens.level == pytest.approx(700, abs=1)
+        usage.update(total_tokens=50)
+    assert limiter.tokens.level == pytest.approx(950, abs=1)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        async with limiter.reserve(300):
+            response(429, {"retry-after": "5"}).raise_for_status()
+    assert limiter.throttled == 1
+    assert limiter.paused_until > time.monotonic() + 4
+    assert limiter.tokens.level == pytest.approx(950, abs=1)